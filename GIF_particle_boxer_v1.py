@@ -15,6 +15,9 @@
         Middle click = Hide all particle/highlights to see clean image
         Right click = Activate erase brush, hold & drag to erase on-the-fly
         Mouse scrollwheel = Increase/decrease eraser tool brush
+        +/- or Ctrl + scrollwheel = Zoom in/out of the .MRC at the mouse position (needs the .MRC next to the .GIF)
+        Shift + left click & drag = Pan the zoomed image
+        u / o = Go to the next image without particles / with too many particles (see otf_boxindex.py)
 """
 
 ##########################
@@ -25,6 +28,11 @@ from tkinter import *
 from tkinter.filedialog import askopenfilename
 from tkinter.messagebox import showerror
 import os
+import base64
+import collections
+
+import otf_boxindex
+import otf_packstore
 
 class Gui:
     def __init__(self, master):
@@ -45,6 +53,11 @@ class Gui:
         dropdown_file.add_command(label="Load marked filelist", command=self.load_marked_filelist)
         # dropdown_file.add_command(label="Import .box coordinates", command=self.load_boxfile_coords)
         dropdown_file.add_command(label="Print marked imgs (Ctrl+S)", command=self.write_marked)
+        dropdown_file.add_command(label="Auto-pick particles (Ctrl+P)", command=self.auto_pick)
+        dropdown_file.add_command(label="Next unpicked image (U)", command=lambda: self.next_by_count('unpicked'))
+        dropdown_file.add_command(label="Next over-picked image (O)", command=lambda: self.next_by_count('over-picked'))
+        self.sort_by_count = BooleanVar(value=False)
+        dropdown_file.add_checkbutton(label="Sort images by particle count", variable=self.sort_by_count, command=self.sort_images)
         dropdown_file.add_command(label="Exit", command=self.menu_exit)
 
         ## Widgets
@@ -63,6 +76,7 @@ class Gui:
         self.input_angpix.insert(END, "%s" % angpix)
         self.box_size_ang_label = Label(master, font=("Helvetica", 11), text="Box size:")
         self.box_size_ang = Label(master, font=("Helvetica italic", 10), text="%s Angstroms" % (box_size * angpix))
+        self.particle_count = Label(master, font=("Helvetica", 11), text="")
 
         ## Widget layout
         self.input_text.grid(row=0, column=0, sticky=NW, padx=5, pady=5)
@@ -76,6 +90,7 @@ class Gui:
         self.input_angpix.grid(row=10, column=1, padx=5, pady=0, sticky=(N, W))
         self.box_size_ang_label.grid(row=13, column=1, padx=5, pady=0, sticky=S)
         self.box_size_ang.grid(row=14, column=1, padx=5, pady=0, sticky=N)
+        self.particle_count.grid(row=17, column=1, padx=5, pady=0, sticky=N)
         self.browse.grid(row=100, column=1, sticky=(S, E))
 
 
@@ -93,6 +108,19 @@ class Gui:
         self.input_angpix.bind('<Return>', lambda event: self.new_angpix())
         self.input_mrc_box_size.bind('<KP_Enter>', lambda event: self.new_box_size()) # numpad 'Return' key
         self.canvas.bind('<Control-KeyRelease-s>', lambda event: self.write_marked())
+        self.canvas.bind('<Control-KeyRelease-p>', lambda event: self.auto_pick())
+        self.canvas.bind('<u>', lambda event: self.next_by_count('unpicked'))
+        self.canvas.bind('<o>', lambda event: self.next_by_count('over-picked'))
+        self.canvas.bind('<plus>', lambda event: self.zoom(1, event))
+        self.canvas.bind('<equal>', lambda event: self.zoom(1, event))
+        self.canvas.bind('<KP_Add>', lambda event: self.zoom(1, event))
+        self.canvas.bind('<minus>', lambda event: self.zoom(-1, event))
+        self.canvas.bind('<KP_Subtract>', lambda event: self.zoom(-1, event))
+        self.canvas.bind('<Control-MouseWheel>', lambda event: self.zoom(1 if event.delta > 0 else -1, event)) # Windows, Mac
+        self.canvas.bind('<Control-Button-4>', lambda event: self.zoom(1, event)) # Linux
+        self.canvas.bind('<Control-Button-5>', lambda event: self.zoom(-1, event))
+        self.canvas.bind('<Shift-ButtonPress-1>', self.start_pan)
+        self.canvas.bind('<Shift-B1-Motion>', self.pan)
         self.canvas.bind("<ButtonPress-1>", self.on_button_press)
         self.canvas.bind("<ButtonPress-2>", self.on_middle_mouse_press)
         self.canvas.bind("<ButtonRelease-2>", self.on_middle_mouse_release)
@@ -107,6 +135,10 @@ class Gui:
 
         self.master.protocol("WM_DELETE_WINDOW", self.menu_exit)
 
+        ## PhotoImages of the .MRC tiles shown recently when zoomed, { (level, tx, ty) : PhotoImage }
+        self.tile_images = collections.OrderedDict()
+        self.pan_start = (0, 0)
+
         ## Run function to check for settings files and, if present load them into variables
         self.load_settings()
 
@@ -340,6 +372,7 @@ class Gui:
             erase_coordinates = [] # avoid changing dictionary until after iteration complete
             ## find all coordinates that clash with the brush
             if len(image_coordinates) > 0:
+                x_min, x_max, y_min, y_max = self.brush_on_gif(x, y)
                 for coord in image_coordinates:
                     if self.check_if_two_ranges_intersect(coord[0], coord[0] + gif_box_size, x_min, x_max): # x0, x1, y0, y1
                         if self.check_if_two_ranges_intersect(coord[1], coord[1] - gif_box_size, y_min, y_max): # x0, x1, y0, y1
@@ -367,6 +400,7 @@ class Gui:
         erase_coordinates = [] # avoid changing dictionary until after iteration complete
         ## find all coordinates that clash with the brush
         if len(image_coordinates) > 0:
+            x_min, x_max, y_min, y_max = self.brush_on_gif(x, y)
             for coord in image_coordinates:
                 if self.check_if_two_ranges_intersect(coord[0], coord[0] + gif_box_size, x_min, x_max): # x0, x1, y0, y1
                     if self.check_if_two_ranges_intersect(coord[1], coord[1] - gif_box_size, y_min, y_max): # x0, x1, y0, y1
@@ -398,7 +432,7 @@ class Gui:
         return
 
     def save_boxfile(self):
-        global image_list, n, image_coordinates, box_size, gif_box_size, gif_pixel_size_x, mrc_pixel_size_x, mrc_pixel_size_y
+        global image_list, n, image_coordinates, box_size, gif_box_size, gif_pixel_size_x, mrc_pixel_size_x, mrc_pixel_size_y, file_dir
 
         # avoid bugging out when hitting 'next img' and no image is currently loaded
         try:
@@ -408,38 +442,276 @@ class Gui:
 
                 with open(current_img_base_name + '.box', 'w') as boxfile : # NOTE: 'w' overwrites existing file; as compared to 'a' which appends only
                     for gif_coord in image_coordinates:
-                        mrc_coord = image_coordinates[gif_coord]
-                        ## new points added on the .GIF with no corresponding .MRC coordinate must interpolate to map the .GIF coordinate onto .MRC
-                        ## NOTE: This remapping is imprecise due to uncompression error
-                        if mrc_coord == 'new_point':
-                            # print(gif_pixel_size_x, gif_pixel_size_y, mrc_pixel_size_x, mrc_pixel_size_y, box_size)
-                            shrinkFactor_mrc2gif = gif_pixel_size_x / mrc_pixel_size_x
-                            #### interpolate .MRC coordinate from .GIF position
-                            mrc_x = int( gif_coord[0] / shrinkFactor_mrc2gif )
-                            mrc_y = int( mrc_pixel_size_y - gif_coord[1] / shrinkFactor_mrc2gif )
-                            # gif_box_size = int(box_size * shrinkFactor_mrc2gif)
-                            boxfile.write("%s     %s    %s    %s\n" % (mrc_x, mrc_y, box_size, box_size) )
-                        else: # if point is not new, we can just write the original corresponding mrc_coordinate back into the file
-                            boxfile.write("%s     %s    %s    %s\n" % (mrc_coord[0], mrc_coord[1], box_size, box_size) )
+                        mrc_x, mrc_y = self.box_coordinate(gif_coord)
+                        boxfile.write("%s     %s    %s    %s\n" % (mrc_x, mrc_y, box_size, box_size) )
+                self.get_box_index(file_dir).update(current_img_base_name + '.box')
         except:
             pass
         return
 
+    def box_coordinate(self, gif_coord):
+        """ The .MRC (.box file) coordinate of a box, given its key in image_coordinates
+        """
+        global image_coordinates, gif_pixel_size_x, mrc_pixel_size_x, mrc_pixel_size_y
+        mrc_coord = image_coordinates[gif_coord]
+        ## new points added on the .GIF with no corresponding .MRC coordinate must interpolate to map the .GIF coordinate onto .MRC
+        ## NOTE: This remapping is imprecise due to uncompression error
+        if mrc_coord == 'new_point':
+            shrinkFactor_mrc2gif = gif_pixel_size_x / mrc_pixel_size_x
+            #### interpolate .MRC coordinate from .GIF position
+            mrc_x = int( gif_coord[0] / shrinkFactor_mrc2gif )
+            mrc_y = int( mrc_pixel_size_y - gif_coord[1] / shrinkFactor_mrc2gif )
+            return mrc_x, mrc_y
+        else: # if point is not new, we can just use the original corresponding mrc_coordinate
+            return mrc_coord
+
+    def view_scale(self):
+        """ Canvas pixels per .GIF pixel at the current zoom level (1 when the .GIF is shown)
+        """
+        global zoom_level, gif_pixel_size_x, mrc_pixel_size_x
+        if zoom_level is None:
+            return 1
+        return mrc_pixel_size_x / (2 ** zoom_level * gif_pixel_size_x)
+
+    def canvas_to_mrc(self, x, y):
+        """ Map a canvas position to .MRC pixel coordinates (y = 0 at the bottom), exact when zoomed
+        """
+        global zoom_level, view_origin, gif_pixel_size_x, mrc_pixel_size_x, mrc_pixel_size_y
+        if zoom_level is None:
+            shrinkFactor_mrc2gif = gif_pixel_size_x / mrc_pixel_size_x
+            return x / shrinkFactor_mrc2gif, mrc_pixel_size_y - y / shrinkFactor_mrc2gif
+        return view_origin[0] + x * 2 ** zoom_level, view_origin[1] - y * 2 ** zoom_level
+
+    def mrc_to_canvas(self, mrc_x, mrc_y):
+        global zoom_level, view_origin, gif_pixel_size_x, mrc_pixel_size_x, mrc_pixel_size_y
+        if zoom_level is None:
+            shrinkFactor_mrc2gif = gif_pixel_size_x / mrc_pixel_size_x
+            return mrc_x * shrinkFactor_mrc2gif, (mrc_pixel_size_y - mrc_y) * shrinkFactor_mrc2gif
+        return (mrc_x - view_origin[0]) / 2 ** zoom_level, (view_origin[1] - mrc_y) / 2 ** zoom_level
+
+    def canvas_to_gif(self, x, y):
+        """ Map a canvas position to .GIF pixel coordinates (the keys of image_coordinates)
+        """
+        global zoom_level, gif_pixel_size_x, gif_pixel_size_y, mrc_pixel_size_x
+        if zoom_level is None:
+            return x, y
+        shrinkFactor_mrc2gif = gif_pixel_size_x / mrc_pixel_size_x
+        mrc_x, mrc_y = self.canvas_to_mrc(x, y)
+        return mrc_x * shrinkFactor_mrc2gif, gif_pixel_size_y - mrc_y * shrinkFactor_mrc2gif
+
+    def brush_on_gif(self, x, y):
+        """ Extent (x_min, x_max, y_min, y_max) in .GIF pixels of the erase brush at a canvas position
+        """
+        global brush_size
+        gif_x, gif_y = self.canvas_to_gif(x, y)
+        half_brush = brush_size / 2 / self.view_scale()
+        return int(gif_x - half_brush), int(gif_x + half_brush), int(gif_y - half_brush), int(gif_y + half_brush)
+
+    def load_pyramid(self):
+        """ Open the tile pyramid of the .MRC of the current image (see otf_pyramid.py), returns None if there is no .MRC
+        """
+        global pyramid, image_list, n, file_dir, mrc_pixel_size_x, mrc_pixel_size_y, image_coordinates
+        mrc = os.path.splitext(file_dir + "/" + image_list[n])[0] + '.mrc'
+        if pyramid is not None and pyramid.path == mrc:
+            return pyramid
+        pyramid = None
+        self.tile_images.clear()
+        if not os.path.exists(mrc):
+            print(">> No .MRC found for %s, zoom needs the .MRC next to the .GIF" % image_list[n])
+            return None
+        try:
+            import otf_pyramid
+            pyramid = otf_pyramid.TilePyramid(mrc)
+        except (ImportError, IOError, ValueError) as e:
+            print(" !!! ERROR: cannot read %s for zooming: %s" % (mrc, e))
+            return None
+        ## the tiles are placed with the real .MRC dimensions
+        if (mrc_pixel_size_x, mrc_pixel_size_y) != (pyramid.nx, pyramid.ny):
+            print(">> .MRC dimensions updated from %s: %s, %s" % (os.path.basename(mrc), pyramid.nx, pyramid.ny))
+            if len(image_coordinates) > 0:
+                self.save_boxfile()
+            mrc_pixel_size_x, mrc_pixel_size_y = pyramid.nx, pyramid.ny
+            image_coordinates = {} ## remapped from the .box file with the new dimensions by load_img()
+        return pyramid
+
+    def zoom(self, direction, event):
+        """ Zoom in (direction = 1) or out (-1) of the .MRC one power of 2 at a time, keeping the point under the mouse
+            in place. Zooming out past the first level shows the .GIF again.
+        """
+        global zoom_level, view_origin, gif_pixel_size_x, mrc_pixel_size_x, n
+        if self.load_pyramid() is None:
+            return
+        mrc_x, mrc_y = self.canvas_to_mrc(event.x, event.y)
+        ## finest level still coarser than the .GIF, i.e. the first level that shows more than the .GIF
+        shrinkFactor_mrc2gif = gif_pixel_size_x / mrc_pixel_size_x
+        first_level = 0
+        while 2 ** -(first_level + 1) > shrinkFactor_mrc2gif:
+            first_level += 1
+        if zoom_level is None:
+            new_level = first_level if direction > 0 else None
+        else:
+            new_level = zoom_level - direction
+            if new_level > first_level:
+                new_level = None
+            new_level = max(0, new_level) if new_level is not None else None
+        zoom_level = new_level
+        if zoom_level is not None:
+            view_origin = (mrc_x - event.x * 2 ** zoom_level, mrc_y + event.y * 2 ** zoom_level)
+        self.load_img(n)
+        return
+
+    def start_pan(self, event):
+        self.pan_start = (event.x, event.y)
+        return
+
+    def pan(self, event):
+        global zoom_level, view_origin
+        if zoom_level is None:
+            return
+        dx, dy = event.x - self.pan_start[0], event.y - self.pan_start[1]
+        self.pan_start = (event.x, event.y)
+        view_origin = (view_origin[0] - dx * 2 ** zoom_level, view_origin[1] + dy * 2 ** zoom_level)
+        self.canvas.delete('particle_positions')
+        self.draw_tiles()
+        self.draw_image_coordinates()
+        return
+
+    def tile_image(self, level, tx, ty):
+        """ PhotoImage of a tile of the pyramid, made when first shown and kept for the most recent tiles only
+        """
+        key = (level, tx, ty)
+        if key in self.tile_images:
+            self.tile_images.move_to_end(key)
+            return self.tile_images[key]
+        self.tile_images[key] = PhotoImage(data=base64.b64encode(pyramid.tile_gif(level, tx, ty)), format='gif')
+        while len(self.tile_images) > 256:
+            self.tile_images.popitem(last=False)
+        return self.tile_images[key]
+
+    def draw_tiles(self):
+        """ Cover the canvas with the tiles of the .MRC visible at the current zoom level, only these are read
+        """
+        global zoom_level, view_origin, gif_pixel_size_x, gif_pixel_size_y, pyramid
+        self.canvas.delete('tiles')
+        scale = 2 ** zoom_level
+        x0, y1 = view_origin
+        x1, y0 = x0 + gif_pixel_size_x * scale, y1 - gif_pixel_size_y * scale
+        for tx, ty in pyramid.visible_tiles(zoom_level, x0, y0, x1, y1):
+            tile_x0, tile_y0, tile_x1, tile_y1 = pyramid.tile_bounds(zoom_level, tx, ty)
+            canvas_x, canvas_y = self.mrc_to_canvas(tile_x0, tile_y1) # top left corner
+            self.canvas.create_image(int(round(canvas_x)), int(round(canvas_y)), anchor=NW, image=self.tile_image(zoom_level, tx, ty), tags='tiles')
+        ## keep the markup above the tiles
+        self.canvas.tag_raise('marker')
+        self.canvas.tag_raise('particle_positions')
+        return
+
     def on_button_press(self, event):
-        global image_coordinates, gif_box_size, n
-        mouse_position = event.x, event.y
+        global image_coordinates, gif_box_size, n, box_size, gif_pixel_size_x, mrc_pixel_size_x
+        mouse_position = self.canvas_to_gif(event.x, event.y)
         # print("Mouse pressed at position: x, y =", mouse_position[0], mouse_position[1])
 
         ## when clicking, check the mouse position against loaded coordinates to figure out if the user is removing a point or adding a point
         if self.is_clashing(mouse_position): # this function will also remove the point if True
             pass
-        else:
+        elif zoom_level is None:
             x_coord = mouse_position[0] - int(gif_box_size / 2)
             y_coord = mouse_position[1] + int(gif_box_size / 2)
             image_coordinates[(x_coord, y_coord)] = 'new_point'
+        else:
+            ## when zoomed, the point is picked directly on the .MRC
+            mrc_x, mrc_y = self.canvas_to_mrc(event.x, event.y)
+            mrc_coord = (int(round(mrc_x - box_size / 2)), int(round(mrc_y - box_size / 2)))
+            gif_x, gif_y = self.canvas_to_gif(*self.mrc_to_canvas(*mrc_coord))
+            image_coordinates[(int(gif_x), int(gif_y))] = mrc_coord
+            gif_box_size = int(box_size * gif_pixel_size_x / mrc_pixel_size_x) # as in map_box2gif(), for the .GIF view
         ## redraw data on screen
         self.load_img(n)
 
+    def auto_pick(self):
+        """ Run the auto-picker (otf_autopick.py) on the current image at the current box size and pixel size, adding
+            its picks to the coordinates already present (picks overlapping them are dropped)
+        """
+        global image_list, n, file_dir, box_size, angpix, mrc_pixel_size_x, mrc_pixel_size_y, image_coordinates
+        if not box_size > 0:
+            showerror("Auto-pick", "Set the .MRC pixel box size first")
+            return
+        try:
+            import otf_autopick
+        except ImportError as e:
+            showerror("Auto-pick", "Auto-picking needs NumPy (%s)" % e)
+            return
+        ## write out the current coordinates first, the picker adds to the .box file
+        if len(image_coordinates) > 0:
+            self.save_boxfile()
+        settings = otf_autopick.default_settings()
+        settings.update({ 'box_size' : box_size, 'angpix' : angpix, 'mrc_size' : (mrc_pixel_size_x, mrc_pixel_size_y), 'existing' : 'merge' })
+        try:
+            picks = otf_autopick.pick_micrograph(os.path.join(file_dir, image_list[n]), settings)
+        except (IOError, ValueError) as e:
+            showerror("Auto-pick", "Failed to pick %s\n%s" % (image_list[n], e))
+            return
+        print(">> %s particles auto-picked" % len(picks))
+        self.get_box_index(file_dir).update(os.path.splitext(os.path.join(file_dir, image_list[n]))[0] + '.box')
+        ## reload the coordinates from the updated .box file
+        self.reset_globals()
+        self.load_img(n)
+        self.canvas.focus_set()
+        return
+
+    def get_box_index(self, directory):
+        """ Index of the particle counts of the .box files in a directory (see otf_boxindex.py), read when first needed
+        """
+        global box_index
+        if box_index is None or box_index.directory != directory:
+            box_index = otf_boxindex.BoxIndex(directory)
+            box_index.refresh()
+        return box_index
+
+    def update_particle_count(self):
+        global image_coordinates, image_list, file_dir
+        particles, picked = self.get_box_index(file_dir).totals()
+        self.particle_count.config(text="%s particles\n(%s on %s of %s images)" % (len(image_coordinates), particles, picked, len(image_list)))
+        return
+
+    def next_by_count(self, kind):
+        """ Go to the next image without particles (kind = 'unpicked') or with more than twice the median number of
+            particles per picked image ('over-picked'), as listed in the .box file index
+        """
+        global n, image_list, image_coordinates, file_dir
+        ## save particles into boxfile, if coordinates are present
+        if len(image_coordinates) > 0:
+            self.save_boxfile()
+        index = self.get_box_index(file_dir)
+        index.refresh()
+        limit = index.over_picked_limit()
+        for step in range(1, len(image_list) + 1):
+            i = (n + step) % len(image_list)
+            count = index.count(image_list[i])
+            if (kind == 'unpicked' and count == 0) or (kind == 'over-picked' and limit is not None and count > limit):
+                n = i
+                self.reset_globals()
+                self.load_img(n)
+                return
+        print(">> No %s images" % kind)
+        return
+
+    def sort_images(self):
+        """ Reload the image list (sorted by particle count if selected), staying on the current image
+        """
+        global n, image_list, file_dir, image_coordinates
+        if len(image_list) == 0:
+            return
+        if len(image_coordinates) > 0:
+            self.save_boxfile()
+        current_img = image_list[n]
+        image_list = []
+        image_list = self.images_in_dir(file_dir)
+        if current_img in image_list:
+            n = image_list.index(current_img)
+        self.load_img(n)
+        self.canvas.focus_set()
+        return
+
     def is_clashing(self, mouse_position):
         """ mouse_position = tuple of form (x, y)
         """
@@ -486,6 +758,7 @@ class Gui:
         global file_dir, file_name, image_list, n, marked_imgs, particle_coordinates
         # See: https://stackoverflow.com/questions/9239514/filedialog-tkinter-and-opening-files
         fname = askopenfilename(parent=self.master, initialdir=".", title='Select file', filetypes=(("Graphics interchange format", "*.gif"),
+                                           ("Packed previews", "*.pack"),
                                            # ("Joint photographic experts group", "*.jpeg;*.jpg"),
                                            ("All files", "*.*") ))
         if fname:
@@ -504,8 +777,11 @@ class Gui:
                 marked_imgs = []
                 particle_coordinates = []
 
-                # find the index of the selected image in the new list
-                n = image_list.index(file_name)
+                # find the index of the selected image in the new list (the first image if a preview pack was selected)
+                if file_name == otf_packstore.PACK_NAME:
+                    n = 0
+                else:
+                    n = image_list.index(file_name)
 
                 ## redraw canvas items with updated global values as the given image index
                 self.load_img(n)
@@ -521,9 +797,10 @@ class Gui:
             return
 
     def reset_globals(self):
-        global image_coordinates, gif_box_size
+        global image_coordinates, gif_box_size, zoom_level
         image_coordinates = {}
         gif_box_size = 0
+        zoom_level = None
         return
 
     def next_img(self, direction):
@@ -578,8 +855,12 @@ class Gui:
         self.input_text.delete(0,END)
         self.input_text.insert(0,image_list[n])
 
-        # load image onto canvas object using PhotoImage
-        self.current_img = PhotoImage(file=image_w_path)
+        # load image onto canvas object using PhotoImage, from the preview pack of the directory if the image is packed (see otf_packstore.py)
+        packed = otf_packstore.read_preview(image_w_path, file_dir)
+        if packed is not None:
+            self.current_img = PhotoImage(data=base64.b64encode(packed), format='gif')
+        else:
+            self.current_img = PhotoImage(file=image_w_path)
         self.display = self.canvas.create_image(0, 0, anchor=NW, image=self.current_img)
         self.canvas.display = self.display
 
@@ -589,6 +870,10 @@ class Gui:
         gif_pixel_size_x = x
         gif_pixel_size_y = y
 
+        ## when zoomed, show the .MRC tiles over the .GIF
+        if zoom_level is not None and self.load_pyramid() is not None:
+            self.draw_tiles()
+
         # add an inset red border to the canvas depending if the file name exists in a given list
         current_img = image_list[n]
         if current_img in marked_imgs:
@@ -603,6 +888,7 @@ class Gui:
 
         self.update_input_widgets()
         self.draw_image_coordinates()
+        self.update_particle_count()
         return
 
     def is_image(self, file):
@@ -622,6 +908,15 @@ class Gui:
         for file in os.listdir(path):
             if self.is_image(file):
                 image_list.append(file)
+        ## images packed by 'otf_pipeline.py --pack-previews' (the CTF .GIFs are in a subdirectory of the pack)
+        store = otf_packstore.open_store(path)
+        if store is not None:
+            listed = set(image_list)
+            image_list.extend(name for name in store.names() if self.is_image(name) and '/' not in name and name not in listed)
+        if self.sort_by_count.get():
+            index = self.get_box_index(path)
+            index.refresh()
+            image_list.sort(key=index.count)
         return image_list
 
     def choose_img(self):
@@ -729,13 +1024,19 @@ class Gui:
         """ Read the global variable list of coordinates with gif and box files associated via a dictionary format, draw all gif coordinates present (regardless if they have associated box coordinates.
             Coordinates are drawn with the input coordinate assumed to be the bottom-left of a box with width/height equal to the global gif_box_size value
         """
-        global image_coordinates, gif_box_size
+        global image_coordinates, gif_box_size, box_size
 
         for coordinate in image_coordinates: # each key in image_coordinates is a gif-friendly coordinate
-            x0 = coordinate[0]
-            y0 = coordinate[1]
-            x1 = x0 + gif_box_size
-            y1 = y0 - gif_box_size # invert direction of box to take into account x0,y0 are at bottom left, not top left
+            if zoom_level is None:
+                x0 = coordinate[0]
+                y0 = coordinate[1]
+                x1 = x0 + gif_box_size
+                y1 = y0 - gif_box_size # invert direction of box to take into account x0,y0 are at bottom left, not top left
+            else:
+                ## when zoomed, draw the exact .MRC box
+                mrc_x, mrc_y = self.box_coordinate(coordinate)
+                x0, y0 = self.mrc_to_canvas(mrc_x, mrc_y)
+                x1, y1 = self.mrc_to_canvas(mrc_x + box_size, mrc_y + box_size)
             self.canvas.create_rectangle(x0, y0, x1, y1, outline='red', width=1, tags='particle_positions')
 
 
@@ -770,6 +1071,12 @@ if __name__ == '__main__':
 
     brush_size = 20 # size of erase brush
 
+    zoom_level = None # None = show the .GIF, otherwise the level of the .MRC tile pyramid shown (1 canvas pixel = 2**zoom_level .MRC pixels)
+    view_origin = (0, 0) # .MRC coordinates (x, y) of the top left corner of the canvas when zoomed
+    pyramid = None # tile pyramid of the current .MRC, see otf_pyramid.py
+
+    box_index = None # particle counts of the .box files in the image directory, see otf_boxindex.py
+
     root = Tk()
     app = Gui(root)
     root.mainloop()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to catch slow-downs in the Python hot paths of the viewers before a collection session.
+
+""" Micro-benchmarks of the Python hot paths in on-the-fly_logviewer.py and GIF_particle_boxer_v1.py, run on synthetic
+    data of a configurable size without opening any window (the Tk canvas is replaced by a stand-in that only counts
+    calls). Each result is the best time per call, in milliseconds.
+        $ bench_hotpaths.py --entries 5000 --particles 500 --files 20000 --save hotpaths.json
+        $ bench_hotpaths.py --compare hotpaths.json
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+import os
+import sys
+import types
+import random
+import shutil
+import timeit
+import argparse
+import tempfile
+import contextlib
+import collections
+import importlib.util
+
+import bench_util
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def load_script(file_name, module_name):
+    """ Import one of the top level scripts (their file names are not valid module names)
+    """
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(bench_util.REPO_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeCanvas:
+    """ Stands in for the Tk canvas, so only the Python side of each call is timed
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def delete(self, *args):
+        self.calls += 1
+
+    def create_rectangle(self, *args, **kwargs):
+        self.calls += 1
+        return self.calls
+
+class FakeEvent:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+def bind(instance, function):
+    return types.MethodType(function, instance)
+
+def write_logfile(path, entries):
+    with open(path, 'w') as f:
+        f.write("## Motion_corrected_images= on-the-fly_processing/ \n")
+        f.write("## CTF_fit_images= on-the-fly_processing/CTF/ \n")
+        f.write("## \n")
+        for i in range(1, entries + 1):
+            f.write("%-38s %-14s %-14s\n" % ("   Bench_Corr_%04d.mrc" % i, "%0.1f" % random.uniform(3, 12), "%0.2f" % random.uniform(0.5, 4)))
+
+def write_boxfile(path, particles, mrc_size, box_size):
+    with open(path, 'w') as f:
+        for i in range(particles):
+            f.write("%s     %s    %s    %s\n" % (random.randint(0, mrc_size - box_size), random.randint(box_size, mrc_size), box_size, box_size))
+
+def best_ms(function, number, repeat = 5):
+    return 1000 * min(timeit.repeat(function, number = number, repeat = repeat)) / number
+
+def run_benchmarks(work_dir, entries, particles, files):
+    logviewer = load_script('on-the-fly_logviewer.py', 'otf_logviewer')
+    boxer = load_script('GIF_particle_boxer_v1.py', 'gif_particle_boxer')
+    results = collections.OrderedDict()
+    random.seed(0)
+
+    ## logviewer: parse_logfile (a fresh load, and the re-parse run on every key press)
+    logfile = os.path.join(work_dir, 'on-the-fly_data.log')
+    write_logfile(logfile, entries)
+    logviewer.n = 1
+    logviewer.img_prefix = 'stack_'
+    def parse_fresh():
+        logviewer.log_data = {}
+        logviewer.parsed_logfile = None
+        logviewer.logfile_offset = 0
+        logviewer.Gui.parse_logfile(None, logfile)
+    results['logviewer.parse_logfile_fresh_ms'] = best_ms(parse_fresh, 5)
+    results['logviewer.parse_logfile_reparse_ms'] = best_ms(lambda: logviewer.Gui.parse_logfile(None, logfile), 5)
+
+    ## logviewer: write_marked with every marked image already present in the file
+    marked_file = os.path.join(work_dir, 'bad_mics.txt')
+    logviewer.marked_imgs = ["Bench_Corr_%04d" % i for i in range(1, entries + 1, 3)]
+    with open(marked_file, 'w') as f:
+        for marked_img in logviewer.marked_imgs:
+            f.write("%s\n" % marked_img.split('_')[-1])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results['logviewer.write_marked_ms'] = best_ms(lambda: logviewer.Gui.write_marked_list(None, logviewer.marked_imgs, marked_file), 3)
+
+    ## boxer: particle coordinates of one micrograph
+    mrc_size, gif_size, box_size = 4096, 800, 160
+    boxfile = os.path.join(work_dir, 'Bench_0001.box')
+    write_boxfile(boxfile, particles, mrc_size, box_size)
+    boxer.mrc_pixel_size_x = boxer.mrc_pixel_size_y = mrc_size
+    boxer.gif_pixel_size_x = boxer.gif_pixel_size_y = gif_size
+    boxer.box_size = box_size
+    boxer.zoom_level = None
+    fake = types.SimpleNamespace(canvas = FakeCanvas())
+    fake.check_if_two_ranges_intersect = bind(fake, boxer.Gui.check_if_two_ranges_intersect)
+    fake.brush_on_gif = bind(fake, boxer.Gui.brush_on_gif)
+    fake.canvas_to_gif = bind(fake, boxer.Gui.canvas_to_gif)
+    fake.view_scale = bind(fake, boxer.Gui.view_scale)
+    fake.box_coordinate = bind(fake, boxer.Gui.box_coordinate)
+    fake.sort_by_count = types.SimpleNamespace(get = lambda: False)
+    fake.draw_image_coordinates = bind(fake, boxer.Gui.draw_image_coordinates)
+    fake.is_image = bind(fake, boxer.Gui.is_image)
+    fake.save_boxfile = bind(fake, boxer.Gui.save_boxfile)
+    results['boxer.map_box2gif_ms'] = best_ms(lambda: boxer.Gui.map_box2gif(fake, boxfile), 20)
+
+    ## a click/brush away from every particle, so each call scans all coordinates and the set stays unchanged
+    boxer.image_coordinates = { (x, y) : v for (x, y), v in boxer.image_coordinates.items() if x > 40 or y < gif_size - 40 }
+    results['boxer.is_clashing_miss_ms'] = best_ms(lambda: boxer.Gui.is_clashing(fake, (1, 1)), 200)
+    boxer.RIGHT_MOUSE_PRESSED = True
+    boxer.brush_size = 20
+    results['boxer.delete_brush_cursor_ms'] = best_ms(lambda: boxer.Gui.delete_brush_cursor(fake, FakeEvent(1, 1)), 50)
+
+    ## boxer: listing a directory of .GIF images
+    image_dir = os.path.join(work_dir, 'images')
+    os.makedirs(image_dir)
+    for i in range(1, files + 1):
+        open(os.path.join(image_dir, 'Bench_%05d.gif' % i), 'w').close()
+        if i % 2 == 0:
+            open(os.path.join(image_dir, 'Bench_%05d.box' % i), 'w').close()
+    def list_images():
+        boxer.image_list = []
+        boxer.Gui.images_in_dir(fake, image_dir)
+    results['boxer.images_in_dir_ms'] = best_ms(list_images, 3)
+
+    ## boxer: write_marked with every marked image already present in the file
+    boxer.marked_imgs = ['Bench_%05d.gif' % i for i in range(1, files + 1, 3)]
+    boxer.image_coordinates = {}
+    marked_file = os.path.join(work_dir, 'marked_imgs.txt')
+    with open(marked_file, 'w') as f:
+        for marked_img in boxer.marked_imgs:
+            f.write("%s\n" % marked_img)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results['boxer.write_marked_ms'] = best_ms(lambda: boxer.Gui.write_marked(fake, marked_file), 3)
+    return results
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Micro-benchmarks of the Python hot paths of the viewers")
+    parser.add_argument('--entries', type = int, default = 5000, help = "log file entries")
+    parser.add_argument('--particles', type = int, default = 500, help = "particles in the .box file")
+    parser.add_argument('--files', type = int, default = 10000, help = ".GIF files in the image directory")
+    parser.add_argument('--save', default = None, help = "save results as a baseline .json")
+    parser.add_argument('--compare', default = None, help = "compare results against a baseline .json")
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = "allowed slow-down before a regression is reported")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix = 'otf_hotpaths_')
+    try:
+        results = run_benchmarks(work_dir, args.entries, args.particles, args.files)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    bench_util.print_results("Hot path micro-benchmarks (best time per call)", results,
+                             units = { name : 'ms' for name in results })
+    if args.save:
+        bench_util.save_results(args.save, results)
+    if args.compare:
+        sys.exit(1 if bench_util.compare_results(args.compare, results, args.tolerance) else 0)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to measure the throughput of the on-the-fly pipeline before a collection session.
+
+""" Drive the full on-the-fly pipeline (otf_pipeline.py) with synthetic movies arriving at a set rate, using the stub
+    MotionCor2/ctffind/e2proc2d.py/convert programs in 'stubs/' with configurable latencies.
+    Reports throughput, end-to-end latency percentiles (movie written -> log entry) and how fast the backlog grows.
+        $ bench_pipeline.py --movies 40 --rate 0.5 --motioncor2 1.5 --ctffind 2.0 --workers 2
+        $ bench_pipeline.py --mode fused --save baseline.json
+        $ bench_pipeline.py --motioncor2-init 2.0 --batch 8
+        $ bench_pipeline.py --mode fused --compare baseline.json
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+import os
+import sys
+import time
+import shutil
+import json
+import argparse
+import tempfile
+import threading
+import collections
+
+import bench_util
+import synthetic
+
+import otf_copy
+import otf_pipeline
+import otf_scheduler
+
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def stub_environment(work_dir, latencies, mrc_size):
+    """ Put the stub programs first on the PATH and write the .MRC templates they copy to their outputs
+    """
+    mrc_template = os.path.join(work_dir, 'template.mrc')
+    ctf_template = os.path.join(work_dir, 'template_CTF.mrc')
+    synthetic.write_mrc(mrc_template, mrc_size)
+    synthetic.write_mrc(ctf_template, 512)
+    os.environ['PATH'] = STUB_DIR + os.pathsep + os.environ['PATH']
+    os.environ['STUB_MRC_TEMPLATE'] = mrc_template
+    os.environ['STUB_CTF_TEMPLATE'] = ctf_template
+    os.environ['STUB_INVOCATION_LOG'] = os.path.join(work_dir, 'invocations.log')
+    for program, seconds in latencies.items():
+        os.environ['STUB_LATENCY_' + program] = str(seconds)
+
+def session_settings(work_dir):
+    settings = otf_pipeline.default_settings('TF30')
+    settings['gain_corrected'] = True
+    settings['out_dir'] = os.path.join(work_dir, 'on-the-fly_processing')
+    settings['ctf_dir'] = os.path.join(settings['out_dir'], 'CTF')
+    settings['logfile'] = os.path.join(work_dir, 'on-the-fly_data.log')
+    settings['metrics_log'] = os.path.join(work_dir, 'on-the-fly_metrics.log')
+    return settings
+
+def count_invocations(work_dir, program):
+    log = os.path.join(work_dir, 'invocations.log')
+    if not os.path.exists(log):
+        return 0
+    with open(log) as f:
+        return sum(1 for line in f if json.loads(line)['program'] == program)
+
+def backlog_slope(samples):
+    """ Least squares slope of (time, backlog) samples, in movies per second
+    """
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_t = sum(t for t, b in samples) / n
+    mean_b = sum(b for t, b in samples) / n
+    var_t = sum((t - mean_t) ** 2 for t, b in samples)
+    if var_t == 0:
+        return 0.0
+    return sum((t - mean_t) * (b - mean_b) for t, b in samples) / var_t
+
+def run_benchmark(work_dir, n_movies, rate, workers, mode, movie_size, frames, timeout, adaptive = False, batch = 1):
+    source_dir = os.path.join(work_dir, 'source')
+    dest_dir = os.path.join(work_dir, 'dest')
+    os.makedirs(source_dir)
+    os.makedirs(dest_dir)
+
+    template_movie = os.path.join(work_dir, 'template.tif')
+    movie_bytes = synthetic.write_tiff_movie(template_movie, movie_size, movie_size, frames)
+
+    settings = session_settings(work_dir)
+    otf_pipeline.init_output_dirs(settings)
+    otf_pipeline.init_logfile(settings)
+    metrics = otf_pipeline.start_metrics(settings, 0)
+    jobs = otf_scheduler.JobQueue(adaptive = adaptive)
+    processor = otf_pipeline.Processor(settings, workers = workers, metrics = metrics, jobs = jobs, max_batch = batch)
+
+    if mode == 'watch':
+        driver = threading.Thread(target = otf_pipeline.watch_directory, daemon = True,
+                                  args = (processor, os.path.join(source_dir, '*.tif'), movie_bytes, 0.25))
+    else:
+        driver = threading.Thread(target = otf_copy.copy_and_process, daemon = True,
+                                  args = (source_dir, dest_dir, processor, '*.tif', movie_bytes, 0, 0.25))
+    driver.start()
+
+    arrivals = collections.OrderedDict() # movie name -> time it finished being written
+    samples = []
+    def first_results():
+        ## only the first result of each movie counts, not any catch-up work done later in adaptive mode
+        return [result for result in processor.results if not 'catch-up' in result['mode']]
+    def sample_backlog():
+        while len(first_results()) < n_movies:
+            samples.append((time.time(), len(arrivals) - len(first_results())))
+            time.sleep(0.1)
+    sampler = threading.Thread(target = sample_backlog, daemon = True)
+    sampler.start()
+
+    ## movies arrive at the requested rate, each written under a temporary name and renamed when complete
+    start_time = time.time()
+    for i in range(n_movies):
+        delay = start_time + i / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        name = 'Bench_%04d.tif' % (i + 1)
+        shutil.copyfile(template_movie, os.path.join(source_dir, '.' + name))
+        os.rename(os.path.join(source_dir, '.' + name), os.path.join(source_dir, name))
+        arrivals[name] = time.time()
+    arrival_end = time.time()
+
+    while len(first_results()) < n_movies and time.time() - start_time < timeout:
+        time.sleep(0.05)
+    end_time = time.time()
+
+    latencies = [result['finished'] - arrivals[os.path.basename(result['movie'])] for result in first_results()]
+    done = len(latencies)
+    results = collections.OrderedDict()
+    results['movies_processed'] = done
+    results['throughput_movies_per_min'] = 60 * done / (end_time - start_time)
+    results['arrival_rate_movies_per_min'] = 60 * n_movies / max(arrival_end - start_time, 1e-9)
+    results['latency_p50_s'] = bench_util.percentile(latencies, 50)
+    results['latency_p90_s'] = bench_util.percentile(latencies, 90)
+    results['latency_p99_s'] = bench_util.percentile(latencies, 99)
+    results['latency_max_s'] = max(latencies) if latencies else float('nan')
+    results['motioncor2_runs'] = count_invocations(work_dir, 'MotionCor2')
+    results['backlog_max'] = max([b for t, b in samples] or [0])
+    results['backlog_growth_per_min'] = 60 * backlog_slope([(t, b) for t, b in samples if t <= arrival_end])
+    for quality_mode in otf_scheduler.QUALITY_MODES:
+        results['movies_%s' % quality_mode] = sum(1 for result in first_results() if result['mode'] == quality_mode)
+    return results, metrics
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmark the on-the-fly pipeline with stub programs and synthetic movies")
+    parser.add_argument('--movies', type = int, default = 20, help = "number of movies to process")
+    parser.add_argument('--rate', type = float, default = 1.0, help = "arrival rate (movies per second)")
+    parser.add_argument('--workers', type = int, default = 1, help = "processing workers")
+    parser.add_argument('--mode', choices = ('watch', 'fused'), default = 'watch', help = "directory watch or fused copy-and-process")
+    parser.add_argument('--movie-size', type = int, default = 2048, help = "movie width/height in pixels")
+    parser.add_argument('--frames', type = int, default = 20, help = "frames per movie")
+    parser.add_argument('--motioncor2', type = float, default = 0.5, help = "stub MotionCor2 latency (s)")
+    parser.add_argument('--motioncor2-init', type = float, default = 0, help = "stub MotionCor2 start-up time per run (s)")
+    parser.add_argument('--batch', type = int, default = 1, help = "most movies per MotionCor2 run")
+    parser.add_argument('--ctffind', type = float, default = 0.5, help = "stub ctffind latency (s)")
+    parser.add_argument('--render', type = float, default = 0.05, help = "stub e2proc2d.py and convert latency (s)")
+    parser.add_argument('--adaptive', action = 'store_true', help = "use the adaptive (newest first, backpressure) job queue")
+    parser.add_argument('--timeout', type = float, default = 600, help = "give up after this many seconds")
+    parser.add_argument('--keep', action = 'store_true', help = "keep the working directory")
+    parser.add_argument('--save', default = None, help = "save results as a baseline .json")
+    parser.add_argument('--compare', default = None, help = "compare results against a baseline .json")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix = 'otf_bench_')
+    try:
+        stub_environment(work_dir, { 'MOTIONCOR2' : args.motioncor2, 'MOTIONCOR2_INIT' : args.motioncor2_init, 'CTFFIND' : args.ctffind,
+                                     'E2PROC2D' : args.render, 'CONVERT' : args.render }, args.movie_size // 2)
+        results, metrics = run_benchmark(work_dir, args.movies, args.rate, args.workers, args.mode,
+                                         args.movie_size, args.frames, args.timeout, args.adaptive, args.batch)
+    finally:
+        if args.keep:
+            print("Working directory kept: %s" % work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors = True)
+
+    bench_util.print_results("Pipeline benchmark (%s mode, %s workers)" % (args.mode, args.workers), results)
+    print(metrics.summary())
+    if args.save:
+        bench_util.save_results(args.save, results)
+    if args.compare:
+        higher_is_better = ('movies_processed', 'throughput_movies_per_min')
+        sys.exit(1 if bench_util.compare_results(args.compare, results, higher_is_better = higher_is_better) else 0)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to share result reporting between the benchmark scripts.
+
+""" Helpers to print, save and compare benchmark results. Results are flat dictionaries of name -> value, where a
+    larger value is worse unless the name is listed in 'higher_is_better'.
+"""
+
+import os
+import sys
+import json
+
+## the package root, so the benchmarks can import the scripts they measure
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not REPO_DIR in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def print_results(title, results, units = None):
+    units = units or {}
+    print(title)
+    print("=" * len(title))
+    for name, value in results.items():
+        print("  %-36s %12.4f %s" % (name, value, units.get(name, '')))
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent = 1, sort_keys = True)
+    print("Results saved to %s" % path)
+
+def compare_results(path, results, tolerance = 0.2, higher_is_better = ()):
+    """ Compare results against a saved baseline, printing every value that got worse by more than 'tolerance'
+        (a fraction). Returns the number of regressions found.
+    """
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+    regressions = 0
+    for name, value in results.items():
+        if not name in baseline or baseline[name] == 0:
+            continue
+        change = (value - baseline[name]) / abs(baseline[name])
+        if name in higher_is_better:
+            change = -change
+        if change > tolerance:
+            regressions += 1
+            print(" !!! REGRESSION: %s = %0.4f (baseline %0.4f, %+0.0f%%)" % (name, value, baseline[name], 100 * change))
+    if regressions == 0:
+        print("No regressions against %s (tolerance %0.0f%%)" % (path, 100 * tolerance))
+    return regressions
@@ -0,0 +1 @@
+stub_program.py
\ No newline at end of file
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so the processing pipeline can be benchmarked without GPUs, MotionCor2, CTFFIND4 or EMAN2.
+
+""" Stand-in for the external programs called by the processing pipeline. The program to imitate is chosen from the
+    name this script is called by (the files next to it are symlinks: MotionCor2, ctffind, e2proc2d.py, convert).
+    Behaviour is set with environment variables:
+        STUB_LATENCY_MOTIONCOR2, STUB_LATENCY_CTFFIND,    seconds each call (MotionCor2: each movie) takes (default 0)
+        STUB_LATENCY_E2PROC2D, STUB_LATENCY_CONVERT
+        STUB_LATENCY_MOTIONCOR2_INIT                      seconds MotionCor2 spends once per call (CUDA, gain reference)
+        STUB_MRC_TEMPLATE       .MRC copied to the MotionCor2 output (default: a small empty .MRC is written)
+        STUB_CTF_TEMPLATE       .MRC copied to the CTFFIND diagnostic output
+        STUB_READ_INPUT         if '1' (default), MotionCor2 reads its whole input movie as the real program would
+        STUB_INVOCATION_LOG     file to append one JSON line per call to (program, argv, start, end)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+
+PROGRAM = os.path.basename(sys.argv[0])
+
+def latency(name):
+    return float(os.environ.get('STUB_LATENCY_' + name, '0'))
+
+def copy_template(variable, dest):
+    template = os.environ.get(variable)
+    if template:
+        shutil.copyfile(template, dest)
+    else:
+        with open(dest, 'wb') as f:
+            f.write(bytes(1024))
+
+def argument(flag, default = None):
+    if flag in sys.argv:
+        return sys.argv[sys.argv.index(flag) + 1]
+    return default
+
+def motioncor2_movie(in_tiff, out_mrc):
+    if os.environ.get('STUB_READ_INPUT', '1') == '1' and os.path.isfile(in_tiff):
+        with open(in_tiff, 'rb') as f:
+            while f.read(8 * 1024 * 1024):
+                pass
+    time.sleep(latency('MOTIONCOR2'))
+    copy_template('STUB_MRC_TEMPLATE', out_mrc)
+    if argument('-LogFile') is not None:
+        ## full-frame alignment log of a steady drift of one pixel per frame along x
+        with open(os.path.splitext(out_mrc)[0] + '0-Full.log', 'w') as f:
+            f.write("# full-frame alignment shift\n# frame     x Shift     y Shift\n")
+            for frame in range(1, 11):
+                f.write("%6d %11.2f %11.2f\n" % (frame, frame - 1.0, 0.0))
+
+def motioncor2():
+    in_tiff = argument('-InTiff')
+    out_mrc = argument('-OutMrc')
+    time.sleep(latency('MOTIONCOR2_INIT'))
+    if argument('-Serial', '0') == '1':
+        ## serial mode: -InTiff and -OutMrc are prefixes, every matching input is written as prefix + name + .mrc
+        in_dir, in_prefix = os.path.split(in_tiff)
+        in_suffix = argument('-InSuffix', '')
+        for name in sorted(os.listdir(in_dir or '.')):
+            if name.startswith(in_prefix) and name.endswith(in_suffix):
+                motioncor2_movie(os.path.join(in_dir, name), out_mrc + os.path.splitext(name[len(in_prefix):])[0] + '.mrc')
+    else:
+        motioncor2_movie(in_tiff, out_mrc)
+
+def ctffind():
+    answers = [sys.stdin.readline().strip() for i in range(17)]
+    ctf_mrc = answers[1]
+    time.sleep(latency('CTFFIND'))
+    copy_template('STUB_CTF_TEMPLATE', ctf_mrc)
+    dZ_x = random.uniform(float(answers[9]), float(answers[10]))
+    dZ_y = dZ_x + random.uniform(-500, 500)
+    base_name = os.path.splitext(ctf_mrc)[0]
+    with open(base_name + '.txt', 'w') as f:
+        f.write("# Output from CTFFIND stub\n")
+        f.write("# Columns: #1 - micrograph number; #2 - defocus 1 [A]; #3 - defocus 2; #4 - azimuth of astigmatism; "
+                "#5 - additional phase shift [radians]; #6 - cross correlation; #7 - spacing up to which CTF rings were fit successfully [A]\n")
+        f.write("1.000000 %0.6f %0.6f 45.0 0.0 0.05 %0.6f\n" % (dZ_x, dZ_y, random.uniform(3.5, 12)))
+    with open(base_name + '_avrot.txt', 'w') as f:
+        f.write("# stub\n")
+
+def e2proc2d():
+    time.sleep(latency('E2PROC2D'))
+    with open(sys.argv[2], 'wb') as f:
+        f.write(bytes(64))
+
+def convert():
+    time.sleep(latency('CONVERT'))
+    with open(sys.argv[-1], 'wb') as f:
+        f.write(b'GIF89a')
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    programs = { 'MotionCor2' : motioncor2, 'ctffind' : ctffind, 'e2proc2d.py' : e2proc2d, 'convert' : convert }
+    programs[PROGRAM]()
+    if os.environ.get('STUB_INVOCATION_LOG'):
+        with open(os.environ['STUB_INVOCATION_LOG'], 'a') as f:
+            f.write(json.dumps({ 'program' : PROGRAM, 'argv' : sys.argv[1:], 'start' : start_time, 'end' : time.time() }) + '\n')
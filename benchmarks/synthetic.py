@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to generate test data of realistic size for the benchmarks in this directory.
+
+""" Write synthetic uncompressed multi-frame .TIF movies and .MRC micrographs for benchmarking.
+    Pixel values only need to look like sparse electron counts; nothing here is meant to be aligned or fitted.
+        $ synthetic.py movie Test_0001.tif --size 4096 --frames 40
+        $ synthetic.py mrc Test_Corr_0001.mrc --size 2048
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+import os
+import struct
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def count_frame(width, height, seed = None):
+    """ One frame of sparse electron counts (~1 e/pix) as uint8 bytes
+    """
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        return rng.poisson(1.0, size = (height, width)).astype(np.uint8).tobytes()
+    return bytes(b & 0x03 for b in os.urandom(width * height))
+
+def write_tiff_movie(path, width = 4096, height = 4096, frames = 40, seed = 0):
+    """ Write an uncompressed, little-endian, 8-bit multi-frame TIFF with one strip per frame (frame data followed by
+        its image file directory), returns the file size in bytes
+    """
+    frame_bytes = width * height
+    ifd_entries = 10
+    ifd_size = 2 + ifd_entries * 12 + 4
+    with open(path, 'wb') as f:
+        f.write(b'II' + struct.pack('<HI', 42, 8 + frame_bytes)) # first IFD follows the first frame
+        for i in range(frames):
+            data_offset = f.tell()
+            f.write(count_frame(width, height, None if seed is None else seed + i))
+            ifd_offset = f.tell()
+            next_ifd = 0 if i == frames - 1 else ifd_offset + ifd_size + frame_bytes
+            entries = [
+                (256, 4, 1, width),        # ImageWidth
+                (257, 4, 1, height),       # ImageLength
+                (258, 3, 1, 8),            # BitsPerSample
+                (259, 3, 1, 1),            # Compression = none
+                (262, 3, 1, 1),            # PhotometricInterpretation = BlackIsZero
+                (273, 4, 1, data_offset),  # StripOffsets
+                (277, 3, 1, 1),            # SamplesPerPixel
+                (278, 4, 1, height),       # RowsPerStrip
+                (279, 4, 1, frame_bytes),  # StripByteCounts
+                (339, 3, 1, 1),            # SampleFormat = unsigned integer
+            ]
+            f.write(struct.pack('<H', ifd_entries))
+            for tag, value_type, count, value in entries:
+                if value_type == 3:
+                    f.write(struct.pack('<HHIHH', tag, value_type, count, value, 0))
+                else:
+                    f.write(struct.pack('<HHII', tag, value_type, count, value))
+            f.write(struct.pack('<I', next_ifd))
+    return os.path.getsize(path)
+
+def mrc_header(nx, ny, nz = 1, mode = 2, angpix = 1.0):
+    """ Build a 1024 byte MRC2014 header (mode 2 = float32)
+    """
+    header = bytearray(1024)
+    struct.pack_into('<10i', header, 0, nx, ny, nz, mode, 0, 0, 0, nx, ny, nz)
+    struct.pack_into('<6f', header, 40, nx * angpix, ny * angpix, nz * angpix, 90, 90, 90)
+    struct.pack_into('<3i', header, 64, 1, 2, 3)
+    header[208:212] = b'MAP '
+    header[212:216] = b'\x44\x44\x00\x00' # little-endian machine stamp
+    return bytes(header)
+
+def write_mrc(path, size = 2048, angpix = 1.24, seed = 0):
+    """ Write a square float32 .MRC micrograph of Gaussian noise, returns the file size in bytes
+    """
+    with open(path, 'wb') as f:
+        f.write(mrc_header(size, size, angpix = angpix))
+        if np is not None:
+            rng = np.random.default_rng(seed)
+            f.write(rng.standard_normal((size, size), dtype = np.float32).tobytes())
+        else:
+            f.write(os.urandom(size * size * 4))
+    return os.path.getsize(path)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Write synthetic movies and micrographs for benchmarking")
+    parser.add_argument('kind', choices = ('movie', 'mrc'))
+    parser.add_argument('path')
+    parser.add_argument('--size', type = int, default = None, help = "image width/height (default: 4096 movie, 2048 mrc)")
+    parser.add_argument('--frames', type = int, default = 40)
+    args = parser.parse_args()
+    if args.kind == 'movie':
+        size = write_tiff_movie(args.path, args.size or 4096, args.size or 4096, args.frames)
+    else:
+        size = write_mrc(args.path, args.size or 2048)
+    print("%s written (%0.1f MB)" % (args.path, size / 1e6))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created as a bulk version of 'mark_listed_files.sh' for long rejection lists on network storage.
+
+""" Mark files listed in a given file (e.g. 'bad_mics.txt' from on-the-fly_logviewer.py) with a defined suffix.
+    List entries are numbers (e.g. 0002, 1074, ...) and files are of the form Name_####.ext, as in 'mark_listed_files.sh'.
+    Each directory is listed only once and entries are matched against that listing, so no per-entry file tests are
+    run. The renames are planned first (use --dry-run to only print the plan) and then applied in one batch, with
+    every rename recorded in a journal file that can be replayed in reverse with --rollback. The processed outputs of
+    each entry (Name_Corr_####.mrc, .gif, .box and CTF/Name_Corr_####_CTF.gif, named as in 'otf_pipeline.py') can be
+    marked in the same pass with --related; the CTF subdirectory of every given directory is searched as well.
+        $ mark_listed_files.py bad_mics.txt Name_0001.tif --related --dir . --dir on-the-fly_processing
+        $ mark_listed_files.py --rollback mark_journal_20261019-101500.txt
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import time
+import argparse
+
+import otf_pipeline
+
+## related files of a micrograph produced by the processing scripts
+RELATED_SUFFIXES = ['.mrc', '.gif', '.box', '_CTF.gif']
+## subdirectory holding the CTFFIND outputs next to the corrected micrographs
+CTF_DIR = 'CTF'
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def read_list(list_file):
+    """ Read the entries (e.g. ####) from the list file, ignoring blank lines, comments and any CRLF line endings
+    """
+    entries = []
+    with open(list_file, 'r') as f:
+        for line in f:
+            column = line.split()
+            if len(column) == 0 or column[0][0] == '#':
+                continue
+            entries.append(column[0])
+    return entries
+
+def split_example(filename):
+    """ From a given example file name (Name_####.ext), extract the prefix (Name_) and suffix (.ext)
+    """
+    filename = os.path.basename(filename)
+    prefix = filename.rsplit('_', 1)[0] + '_'
+    suffix = '.' + filename.rsplit('.', 1)[-1]
+    return prefix, suffix
+
+def list_files(directory):
+    try:
+        return set(entry.name for entry in os.scandir(directory) if entry.is_file())
+    except FileNotFoundError:
+        return set()
+
+def plan_marks(entries, directories, prefix, suffixes, mark, corrected_suffix = None):
+    """ Build the list of renames needed to mark every listed entry. Each directory (and its CTF subdirectory, for
+        the related files) is listed once and file names are looked up in a set. The first suffix is the listed file
+        itself, which is missing only if no directory holds it; the others are related files, looked up both under the
+        entry's own name and under its corrected name (Name_Corr_####). Returns (plan, missing, conflicts, n_marked)
+        where plan is a list of (old_path, new_path) and n_marked the number of files already carrying the mark
+    """
+    listings = [] # (directory, file names, holds listed files)
+    seen = set()
+    for directory in directories + [os.path.join(d, CTF_DIR) for d in directories]:
+        if not os.path.normpath(directory) in seen:
+            seen.add(os.path.normpath(directory))
+            listings.append((directory, list_files(directory), directory in directories))
+
+    plan = []
+    missing = []
+    conflicts = []
+    n_marked = sum(1 for directory, present, _ in listings for name in present if name.endswith(mark))
+
+    def add(directory, present, target):
+        if target + mark in present:
+            conflicts.append(os.path.join(directory, target + mark))
+        else:
+            plan.append((os.path.join(directory, target), os.path.join(directory, target + mark)))
+
+    for entry in entries:
+        target = prefix + entry + suffixes[0]
+        found = False
+        for directory, present, primary in listings:
+            if primary and target in present:
+                add(directory, present, target)
+                found = True
+        if not found:
+            missing.append(target)
+
+        bases = [prefix + entry]
+        if corrected_suffix:
+            bases.append(otf_pipeline.corrected_name(target, corrected_suffix))
+        for suffix in suffixes[1:]:
+            for base in bases:
+                for directory, present, _ in listings:
+                    if base + suffix in present:
+                        add(directory, present, base + suffix)
+    return plan, missing, conflicts, n_marked
+
+def write_journal(journal, plan):
+    """ Record every planned rename before any file is touched, so an interrupted batch can always be rolled back
+    """
+    with open(journal, 'w') as f:
+        f.write("## mark_listed_files.py journal: old_path <TAB> new_path\n")
+        for old_path, new_path in plan:
+            f.write("%s\t%s\n" % (old_path, new_path))
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(journal):
+    plan = []
+    with open(journal, 'r') as f:
+        for line in f:
+            if line[0] == '#' or not line.strip():
+                continue
+            old_path, new_path = line.rstrip('\n').split('\t')
+            plan.append((old_path, new_path))
+    return plan
+
+def apply_plan(plan):
+    """ Apply all renames in the plan. If any rename fails, the renames already done are reversed and the error
+        is raised again, so the directory is left either fully marked or untouched
+    """
+    done = []
+    try:
+        for old_path, new_path in plan:
+            os.rename(old_path, new_path)
+            done.append((old_path, new_path))
+    except OSError:
+        for old_path, new_path in reversed(done):
+            os.rename(new_path, old_path)
+        raise
+    return len(done)
+
+def rollback(journal):
+    """ Undo the renames recorded in a journal, skipping any that were never applied. Returns the number restored
+    """
+    restored = 0
+    for old_path, new_path in reversed(read_journal(journal)):
+        if os.path.exists(new_path) and not os.path.exists(old_path):
+            os.rename(new_path, old_path)
+            restored += 1
+            if VERBOSE:
+                print("'%s' -> '%s'" % (new_path, old_path))
+    return restored
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Mark files listed in a given file with a defined suffix")
+    parser.add_argument('list', nargs = '?', help = "file with listed frames to be marked (e.g. bad_mics.txt)")
+    parser.add_argument('filename', nargs = '?', help = "example file from the batch to be modified (e.g. Name_0001.ext)")
+    parser.add_argument('--mark', default = '_badframe', help = "suffix to mark listed files (default: _badframe)")
+    parser.add_argument('--dir', action = 'append', default = None, help = "directory with the files, can be repeated (default: .)")
+    parser.add_argument('--related', nargs = '*', default = None, metavar = 'SUFFIX',
+                        help = "also mark related files with these suffixes (default if no suffix given: %s)" % ' '.join(RELATED_SUFFIXES))
+    parser.add_argument('--corrected-suffix', default = otf_pipeline.default_settings()['corrected_suffix'],
+                        help = "suffix of the corrected micrograph names, for the related files (default: Corr)")
+    parser.add_argument('-n', '--dry-run', action = 'store_true', help = "only print the planned renames")
+    parser.add_argument('-y', '--yes', action = 'store_true', help = "do not ask for confirmation")
+    parser.add_argument('--journal', default = None, help = "journal file to record renames in (default: mark_journal_<time>.txt)")
+    parser.add_argument('--rollback', metavar = 'JOURNAL', default = None, help = "undo the renames recorded in a journal")
+    args = parser.parse_args()
+
+    if args.rollback:
+        print("Job complete: %s files restored from %s" % (rollback(args.rollback), args.rollback))
+        sys.exit()
+
+    if args.list is None or args.filename is None:
+        parser.error("a list file and an example file name are required")
+
+    directories = args.dir or ['.']
+    prefix, suffix = split_example(args.filename)
+    suffixes = [suffix]
+    if args.related is not None:
+        suffixes += [s for s in (args.related or RELATED_SUFFIXES) if s != suffix]
+
+    entries = read_list(args.list)
+    plan, missing, conflicts, n_marked = plan_marks(entries, directories, prefix, suffixes, args.mark, args.corrected_suffix)
+
+    for name in missing:
+        print(" !!! ERROR: File %s not found in %s, skipping ..." % (name, ', '.join(directories)))
+    for path in conflicts:
+        print(" !!! ERROR: File %s already exists, skipping ..." % path)
+    if args.dry_run or VERBOSE:
+        for old_path, new_path in plan:
+            print("'%s' -> '%s'" % (old_path, new_path))
+    print("%s entries listed, %s files will be marked with '%s' (%s missing, %s already marked)" % (
+          len(entries), len(plan), args.mark, len(missing), len(conflicts)))
+    if args.dry_run or len(plan) == 0:
+        sys.exit()
+
+    if not args.yes:
+        userinput = input(">> Proceed? ")
+        if not userinput in ('y', 'yes', 'Y', 'Yes'):
+            print("Terminating script.")
+            sys.exit()
+
+    journal = args.journal or time.strftime("mark_journal_%Y%m%d-%H%M%S.txt")
+    write_journal(journal, plan)
+    try:
+        applied = apply_plan(plan)
+    except OSError as e:
+        print(" !!! ERROR: %s, all renames were rolled back" % e)
+        sys.exit(1)
+
+    print("Job complete: %s files marked (%s files with '%s' in total)." % (applied, n_marked + applied, args.mark))
+    print("Undo with: mark_listed_files.py --rollback %s" % journal)
+    print("If desired, remove marked files with: ")
+    print("    rm *%s" % args.mark)
@@ -16,9 +16,15 @@
 VERBOSE = False
 
 from tkinter import *
-from tkinter.filedialog import askopenfilename
-from tkinter.messagebox import showerror
+from tkinter.filedialog import askopenfilename, askopenfilenames
+from tkinter.messagebox import showerror, showinfo
 import os
+import base64
+import bisect
+
+import otf_logmerge
+import otf_boxindex
+import otf_packstore
 
 class Gui:
     def __init__(self, master):
@@ -36,7 +42,13 @@ class Gui:
         dropdown_file = Menu(menubar)
         menubar.add_cascade(label="File", menu=dropdown_file)
         dropdown_file.add_command(label="Open log file", command=self.load_logfile)
+        dropdown_file.add_command(label="Open several log files (merged)", command=self.load_logfiles)
+        dropdown_file.add_command(label="Session statistics", command=self.show_stats)
         dropdown_file.add_command(label="Print marked imgs (Ctrl+S)", command=self.write_marked)
+        dropdown_file.add_command(label="Next unpicked micrograph (U)", command=lambda: self.next_by_count('unpicked'))
+        dropdown_file.add_command(label="Next over-picked micrograph (O)", command=lambda: self.next_by_count('over-picked'))
+        self.follow = BooleanVar(value=False)
+        dropdown_file.add_checkbutton(label="Auto-follow new images (Ctrl+F)", variable=self.follow, command=self.toggle_follow)
         dropdown_file.add_command(label="Exit", command=self.menu_exit)
 
         ## Widgets
@@ -54,19 +66,23 @@ class Gui:
         self.img_mark = Label(master, font=("Helvetica", 12), text="")
         self.img_dZ = Label(master, font=("Helvetica", 12), text="Est. dZ = ")
         self.img_fitRes = Label(master, font=("Helvetica", 12), text="Fit Res = ")
+        self.img_particles = Label(master, font=("Helvetica", 12), text="Particles = ")
+        self.img_quality = Label(master, font=("Helvetica", 10), text="")
         self.go_to_n = Entry(master, width=30, font=("Helvetica", 14), highlightcolor="blue", borderwidth=2, relief=RIDGE, foreground="gray")
         self.go_to_n.insert(0, "Go to micrograph # ...")
 
         ## Widget layout
         self.img_current_dir.grid(row=0, column=0, sticky=W, padx=5, columnspan=2)
         self.CTF_current_dir.grid(row=1, column=0, sticky=W, padx=5, columnspan=2)
-        self.img_canvas.grid(row=2, column=0, columnspan=1, rowspan=6, sticky=N)
+        self.img_canvas.grid(row=2, column=0, columnspan=1, rowspan=8, sticky=N)
         self.CTF_canvas.grid(row=2, column=1, columnspan=1, sticky=N)
         self.img_name.grid(row=3, column=1, sticky=N)
         self.img_mark.grid(row=4, column=1)
         self.img_dZ.grid(row=5, column=1)
         self.img_fitRes.grid(row=6, column=1, sticky=N)
-        self.go_to_n.grid(row=7, column=1, sticky=S, pady=10)
+        self.img_particles.grid(row=7, column=1, sticky=N)
+        self.img_quality.grid(row=8, column=1, sticky=N)
+        self.go_to_n.grid(row=9, column=1, sticky=S, pady=10)
 
         ## Key bindings
         self.img_canvas.bind('<Left>', lambda event: self.next_img('left'))
@@ -74,6 +90,9 @@ class Gui:
         self.img_canvas.bind('<d>', lambda event: self.mark_img())
         self.img_canvas.bind('<D>', lambda event: self.mark_img())
         self.img_canvas.bind('<Control-KeyRelease-s>', lambda event: self.write_marked())
+        self.img_canvas.bind('<u>', lambda event: self.next_by_count('unpicked'))
+        self.img_canvas.bind('<o>', lambda event: self.next_by_count('over-picked'))
+        self.img_canvas.bind('<Control-KeyRelease-f>', lambda event: (self.follow.set(not self.follow.get()), self.toggle_follow()))
 
         self.go_to_n.bind('<Control-KeyRelease-a>', lambda event: self.select_all(self.go_to_n))
         self.go_to_n.bind('<Return>', lambda event: self.update_num())
@@ -81,6 +100,9 @@ class Gui:
         self.go_to_n.bind('<Button-1>', lambda event: self.clear_entry(self.go_to_n))
 
 
+        ## auto-follow state: inotify watcher, or the pending Tk 'after' job when checking the log file size instead
+        self.watcher = None
+        self.follow_job = None
 
         ## Set focus to canvas, which has arrow key bindings
         self.img_canvas.focus_set()
@@ -105,8 +127,18 @@ class Gui:
     def write_marked(self, file="bad_mics.txt"):
         """ When called, this function prints each marked file into a text document. If the file name is already
             present in a previously existing file, a duplicate is NOT printed (e.g. does not overwrite existing list, if present)
+            With several logs open, each session gets its own list next to its log file.
         """
-        global marked_imgs
+        global marked_imgs, merged_entries, session_data
+        if merged_entries:
+            for log_path, data in session_data.items():
+                session_marked = [marked_img for marked_img in marked_imgs if marked_img in data]
+                if session_marked:
+                    self.write_marked_list(session_marked, os.path.join(os.path.dirname(os.path.abspath(log_path)), file))
+            return
+        self.write_marked_list(marked_imgs, file)
+
+    def write_marked_list(self, marked_imgs, file):
         ## if present, determine what entries might already exist in the target file (e.g. if continuing from a previous session)
         existing_entries = []
         if os.path.exists(file):
@@ -152,10 +184,21 @@ class Gui:
         else:
             self.img_dZ.config(text="Est. dZ = ")
             self.img_fitRes.config(text="Fit Res = ")
+        ## quality metrics of the image (key=value columns written by 'otf_pipeline.py --quality-metrics')
+        fields = dict(column.split('=', 1) for column in log_data.get(new_name, ()) if '=' in column)
+        quality = ["%s = %s" % (label, fields[key]) for key, label in (('mean', 'Mean'), ('std', 'Std'), ('hf', 'HF'), ('drift', 'Drift (A)')) if key in fields]
+        self.img_quality.config(text=', '.join(quality))
+        ## particles picked on the image (.box files next to the .GIFs, e.g. from GIF_particle_boxer_v1.py)
+        box_dir = os.path.split(logfile_path)[0] + '/' + img_dir
+        if os.path.isdir(box_dir):
+            self.img_particles.config(text="Particles = %s" % self.box_index(box_dir).check(new_name))
+        else:
+            self.img_particles.config(text="Particles = ")
         ## if the image corresponding to the CTF of the current img exists, load it on to the CTF_canvas
-        if os.path.exists(os.path.split(logfile_path)[0] + '/' + CTF_dir + '/' + new_name + '_CTF.gif'):
+        CTF_img = self.preview_image(os.path.split(logfile_path)[0] + '/' + CTF_dir + '/' + new_name + '_CTF.gif')
+        if CTF_img is not None:
             ## load image onto canvas
-            self.current_CTF_img = PhotoImage(file=os.path.split(logfile_path)[0] + '/' + CTF_dir + '/' + new_name + '_CTF.gif')
+            self.current_CTF_img = CTF_img
             self.display_CTF = self.CTF_canvas.create_image(0, 0, anchor=NW, image=self.current_CTF_img)
             self.CTF_canvas.display_CTF = self.display_CTF
             ## resize canvas to match new image
@@ -171,9 +214,10 @@ class Gui:
                 print("Loading CTF img:")
                 print(">> " + new_name + '_CTF.gif' + " not found!")
         ## load motion corrected image if it exists, otherwise clear the canvas
-        if os.path.exists(os.path.split(logfile_path)[0] + '/' + img_dir + '/' + new_name + '.gif'):
+        img = self.preview_image(os.path.split(logfile_path)[0] + '/' + img_dir + '/' + new_name + '.gif')
+        if img is not None:
             ## load image onto canvas
-            self.current_img = PhotoImage(file=os.path.split(logfile_path)[0] + '/' + img_dir + '/' + new_name + '.gif')
+            self.current_img = img
             self.display_img = self.img_canvas.create_image(0, 0, anchor=NW, image=self.current_img)
             self.img_canvas.display_img = self.display_img
             ## resize canvas to match new image
@@ -189,11 +233,23 @@ class Gui:
                 print("Loading main img:")
                 print(">> " + new_name + '.gif' + " not found!")
 
+    def preview_image(self, path):
+        """ PhotoImage of a .GIF, read from the preview pack of the img dir (see otf_packstore.py) if the pipeline
+            packed it, otherwise from the file itself. None if neither exists
+        """
+        global logfile_path, img_dir
+        data = otf_packstore.read_preview(path, os.path.split(logfile_path)[0] + '/' + img_dir)
+        if data is not None:
+            return PhotoImage(data=base64.b64encode(data), format='gif')
+        if os.path.exists(path):
+            return PhotoImage(file=path)
+        return None
+
     def update_num(self):
         """ Read from an Entry widget and update the global n variable before updating
             the log_data and widgets
         """
-        global n, img_prefix, logfile_path
+        global n, img_prefix, logfile_path, merged_entries
         input_value = self.go_to_n.get()
         print("INPUT value = " + input_value)
         ## confirm an integer was typed in, otherwise do not update 'n'
@@ -204,8 +260,12 @@ class Gui:
             self.go_to_n.insert(0,"Integer value expected...")
             return
         # update log file in case new entries have been written
-        self.parse_logfile(logfile_path)
-        self.update_widgets()
+        if merged_entries:
+            self.read_merged()
+            self.show_entry(self.find_entry(n))
+        else:
+            self.parse_logfile(logfile_path)
+            self.update_widgets()
         ## reset widget text to default after action is complete
         self.go_to_n.delete(0,END)
         self.go_to_n.insert(0,"Go to micrograph #...")
@@ -217,7 +277,13 @@ class Gui:
     def next_img(self, direction):
         """ Increments the variable 'n' based on the direction given to the function.
         """
-        global n, logfile_path, log_data
+        global n, logfile_path, log_data, merged_entries, merged_index
+        ## with several logs open, step through the merged entries instead
+        if merged_entries:
+            self.read_merged()
+            step = 1 if direction == 'right' else -1
+            self.show_entry(max(0, min(len(merged_entries) - 1, merged_index + step)))
+            return
         # update log file in case new entries have been written
         self.parse_logfile(logfile_path)
 
@@ -237,9 +303,10 @@ class Gui:
             print(">> ", n)
 
     def load_logfile(self):
-        global logfile_path, n
-        ## reset the log_data and incrementor variables to accept new input data
-        log_data = {}
+        global logfile_path, n, merged_entries, parsed_logfile
+        merged_entries = []
+        ## reset the incrementor and make parse_logfile() read the selected file from the start into a new log_data
+        parsed_logfile = None
         n = 1
         ## load selected file into variable fname
         fname = askopenfilename(parent=self.master, initialdir="./", title='Select file', filetypes=( ("Log file", "*.log"),("All files", "*.*") ))
@@ -262,37 +329,260 @@ class Gui:
         """ Read logfile and extract relevant data into a dictionary format:
                 log_data = {'Name_####': (CTF fit, Avg dZ, ...), ... }
             NOTE: Any extension present in the name is removed in the dictionary key name
+            Only the lines added since the last call are read (from the byte offset reached last time), unless a different
+            log file is given or the file was rewritten. Returns the names of the new entries, in the order they were written.
         """
-        global log_data, img_dir, CTF_dir, img_prefix, n
-        with open(file, 'r') as file_obj :
-            for line in file_obj:
-                ## read header lines indicated by hash marks
-                if line[0] == '#':
-                    if 'Motion_corrected_images' in line:
-                        img_dir = line.split()[2]
-                        continue
-                    if 'CTF_fit_images' in line:
-                        CTF_dir = line.split()[2]
-                        continue
-                    continue
-                ## parse each line with space delimiter into a list using .split() function (e.g. ['col1', 'col2', ...])
-                column = line.split()
-                ## eliminate empty lines by removing length 0 lists
-                if len(column) == 0:
+        global log_data, img_dir, CTF_dir, img_prefix, n, parsed_logfile, logfile_offset
+        if file != parsed_logfile or os.path.getsize(file) < logfile_offset:
+            parsed_logfile = file
+            logfile_offset = 0
+            ## a new dictionary, the one shown last may belong to a session of the merged view (session_data)
+            log_data = {}
+        start = logfile_offset
+        with open(file, 'rb') as file_obj :
+            file_obj.seek(logfile_offset)
+            data = file_obj.read()
+        ## leave a line that is still being written for the next call
+        data = data[:data.rfind(b'\n') + 1]
+        logfile_offset += len(data)
+        new_names = []
+        for line in data.decode(errors='replace').splitlines():
+            ## read header lines indicated by hash marks
+            if line[:1] == '#':
+                if 'Motion_corrected_images' in line:
+                    img_dir = line.split()[2]
                     continue
-                ## extract data into name and data parts
-                mic_name = os.path.splitext(column[0])[0] # os module path.splitext removes .EXT from input name
-                mic_data = tuple(column[1:]) # col1 = CTF fit (Ang); col2 = Est. avg dZ (um); ...
-                ## skip adding entry to dictionary if already defined (e.g. duplicates)
-                if mic_name in log_data:
+                if 'CTF_fit_images' in line:
+                    CTF_dir = line.split()[2]
                     continue
-                ## write entry into dictionary
-                log_data[mic_name] = mic_data
+                continue
+            ## parse each line with space delimiter into a list using .split() function (e.g. ['col1', 'col2', ...])
+            column = line.split()
+            ## eliminate empty lines by removing length 0 lists
+            if len(column) == 0:
+                continue
+            ## extract data into name and data parts
+            mic_name = os.path.splitext(column[0])[0] # os module path.splitext removes .EXT from input name
+            mic_data = tuple(column[1:]) # col1 = CTF fit (Ang); col2 = Est. avg dZ (um); ...
+            ## skip adding entry to dictionary if already defined (e.g. duplicates)
+            if mic_name in log_data:
+                continue
+            ## write entry into dictionary
+            log_data[mic_name] = mic_data
+            new_names.append(mic_name)
         ## use the first entry in log_data to determine the fixed image prefix used for the dataset (of the form: Name_other_..._####.EXT)
-        img_prefix = '_'.join(sorted(log_data.items())[0][0].split('_')[0:-1])+'_'
+        if new_names and (start == 0 or len(new_names) == len(log_data)):
+            img_prefix = '_'.join(min(log_data).split('_')[0:-1])+'_'
         if VERBOSE:
             print("Log file loaded:")
             print('>>', 'index (n) =', n ,'\n>>', 'prefix =', img_prefix,'\n>>', 'img dir =', img_dir, '\n>>','CTF dir =', CTF_dir, '\n>>','# log file items = ', len(log_data))
+        return new_names
+
+    def toggle_follow(self):
+        """ Switch auto-follow mode on or off (menu checkbutton or Ctrl+F). While on, the newest micrograph is shown as soon
+            as its entry is written to the log file, and its CTF image as soon as it lands
+        """
+        if self.follow.get():
+            self.start_follow()
+        else:
+            self.stop_follow()
+
+    def start_follow(self):
+        global logfile_path, img_dir, CTF_dir, merged_entries
+        if merged_entries or not os.path.isfile(logfile_path):
+            showerror("Auto-follow", "Open a single log file first")
+            self.follow.set(False)
+            return
+        self.parse_logfile(logfile_path)
+        self.show_newest()
+        log_dir = os.path.split(logfile_path)[0]
+        try:
+            import otf_inotify
+            if not otf_inotify.available():
+                raise OSError("inotify is not available")
+            self.watcher = otf_inotify.Inotify()
+            ## watch the directories (not the files), so files renamed into place or created later are seen too
+            for directory in (log_dir, os.path.join(log_dir, img_dir), os.path.join(log_dir, CTF_dir)):
+                if os.path.isdir(directory) and not os.path.realpath(directory) in [os.path.realpath(d) for d in self.watcher.watches.values()]:
+                    self.watcher.add_watch(directory)
+            self.master.tk.createfilehandler(self.watcher.fileno(), READABLE, lambda fd, mask: self.on_file_event())
+            print("Following %s (inotify, and checking the log file every 2 s)" % logfile_path)
+        except (ImportError, OSError) as e:
+            ## e.g. not on Linux: only check whether the log file grew
+            self.watcher = None
+            print("Following %s (checking the log file every 2 s: %s)" % (logfile_path, e))
+        ## inotify only sees writes made on this host, on network storage written by another host (NFS, CIFS) it
+        ## stays silent: the log file is always checked as well, inotify only makes updates quicker
+        self.follow_job = self.master.after(2000, self.check_log_size)
+
+    def stop_follow(self):
+        if self.watcher is not None:
+            self.master.tk.deletefilehandler(self.watcher.fileno())
+            self.watcher.close()
+            self.watcher = None
+        if self.follow_job is not None:
+            self.master.after_cancel(self.follow_job)
+            self.follow_job = None
+
+    def on_file_event(self):
+        """ Called by Tk when the watched directories report changes: apply new log entries, and reload the images if
+            one of the current micrograph landed
+        """
+        global logfile_path, img_prefix, n
+        events = self.watcher.read_events()
+        names = set(name for wd, mask, name in events)
+        if os.path.basename(logfile_path) in names and self.parse_logfile(logfile_path):
+            self.show_newest()
+            return
+        current_name = img_prefix + ("%04d" % n)
+        if otf_packstore.index_path(otf_packstore.PACK_NAME) in names:
+            ## previews appended to the pack of the img dir
+            store = otf_packstore.open_store(os.path.join(os.path.split(logfile_path)[0], img_dir))
+            if store is not None:
+                names.update(os.path.basename(name) for name in store.refresh())
+        if current_name + '.gif' in names or current_name + '_CTF.gif' in names:
+            self.update_widgets()
+
+    def check_log_size(self):
+        global logfile_path
+        if self.parse_logfile(logfile_path):
+            self.show_newest()
+        self.follow_job = self.master.after(2000, self.check_log_size)
+
+    def show_newest(self):
+        """ Jump to the last entry written to the log file
+        """
+        global log_data, n
+        if not log_data:
+            return
+        newest = next(reversed(log_data))
+        try:
+            n = int(newest.split('_')[-1])
+        except ValueError:
+            return
+        self.update_widgets()
+
+    def load_logfiles(self):
+        """ Open several log files (e.g. of two microscopes or several grids) at once. Their entries are merged by the time
+            they were written (see otf_logmerge.py), and each entry is shown with the names and directories of its own session
+        """
+        global merged_readers, merged_entries, merged_keys, session_data, marked_imgs
+        fnames = askopenfilenames(parent=self.master, initialdir="./", title='Select files', filetypes=( ("Log file", "*.log"),("All files", "*.*") ))
+        if not fnames:
+            return
+        if self.follow.get():
+            self.follow.set(False)
+            self.stop_follow()
+        try:
+            merged_readers, entries = otf_logmerge.merge_logs(list(fnames), 'time')
+            merged_entries = list(entries)
+        except (IOError, IndexError, ValueError):
+            showerror("Open Source Files", "Failed to read files\n'%s'" % "\n".join(fnames))
+            merged_entries = []
+            return
+        merged_keys = [entry['time'] for entry in merged_entries]
+        session_data = {}
+        for entry in merged_entries:
+            session_data.setdefault(entry['log'], {})[entry['name']] = entry['data']
+        if merged_entries:
+            self.show_entry(0)
+
+    def read_merged(self):
+        """ Add the entries written to any of the open logs since they were last read, in merged order
+        """
+        global merged_readers, merged_entries, merged_keys, session_data
+        for reader in merged_readers:
+            for entry in reader.entries(with_gif_time=True):
+                index = bisect.bisect_right(merged_keys, entry['time'])
+                merged_keys.insert(index, entry['time'])
+                merged_entries.insert(index, entry)
+                session_data.setdefault(entry['log'], {})[entry['name']] = entry['data']
+
+    def find_entry(self, number):
+        """ Index of micrograph 'number' in the merged entries, looked up in the session of the current entry first
+        """
+        global merged_entries, merged_index
+        current_log = merged_entries[merged_index]['log']
+        matches = [i for i, entry in enumerate(merged_entries) if entry['number'] == number]
+        for i in matches:
+            if merged_entries[i]['log'] == current_log:
+                return i
+        return matches[0] if matches else merged_index
+
+    def show_entry(self, index):
+        """ Show a merged entry, pointing the global variables used by update_widgets() at its own session
+        """
+        global merged_entries, merged_index, logfile_path, log_data, img_dir, CTF_dir, img_prefix, n, session_data
+        merged_index = index
+        entry = merged_entries[index]
+        logfile_path = os.path.abspath(entry['log'])
+        log_data = session_data[entry['log']]
+        img_dir, CTF_dir, img_prefix, n = entry['img_dir'], entry['ctf_dir'], entry['prefix'], entry['number']
+        self.master.title("Tk-based on-the-fly EM processing logviewer - %s (%s of %s)" % (entry['session'], index + 1, len(merged_entries)))
+        self.update_widgets()
+
+    def show_stats(self):
+        """ Show statistics of every open session (number of images, flagged images, mean CTF fit and defocus)
+        """
+        global merged_entries, logfile_path
+        if merged_entries:
+            self.read_merged()
+            stats = otf_logmerge.summarize(merged_entries)
+        elif os.path.isfile(logfile_path):
+            stats = otf_logmerge.summarize(otf_logmerge.LogReader(logfile_path).entries())
+        else:
+            showerror("Session statistics", "Open a log file first")
+            return
+        lines = []
+        for session, session_stats in stats.items():
+            fitted = max(session_stats['fitted'], 1)
+            lines.append("%s:\n    %s images, %s flagged, mean fit %0.1f A (best %0.1f A), mean dZ -%0.2f um" % (
+                         session, session_stats['micrographs'], session_stats['flagged'], session_stats['fit_res_sum'] / fitted,
+                         session_stats['best_fit_res'] or 0, session_stats['dZ_sum'] / fitted))
+        showinfo("Session statistics", "\n".join(lines))
+
+    def box_index(self, directory):
+        """ Index of the particle counts of the .box files in a directory (see otf_boxindex.py)
+        """
+        global box_indexes
+        if directory not in box_indexes:
+            box_indexes[directory] = otf_boxindex.BoxIndex(directory)
+            box_indexes[directory].refresh()
+        return box_indexes[directory]
+
+    def next_by_count(self, kind):
+        """ Go to the next micrograph without particles (kind = 'unpicked') or with more than twice the median number of
+            particles per picked micrograph ('over-picked')
+        """
+        global n, logfile_path, log_data, img_dir, img_prefix, merged_entries, merged_index, box_indexes
+        for index in box_indexes.values():
+            index.refresh()
+        def matches(directory, name):
+            if not os.path.isdir(directory):
+                return False
+            index = self.box_index(directory)
+            count = index.count(name)
+            limit = index.over_picked_limit()
+            return (kind == 'unpicked' and count == 0) or (kind == 'over-picked' and limit is not None and count > limit)
+        if merged_entries:
+            self.read_merged()
+            for step in range(1, len(merged_entries) + 1):
+                i = (merged_index + step) % len(merged_entries)
+                entry = merged_entries[i]
+                if matches(os.path.join(os.path.dirname(os.path.abspath(entry['log'])), entry['img_dir']), entry['name']):
+                    self.show_entry(i)
+                    return
+        elif len(log_data) > 0:
+            self.parse_logfile(logfile_path)
+            box_dir = os.path.split(logfile_path)[0] + '/' + img_dir
+            numbers = sorted(otf_logmerge.image_number(name) for name in log_data if name.startswith(img_prefix))
+            ## micrographs after the current one first, then from the start
+            for number in [number for number in numbers if number > n] + [number for number in numbers if number <= n]:
+                if matches(box_dir, img_prefix + ("%04d" % number)):
+                    n = number
+                    self.update_widgets()
+                    return
+        print(">> No %s micrographs" % kind)
 
     def menu_exit(self):
         """ Quit Tk program when clicking the 'Exit' button in the 'File' dropdown menu
@@ -326,6 +616,17 @@ if __name__ == '__main__':
     img_dir = 'on-the-fly_processing/'
     CTF_dir = 'on-the-fly_processing/CTF/'
     img_prefix = 'stack_'
+    parsed_logfile = None # log file read by parse_logfile() ...
+    logfile_offset = 0 # ... and the byte offset it has been read up to
+
+    ## several logs open at once (File > Open several log files)
+    merged_readers = []
+    merged_entries = [] # entries of all logs in merged order, see otf_logmerge.py
+    merged_keys = []
+    merged_index = 0
+    session_data = {} # log file -> its log_data
+
+    box_indexes = {} # image directory -> its .box file index, see otf_boxindex.py
 
     n=0
 
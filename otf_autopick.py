@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so curators start from candidate picks in 'GIF_particle_boxer_v1.py' instead of a blank image.
+
+""" Automatic particle picking into EMAN2 .BOX files, for curation in 'GIF_particle_boxer_v1.py'.
+    Each micrograph is read from its .MRC (next to the .GIF, through a memory map) or, if the .MRC was not kept, from
+    the .GIF itself. The image is binned so a particle is ~16 px across, then filtered in Fourier space with a
+    difference of Gaussians matched to the particle diameter (or cross-correlated with a 2D template, --template).
+    Peaks are found by a vectorised non-maximum suppression (a separable sliding max filter), thresholded in units of
+    the (robust) standard deviation of the filtered image and written as boxes of the given box size:
+        $ otf_autopick.py on-the-fly_processing --box-size 180 --angpix 1.24 --diameter 150
+        $ otf_autopick.py on-the-fly_processing --box-size 180 --template ref.mrc --workers 8
+    Micrographs that already have a .BOX file are skipped (curated picks are kept), unless --existing merge (add
+    picks that do not overlap the existing ones) or --existing overwrite is given. The .MRC dimensions and pixel size
+    default to those saved by the boxer in 'GIF_particle_boxer_settings.txt'.
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import concurrent.futures
+
+import numpy as np
+
+import otf_imageio
+import otf_packstore
+
+EXISTING = ('skip', 'merge', 'overwrite')
+
+BOXER_SETTINGS = 'GIF_particle_boxer_settings.txt'
+
+## size of a particle after binning, in pixels
+BINNED_DIAMETER = 16
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def default_settings():
+    return {
+        'box_size' : 0, # px in the .MRC
+        'angpix' : 1.0,
+        'diameter' : None, # A, default 2/3 of the box
+        'min_distance' : None, # A between picks, default 0.8 x diameter
+        'threshold' : 3.0, # standard deviations of the filtered image
+        'contrast' : 'dark', # particles darker ('dark') or brighter ('light') than the background
+        'template' : None, # .MRC of a 2D template (in micrograph contrast), at the pixel size of the micrographs
+        'mrc_size' : None, # (x, y) of the .MRC, only needed to pick from a .GIF
+        'max_picks' : 1000,
+        'existing' : 'skip' # what to do with micrographs that have a .BOX file
+    }
+
+def boxer_settings(directory, settings):
+    """ Take the .MRC dimensions and pixel size saved by GIF_particle_boxer_v1.py in the directory, if any
+    """
+    path = os.path.join(directory, BOXER_SETTINGS)
+    if not os.path.exists(path):
+        return settings
+    values = {}
+    with open(path, 'r') as f:
+        for line in f:
+            column = line.split()
+            if len(column) == 2 and column[0][0] != '#':
+                values[column[0]] = column[1]
+    if 'mrc_pixel_size_x' in values and 'mrc_pixel_size_y' in values:
+        settings['mrc_size'] = (int(values['mrc_pixel_size_x']), int(values['mrc_pixel_size_y']))
+    if 'angpix' in values:
+        settings['angpix'] = float(values['angpix'])
+    return settings
+
+def diameter_px(settings):
+    if settings['diameter']:
+        return settings['diameter'] / settings['angpix']
+    return settings['box_size'] * 2 / 3
+
+def read_micrograph(gif, settings):
+    """ Read the micrograph of a .GIF, from its .MRC if present. Returns (image, scale_x, scale_y, source) with row 0
+        of the image at .MRC y = 0 and the size of one image pixel in .MRC pixels along x and y.
+    """
+    mrc = os.path.splitext(gif)[0] + '.mrc'
+    if os.path.exists(mrc):
+        image = otf_imageio.mrc_memmap(mrc)
+        if image.ndim == 3:
+            image = image[0]
+        return image, 1.0, 1.0, mrc
+    if settings['mrc_size'] is None:
+        raise ValueError("%s has no .MRC, give the .MRC dimensions to pick from the .GIF" % gif)
+    ## the .GIF is displayed with .MRC y = 0 at the bottom
+    image = otf_imageio.read_gif(gif, otf_packstore.read_preview(gif, os.path.dirname(gif)))[::-1]
+    return image, settings['mrc_size'][0] / image.shape[1], settings['mrc_size'][1] / image.shape[0], gif
+
+def fourier_gaussian(shape, sigma):
+    """ Half-plane Fourier transform of a Gaussian blur of 'sigma' pixels
+    """
+    fy = np.fft.fftfreq(shape[0]).astype(np.float32)
+    fx = np.fft.rfftfreq(shape[1]).astype(np.float32)
+    return np.exp(-2 * np.pi ** 2 * sigma ** 2 * (fy[:, None] ** 2 + fx[None, :] ** 2))
+
+def dog_score(image, radius):
+    """ Difference of Gaussians matched to blobs of the given radius (scale radius / sqrt(2), ratio 1.6)
+    """
+    sigma = radius / np.sqrt(2)
+    kernel = fourier_gaussian(image.shape, sigma) - fourier_gaussian(image.shape, 1.6 * sigma)
+    return np.fft.irfft2(np.fft.rfft2(image) * kernel, s = image.shape).astype(np.float32)
+
+def template_score(image, template, radius):
+    """ Cross-correlation with a template (zero mean, unit norm), after removing gradients wider than the particle
+    """
+    image = np.fft.irfft2(np.fft.rfft2(image) * (1 - fourier_gaussian(image.shape, 4 * radius)), s = image.shape)
+    template = template - template.mean()
+    template /= max(np.linalg.norm(template), 1e-12)
+    padded = np.zeros(image.shape, dtype = np.float32)
+    ty, tx = template.shape
+    padded[:ty, :tx] = template
+    ## centre the template on the origin, so correlation peaks sit on the particle centres
+    padded = np.roll(padded, (-(ty // 2), -(tx // 2)), axis = (0, 1))
+    return np.fft.irfft2(np.fft.rfft2(image) * np.conj(np.fft.rfft2(padded)), s = image.shape).astype(np.float32)
+
+def max_filter(image, half_width):
+    """ Maximum over a (2 half_width + 1)^2 window around every pixel, as two 1D sliding maxima
+    """
+    size = 2 * half_width + 1
+    padded = np.pad(image, half_width, mode = 'constant', constant_values = -np.inf)
+    rows = np.lib.stride_tricks.sliding_window_view(padded, size, axis = 0).max(axis = -1)
+    return np.lib.stride_tricks.sliding_window_view(rows, size, axis = 1).max(axis = -1)
+
+def find_peaks(score, half_width, threshold, border, max_picks):
+    """ Non-maximum suppression: pixels that are the maximum of their window, above the threshold and at least
+        'border' pixels from the edges. Returns (rows, columns, scores), best first.
+    """
+    peaks = (score == max_filter(score, half_width)) & (score > threshold)
+    peaks[:border, :] = False
+    peaks[:, :border] = False
+    peaks[score.shape[0] - border:, :] = False
+    peaks[:, score.shape[1] - border:] = False
+    rows, cols = np.nonzero(peaks)
+    values = score[rows, cols]
+    order = np.argsort(-values)[:max_picks]
+    return rows[order], cols[order], values[order]
+
+def load_template(settings, shrink):
+    """ Read the template and shrink it to the pixel size of the picked image (a .GIF is not binned by a whole factor)
+    """
+    template = np.asarray(otf_imageio.mrc_memmap(settings['template']), dtype = np.float32)
+    if template.ndim == 3:
+        template = template[0]
+    shape = (max(1, int(round(template.shape[0] / shrink))), max(1, int(round(template.shape[1] / shrink))))
+    return otf_imageio.resize_nearest(otf_imageio.bin_image(template, int(shrink)), shape)
+
+def pick_image(image, scale_x, scale_y, settings):
+    """ Pick particles in an image, returns the centres in .MRC pixels as an array of (x, y) rows and their scores
+    """
+    ## bin so that a particle is about BINNED_DIAMETER pixels across
+    diameter = diameter_px(settings) / scale_x
+    bin_factor = max(1, int(diameter / BINNED_DIAMETER))
+    image = otf_imageio.bin_image(image, bin_factor)
+    ## make particles bright, the template (in the contrast of the micrographs) along with them
+    sign = -1 if settings['contrast'] == 'dark' else 1
+    image = sign * (image - image.mean())
+    radius = diameter / bin_factor / 2
+    if settings['template']:
+        score = template_score(image, sign * load_template(settings, bin_factor * scale_x), radius)
+    else:
+        score = dog_score(image, radius)
+    ## robust standard deviation, so that the particles themselves do not raise the threshold
+    median = np.median(score)
+    score = (score - median) / max(1.4826 * np.median(np.abs(score - median)), 1e-12)
+    min_distance = settings['min_distance'] / settings['angpix'] if settings['min_distance'] else 0.8 * diameter_px(settings)
+    half_width = max(1, int(min_distance / scale_x / bin_factor))
+    border = int(np.ceil(settings['box_size'] / 2 / scale_x / bin_factor))
+    rows, cols, values = find_peaks(score, half_width, settings['threshold'], border, settings['max_picks'])
+    centres = np.column_stack(((cols + 0.5) * bin_factor * scale_x, (rows + 0.5) * bin_factor * scale_y))
+    return centres, values
+
+def read_boxfile(boxfile):
+    """ Centres of the boxes in a .BOX file, as an array of (x, y) rows
+    """
+    centres = []
+    with open(boxfile, 'r') as f:
+        for line in f:
+            column = line.split()
+            if len(column) >= 3:
+                x, y, size = float(column[0]), float(column[1]), float(column[2])
+                centres.append((x + size / 2, y + size / 2))
+    return np.array(centres, dtype = np.float64).reshape(-1, 2)
+
+def write_boxfile(boxfile, centres, box_size, append = False):
+    """ Write boxes (lower left corner, as read by GIF_particle_boxer_v1.py) around the given centres
+    """
+    with open(boxfile, 'a' if append else 'w') as f:
+        for x, y in centres:
+            f.write("%s     %s    %s    %s\n" % (int(x - box_size / 2), int(y - box_size / 2), box_size, box_size))
+
+def pick_micrograph(gif, settings):
+    """ Pick one micrograph and write its .BOX file (see 'existing' in default_settings()), returns the new centres
+        in .MRC pixels (None if the micrograph was skipped)
+    """
+    if not settings['box_size'] > 0:
+        raise ValueError("no box size given")
+    boxfile = os.path.splitext(gif)[0] + '.box'
+    merge = False
+    if os.path.exists(boxfile):
+        if settings['existing'] == 'skip':
+            return None
+        merge = settings['existing'] == 'merge'
+    image, scale_x, scale_y, source = read_micrograph(gif, settings)
+    centres, values = pick_image(image, scale_x, scale_y, settings)
+    if merge and len(centres) > 0:
+        ## drop picks that overlap particles already picked
+        existing = read_boxfile(boxfile)
+        if len(existing) > 0:
+            min_distance = settings['min_distance'] / settings['angpix'] if settings['min_distance'] else 0.8 * diameter_px(settings)
+            distances = np.linalg.norm(centres[:, None, :] - existing[None, :, :], axis = 2)
+            centres = centres[distances.min(axis = 1) >= min_distance]
+    if len(centres) > 0 or not merge:
+        write_boxfile(boxfile, centres, settings['box_size'], append = merge)
+    if VERBOSE:
+        print("%s: %s particles picked from %s" % (os.path.basename(gif), len(centres), os.path.basename(source)))
+    return centres
+
+def pick_file(gif, settings):
+    """ pick_micrograph() for a worker process, returns (gif, number of picks or None if skipped, error)
+    """
+    try:
+        centres = pick_micrograph(gif, settings)
+    except (IOError, ValueError) as e:
+        return gif, None, str(e)
+    return gif, None if centres is None else len(centres), None
+
+def gifs_in_dir(directory):
+    """ .GIF images of a directory, loose or in its preview pack (see otf_packstore.py)
+    """
+    names = set(name for name in os.listdir(directory) if name.endswith('.gif') and not name.startswith('.'))
+    store = otf_packstore.open_store(directory)
+    if store is not None:
+        names.update(name for name in store.names() if name.endswith('.gif') and '/' not in name)
+    return sorted(os.path.join(directory, name) for name in names)
+
+def pick_directory(directory, settings, workers = None):
+    """ Pick every .GIF micrograph of a directory with a pool of processes, yields the results of pick_file()
+    """
+    gifs = gifs_in_dir(directory)
+    if workers == 1:
+        for gif in gifs:
+            yield pick_file(gif, settings)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        for result in executor.map(pick_file, gifs, itertools.repeat(settings), chunksize = 4):
+            yield result
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Auto-pick particles into .BOX files for GIF_particle_boxer_v1.py")
+    parser.add_argument('directory', help = "directory of .GIF micrographs (and their .MRCs, if kept)")
+    parser.add_argument('--box-size', type = int, required = True, help = "box size in .MRC pixels")
+    parser.add_argument('--angpix', type = float, default = None, help = "pixel size of the .MRC (default: boxer settings, or 1)")
+    parser.add_argument('--diameter', type = float, default = None, help = "particle diameter in A (default: 2/3 of the box)")
+    parser.add_argument('--min-distance', type = float, default = None, help = "minimum distance between picks in A (default: 0.8 x diameter)")
+    parser.add_argument('--threshold', type = float, default = 3.0, help = "pick threshold in standard deviations")
+    parser.add_argument('--contrast', choices = ('dark', 'light'), default = 'dark', help = "particle contrast")
+    parser.add_argument('--template', default = None, help = ".MRC 2D template to cross-correlate with, instead of a DoG")
+    parser.add_argument('--mrc-size', type = int, nargs = 2, default = None, metavar = ('X', 'Y'), help = ".MRC dimensions, to pick from .GIFs without an .MRC (default: boxer settings)")
+    parser.add_argument('--max-picks', type = int, default = 1000, help = "maximum picks per micrograph")
+    parser.add_argument('--existing', choices = EXISTING, default = 'skip', help = "micrographs that have a .BOX file already")
+    parser.add_argument('--workers', type = int, default = None, help = "processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    settings = boxer_settings(args.directory, default_settings())
+    settings.update({ 'box_size' : args.box_size, 'diameter' : args.diameter, 'min_distance' : args.min_distance,
+                      'threshold' : args.threshold, 'contrast' : args.contrast, 'template' : args.template,
+                      'max_picks' : args.max_picks, 'existing' : args.existing })
+    if args.angpix is not None:
+        settings['angpix'] = args.angpix
+    if args.mrc_size is not None:
+        settings['mrc_size'] = tuple(args.mrc_size)
+
+    start_time = time.time()
+    n_micrographs, n_picks, n_skipped, n_failed = 0, 0, 0, 0
+    for gif, picks, error in pick_directory(args.directory, settings, args.workers):
+        if error is not None:
+            n_failed += 1
+            print(" !!! ERROR: %s: %s" % (os.path.basename(gif), error))
+        elif picks is None:
+            n_skipped += 1
+        else:
+            n_micrographs += 1
+            n_picks += picks
+            print("%-40s %6s particles" % (os.path.basename(gif), picks))
+    print(">> %s particles picked on %s micrographs in %0.1f s (%s skipped, already boxed; %s failed)" % (
+          n_picks, n_micrographs, time.time() - start_time, n_skipped, n_failed))
+    if n_failed:
+        sys.exit(1)
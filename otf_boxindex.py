@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to see how many particles each micrograph has without opening every .box file in the boxer.
+
+""" Index of the .BOX files of a directory: the number of particles and the box size of every micrograph, kept in
+    '.box_index.json' next to the .BOX files. An entry is only read again when the modification time or size of its
+    .BOX file changed, so refreshing the index of tens of thousands of micrographs costs one stat() per file; when
+    many files changed (e.g. the first time, or after 'otf_autopick.py'), they are read by a pool of processes.
+    'GIF_particle_boxer_v1.py' updates the index whenever it saves a .BOX file, and both viewers use it to show the
+    counts and to jump to unpicked or over-picked micrographs. From the command line:
+        $ otf_boxindex.py on-the-fly_processing                       (summary)
+        $ otf_boxindex.py on-the-fly_processing --list --sort count    (count of every micrograph, fewest first)
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import concurrent.futures
+
+INDEX_NAME = '.box_index.json'
+
+## read changed files with a pool of processes beyond this many
+PARALLEL_FILES = 2000
+
+## micrographs with more than this many times the median count of the picked micrographs are over-picked
+OVER_PICKED_FACTOR = 2.0
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def count_boxes(path):
+    """ Number of boxes in a .BOX file and their box size (of the first box, 0 if there are none)
+    """
+    count, box_size = 0, 0
+    with open(path, 'rb') as f:
+        for line in f:
+            column = line.split()
+            if len(column) < 3:
+                continue
+            if count == 0:
+                box_size = int(float(column[2]))
+            count += 1
+    return count, box_size
+
+def read_entries(paths):
+    """ Index entries { name : [mtime_ns, size, count, box_size] } of a list of .BOX files (run in a worker process)
+    """
+    entries = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            count, box_size = count_boxes(path)
+        except (IOError, ValueError):
+            continue
+        entries[os.path.basename(path)] = [stat.st_mtime_ns, stat.st_size, count, box_size]
+    return entries
+
+def box_name(image_name):
+    """ .BOX file name of an image (Name_0001.gif, Name_0001.mrc or Name_0001 -> Name_0001.box)
+    """
+    base_name, extension = os.path.splitext(os.path.basename(image_name))
+    if extension not in ('.gif', '.mrc', '.box'):
+        base_name += extension
+    return base_name + '.box'
+
+class BoxIndex:
+    def __init__(self, directory, index_path = None):
+        self.directory = directory
+        self.index_path = index_path if index_path is not None else os.path.join(directory, INDEX_NAME)
+        self.entries = {} # .box name -> [mtime_ns, size, count, box_size]
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                print(" !!! WARNING: %s is unreadable, building the index again" % self.index_path)
+
+    def save(self):
+        temp_path = self.index_path + '.%s.part' % os.getpid()
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.index_path)
+        except IOError as e:
+            ## e.g. a read-only directory, the index is then only kept in memory
+            print(" !!! WARNING: cannot save %s: %s" % (self.index_path, e))
+
+    def refresh(self, workers = None):
+        """ Bring the index up to date with the .BOX files of the directory, returns the number of entries changed
+        """
+        stale, present = [], set()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.box') or entry.name.startswith('.'):
+                continue
+            present.add(entry.name)
+            known = self.entries.get(entry.name)
+            stat = entry.stat()
+            if known is None or known[0] != stat.st_mtime_ns or known[1] != stat.st_size:
+                stale.append(entry.path)
+        removed = [name for name in self.entries if name not in present]
+        for name in removed:
+            del self.entries[name]
+        if len(stale) > PARALLEL_FILES and workers != 1:
+            chunks = [stale[i:i + 500] for i in range(0, len(stale), 500)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+                for entries in executor.map(read_entries, chunks):
+                    self.entries.update(entries)
+        else:
+            self.entries.update(read_entries(stale))
+        if stale or removed:
+            self.save()
+            if VERBOSE:
+                print(">> Box index of %s: %s files read, %s removed" % (self.directory, len(stale), len(removed)))
+        return len(stale) + len(removed)
+
+    def update(self, boxfile):
+        """ Read one .BOX file again (e.g. just saved by the boxer)
+        """
+        name = os.path.basename(boxfile)
+        if os.path.exists(boxfile):
+            self.entries.update(read_entries([boxfile]))
+        else:
+            self.entries.pop(name, None)
+        self.save()
+
+    def check(self, image_name):
+        """ Number of particles of an image, reading its .BOX file again first if it changed since it was indexed
+        """
+        name = box_name(image_name)
+        path = os.path.join(self.directory, name)
+        known = self.entries.get(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if known is not None:
+                self.update(path)
+            return 0
+        if known is None or known[0] != stat.st_mtime_ns or known[1] != stat.st_size:
+            self.update(path)
+        return self.count(image_name)
+
+    def count(self, image_name):
+        """ Number of particles of an image (0 if it has no .BOX file)
+        """
+        entry = self.entries.get(box_name(image_name))
+        return entry[2] if entry is not None else 0
+
+    def box_size(self, image_name):
+        entry = self.entries.get(box_name(image_name))
+        return entry[3] if entry is not None else 0
+
+    def over_picked_limit(self):
+        """ Count above which a micrograph is over-picked (OVER_PICKED_FACTOR x the median of the picked micrographs)
+        """
+        counts = [entry[2] for entry in self.entries.values() if entry[2] > 0]
+        if not counts:
+            return None
+        return OVER_PICKED_FACTOR * statistics.median(counts)
+
+    def totals(self):
+        """ (particles, micrographs with particles) over the whole index
+        """
+        counts = [entry[2] for entry in self.entries.values()]
+        return sum(counts), sum(1 for count in counts if count > 0)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Particle counts of the .BOX files in a directory")
+    parser.add_argument('directory', help = "directory of .BOX files (and their .GIF images)")
+    parser.add_argument('--list', action = 'store_true', help = "print the count of every micrograph")
+    parser.add_argument('--sort', choices = ('name', 'count'), default = 'name', help = "order of --list")
+    parser.add_argument('--unpicked', action = 'store_true', help = "list the .GIF images without particles")
+    parser.add_argument('--over-picked', action = 'store_true', help = "list the micrographs with more than %s x the median count" % OVER_PICKED_FACTOR)
+    parser.add_argument('--workers', type = int, default = None, help = "processes to read changed files with (default: number of CPUs)")
+    args = parser.parse_args()
+
+    index = BoxIndex(args.directory)
+    changed = index.refresh(args.workers)
+    names = sorted(index.entries)
+    if args.sort == 'count':
+        names.sort(key = lambda name: index.entries[name][2])
+    try:
+        if args.list:
+            for name in names:
+                print("%-40s %6s particles   box %s" % (name, index.entries[name][2], index.entries[name][3]))
+        if args.unpicked:
+            images = sorted(name for name in os.listdir(args.directory) if name.endswith('.gif') and not name.startswith('.'))
+            for image in images:
+                if index.count(image) == 0:
+                    print(image)
+        if args.over_picked:
+            limit = index.over_picked_limit()
+            for name in names:
+                if limit is not None and index.entries[name][2] > limit:
+                    print("%-40s %6s particles" % (name, index.entries[name][2]))
+        particles, picked = index.totals()
+        limit = index.over_picked_limit()
+        print(">> %s particles on %s micrographs (%s .box files, %s read again), over-picked above %s" % (
+              particles, picked, len(index.entries), changed, "%0.0f" % limit if limit is not None else "-"))
+    except BrokenPipeError:
+        ## e.g. piped into 'head'
+        sys.stderr.close()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to replace the keep-all or delete-all choice for corrected .MRCs and CTFFIND intermediates.
+
+""" Retention cache for the intermediate files of the on-the-fly pipeline (see 'otf_pipeline.py --cache-budget').
+    Corrected .MRCs and the CTFFIND outputs (_CTF.mrc, _CTF.txt, _CTF_avrot.txt) are kept after processing as long as
+    they fit in a byte budget. Beyond the budget, the least recently used files are removed first, in order of priority:
+        0 = normal micrographs
+        1 = micrographs flagged in the log file ('*', out of range CTF values)
+        2 = micrographs marked in a viewer (listed in 'bad_mics.txt' or 'marked_imgs.txt'), never removed
+    Every entry records the parameters it was made with, so a later step can reuse it instead of running MotionCor2
+    or CTFFIND again (e.g. when a micrograph is reprocessed), as long as the parameters are the same.
+    The index is a .json file next to the files (one per host), check on it with:
+        $ otf_cache.py on-the-fly_processing/.retention_cache_HOSTNAME.json
+        $ otf_cache.py on-the-fly_processing/.retention_cache_HOSTNAME.json --budget 20G     (remove files down to 20 GB now)
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+PRIORITY_NORMAL = 0
+PRIORITY_FLAGGED = 1
+PRIORITY_MARKED = 2
+
+SIZE_UNITS = { 'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3, 'T' : 1024 ** 4 }
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def parse_size(text):
+    """ Parse a size in bytes, with an optional K, M, G or T suffix (e.g. '500G')
+    """
+    text = str(text).strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(n_bytes):
+    for unit in ('T', 'G', 'M', 'K'):
+        if n_bytes >= SIZE_UNITS[unit]:
+            return "%0.1f %sB" % (n_bytes / SIZE_UNITS[unit], unit)
+    return "%s B" % n_bytes
+
+def image_number(name):
+    """ Number of a micrograph as written in the marked lists of the viewers (Name_Corr_0001.mrc -> 0001)
+    """
+    return os.path.basename(name).rsplit('_', 1)[-1].split('.')[0]
+
+def image_name(name):
+    """ Name of a micrograph without directory or extension (on-the-fly_processing/Name_Corr_0001.gif -> Name_Corr_0001)
+    """
+    return os.path.splitext(os.path.basename(name))[0]
+
+class RetentionCache:
+    """ Index of cached intermediate files. An entry is one kind of output ('mrc' or 'ctf') of one micrograph, with
+        its files, the parameters ('key') they were made with and when it was last used. Thread-safe.
+    """
+    def __init__(self, index_path, budget, marked_lists = ()):
+        self.index_path = index_path
+        self.budget = budget
+        self.marked_lists = marked_lists
+        self.marked = set() # names listed in the marked lists (the boxer writes names, e.g. Name_Corr_0001.gif)
+        self.marked_numbers = set() # image numbers listed without a name (the logviewer writes numbers, e.g. 0001)
+        self.marked_mtimes = {}
+        self.lock = threading.Lock()
+        self.entries = {} # 'name:kind' -> { 'name', 'kind', 'files', 'key', 'bytes', 'last_used', 'priority' }
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                self.entries = json.load(f)
+            ## forget entries whose files were removed while the pipeline was not running
+            for entry_id, entry in list(self.entries.items()):
+                if not all(os.path.exists(path) for path in entry['files']):
+                    del self.entries[entry_id]
+
+    def total_bytes(self):
+        return sum(entry['bytes'] for entry in self.entries.values())
+
+    def save(self):
+        temp_path = self.index_path + '.part'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.index_path)
+
+    def lookup(self, name, kind, key):
+        """ Return the cached files of a micrograph made with the same parameters, or None
+        """
+        with self.lock:
+            entry = self.entries.get(name + ':' + kind)
+            if entry is None or entry['key'] != key:
+                return None
+            if not all(os.path.exists(path) for path in entry['files']):
+                del self.entries[name + ':' + kind]
+                return None
+            entry['last_used'] = time.time()
+            return entry['files']
+
+    def add(self, name, kind, files, key, priority = PRIORITY_NORMAL):
+        """ Hand the files of a micrograph over to the cache (instead of removing them), then remove the least
+            valuable files if the budget is exceeded
+        """
+        files = [path for path in files if os.path.exists(path)]
+        with self.lock:
+            self.entries[name + ':' + kind] = { 'name' : name, 'kind' : kind, 'files' : files, 'key' : key,
+                                                'bytes' : sum(os.path.getsize(path) for path in files),
+                                                'last_used' : time.time(), 'priority' : priority }
+            self.evict()
+            self.save()
+
+    def update_marked(self):
+        """ Re-read the marked lists of the viewers if any of them changed (images can be unmarked, so the marked
+            images are always read again from every list)
+        """
+        mtimes = {}
+        for list_file in self.marked_lists:
+            try:
+                mtimes[list_file] = os.path.getmtime(list_file)
+            except OSError:
+                pass
+        if mtimes == self.marked_mtimes:
+            return
+        self.marked_mtimes = mtimes
+        marked, marked_numbers = set(), set()
+        for list_file in mtimes:
+            try:
+                with open(list_file, 'r') as f:
+                    for line in f:
+                        column = line.split()
+                        if len(column) == 0 or column[0][0] == '#':
+                            continue
+                        if column[0].isdigit():
+                            marked_numbers.add(column[0])
+                        else:
+                            marked.add(image_name(column[0]))
+            except OSError:
+                pass
+        self.marked, self.marked_numbers = marked, marked_numbers
+
+    def priority(self, entry):
+        if entry['name'] in self.marked or image_number(entry['name']) in self.marked_numbers:
+            return PRIORITY_MARKED
+        return entry['priority']
+
+    def evict(self):
+        """ Remove entries, lowest priority and least recently used first, until the cache fits in its budget.
+            Entries of marked micrographs are never removed. Call with the lock held.
+        """
+        total = self.total_bytes()
+        if total <= self.budget:
+            return
+        self.update_marked()
+        candidates = [(self.priority(entry), entry['last_used'], entry_id) for entry_id, entry in self.entries.items()]
+        candidates = sorted(candidate for candidate in candidates if candidate[0] < PRIORITY_MARKED)
+        for priority, last_used, entry_id in candidates:
+            if total <= self.budget:
+                break
+            entry = self.entries.pop(entry_id)
+            for path in entry['files']:
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= entry['bytes']
+            if VERBOSE:
+                print("Removed cached %s files of %s (%s)" % (entry['kind'], entry['name'], format_size(entry['bytes'])))
+        if total > self.budget:
+            print(" !!! WARNING: cache holds %s of marked micrographs, over its budget of %s" % (format_size(total), format_size(self.budget)))
+
+    def summary(self):
+        with self.lock:
+            counts = [0, 0, 0]
+            self.update_marked()
+            for entry in self.entries.values():
+                counts[self.priority(entry)] += 1
+            budget = format_size(self.budget) if self.budget != float('inf') else "no budget"
+            return "%s cached entries, %s of %s (%s normal, %s flagged, %s marked)" % (
+                   len(self.entries), format_size(self.total_bytes()), budget, *counts)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Show or shrink the retention cache of the on-the-fly pipeline")
+    parser.add_argument('index', help = "cache index (e.g. on-the-fly_processing/.retention_cache_HOSTNAME.json)")
+    parser.add_argument('--budget', default = None, help = "remove files until the cache fits in this size (e.g. 20G)")
+    parser.add_argument('--marked', nargs = '*', default = ['bad_mics.txt', 'marked_imgs.txt'], help = "marked lists of the viewers")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.index):
+        sys.exit("No cache index at %s" % args.index)
+    budget = parse_size(args.budget) if args.budget else float('inf')
+    cache = RetentionCache(args.index, budget, args.marked)
+    if args.budget:
+        with cache.lock:
+            cache.evict()
+            cache.save()
+    print(cache.summary())
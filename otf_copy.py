@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to fuse 'copy_loop.sh' and 'proc_loop.sh', each movie is handed to the processing queue as soon as
+#             its copy is verified so it is never rediscovered (and re-read from disk) by a separate polling loop.
+
+""" Continuously copy new movies from a SOURCE directory to a DEST directory and send each verified copy straight for
+    motion correction and CTF estimation (see 'otf_pipeline.py').
+    Each movie is read once from SOURCE: the data is checksummed as it is read, and the copy is read back and checked
+    against that checksum while it is still in the page cache of the processing host (where MotionCor2 then reads it).
+    With --preview-frames, a quick full-frame alignment of the first few frames is started while the rest of the
+    movie is still being copied, from a movie of just these frames written from the partial copy.
+        $ otf_copy.py /raidy/Alex/img_dir/ ./ --min-size 400000000 --preview-frames 8
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import time
+import zlib
+import fnmatch
+import struct
+import argparse
+import threading
+
+import otf_metrics
+import otf_pipeline
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024 # bytes read per system call while copying
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def file_is_stable(stat, last_seen, min_size, interval):
+    """ A file is complete once it has reached 'min_size' and either was last modified more than one interval ago, or
+        its size did not change since the last scan ('last_seen', the (size, mtime) seen then, or None)
+    """
+    if stat.st_size < min_size:
+        return False
+    return time.time() - stat.st_mtime >= interval or last_seen == (stat.st_size, stat.st_mtime)
+
+def file_crc32(path, chunk_size = COPY_CHUNK_SIZE):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+def copy_verified(source, dest_dir, chunk_size = COPY_CHUNK_SIZE, on_chunk = None):
+    """ Copy a file in a single streaming pass, computing a CRC32 of the data as it is read from the source. The copy is
+        written to a hidden temporary name, then read back and only renamed into place if its CRC32 and size match,
+        so a half-written or corrupted movie can never be picked up for processing. The copy is read back from the page
+        cache of this host: this catches short or mangled writes through the file system, not later media errors.
+        'on_chunk' is called with (temporary path, bytes written so far) after every chunk. Returns (dest_path, size, crc32).
+    """
+    name = os.path.basename(source)
+    dest = os.path.join(dest_dir, name)
+    temp_dest = os.path.join(dest_dir, '.' + name + '.part')
+    source_stat = os.stat(source)
+    crc = 0
+    size = 0
+    with open(source, 'rb') as f_in, open(temp_dest, 'wb') as f_out:
+        while True:
+            chunk = f_in.read(chunk_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            f_out.write(chunk)
+            if on_chunk is not None:
+                f_out.flush()
+                on_chunk(temp_dest, size)
+    ## the source must not have changed during the copy, and the copy must hold the same bytes as were read
+    if os.path.getsize(temp_dest) != size or size != source_stat.st_size or os.stat(source).st_mtime != source_stat.st_mtime:
+        os.remove(temp_dest)
+        raise IOError("%s changed or was truncated during copy" % source)
+    if file_crc32(temp_dest, chunk_size) != crc & 0xffffffff:
+        os.remove(temp_dest)
+        raise IOError("copy of %s does not match its checksum" % source)
+    os.replace(temp_dest, dest)
+    ## keep the source time stamp, as 'cp -p' does
+    os.utime(dest, (source_stat.st_atime, source_stat.st_mtime))
+    return dest, size, crc & 0xffffffff
+
+## sizes of the TIFF field types, to find the values stored outside of a directory
+TIFF_TYPE_SIZES = { 1 : 1, 2 : 1, 3 : 2, 4 : 4, 5 : 8, 6 : 1, 7 : 1, 8 : 2, 9 : 4, 10 : 8, 11 : 4, 12 : 8, 16 : 8, 17 : 8, 18 : 8 }
+
+def tiff_prefix(path, size, frames):
+    """ For a .TIF movie still being written (its first 'size' bytes are on disk), find the start of the file that
+        holds its first 'frames' frames: returns (length, position of the next directory pointer of the last of these
+        frames, struct format of that pointer), or None if they are not all written yet
+    """
+    with open(path, 'rb') as f:
+        header = f.read(16)
+        if len(header) < 16 or size < 16:
+            return None
+        if header[:2] == b'II':
+            endian = '<'
+        elif header[:2] == b'MM':
+            endian = '>'
+        else:
+            raise ValueError("%s is not a TIFF file" % path)
+        magic = struct.unpack(endian + 'H', header[2:4])[0]
+        if magic == 42:
+            offset = struct.unpack(endian + 'I', header[4:8])[0]
+            count_fmt, entry_fmt, pointer_fmt = 'H', 'HHI', 'I'
+        elif magic == 43: # BigTIFF
+            offset = struct.unpack(endian + 'Q', header[8:16])[0]
+            count_fmt, entry_fmt, pointer_fmt = 'Q', 'HHQ', 'Q'
+        else:
+            raise ValueError("%s is not a TIFF file" % path)
+        value_size = struct.calcsize(pointer_fmt)
+        entry_size = struct.calcsize(endian + entry_fmt) + value_size
+        end = 16 if magic == 43 else 8
+        for frame in range(frames):
+            if offset == 0:
+                raise ValueError("%s has fewer than %s frames" % (path, frames))
+            f.seek(offset)
+            raw_count = f.read(struct.calcsize(count_fmt))
+            if offset + len(raw_count) > size or len(raw_count) < struct.calcsize(count_fmt):
+                return None
+            n_entries = struct.unpack(endian + count_fmt, raw_count)[0]
+            pointer_offset = offset + len(raw_count) + n_entries * entry_size
+            if pointer_offset + value_size > size:
+                return None
+            entries = f.read(n_entries * entry_size)
+            next_offset = struct.unpack(endian + pointer_fmt, f.read(value_size))[0]
+            end = max(end, pointer_offset + value_size)
+            strips = {}
+            for i in range(n_entries):
+                entry = entries[i * entry_size:(i + 1) * entry_size]
+                tag, field_type, count = struct.unpack(endian + entry_fmt, entry[:-value_size])
+                if field_type not in TIFF_TYPE_SIZES:
+                    continue
+                length = count * TIFF_TYPE_SIZES[field_type]
+                raw = entry[-value_size:]
+                if length > value_size:
+                    ## values stored elsewhere in the file, they must be written as well
+                    position = struct.unpack(endian + pointer_fmt, raw)[0]
+                    end = max(end, position + length)
+                    if end > size:
+                        return None
+                    f.seek(position)
+                    raw = f.read(length)
+                if tag in (273, 279) and field_type in (3, 4, 16):
+                    strips[tag] = struct.unpack(endian + { 3 : 'H', 4 : 'I', 16 : 'Q' }[field_type] * count, raw[:length])
+            if 273 not in strips or 279 not in strips:
+                raise ValueError("%s has no image strips" % path)
+            end = max([end] + [strip_offset + strip_size for strip_offset, strip_size in zip(strips[273], strips[279])])
+            if end > size:
+                return None
+            offset = next_offset
+    return end, pointer_offset, endian + pointer_fmt
+
+def write_preview_movie(partial, size, frames, preview_movie):
+    """ Write the first 'frames' frames of a .TIF movie still being copied into a movie of their own, read from the
+        partial copy (still in the page cache) rather than from SOURCE. Returns False if the frames are not all
+        written yet
+    """
+    prefix = tiff_prefix(partial, size, frames)
+    if prefix is None:
+        return False
+    length, pointer_offset, pointer_fmt = prefix
+    with open(partial, 'rb') as f:
+        data = bytearray(f.read(length))
+    ## end the chain of directories after the last frame kept
+    data[pointer_offset:pointer_offset + struct.calcsize(pointer_fmt)] = struct.pack(pointer_fmt, 0)
+    with open(preview_movie, 'wb') as f:
+        f.write(data)
+    return True
+
+def start_preview(preview_movie, movie_name, settings, preview_dir):
+    """ Launch a quick, full-frame only motion correction of a preview movie (see write_preview_movie()) in a background
+        thread, writing a preview .GIF into 'preview_dir'. Returns the thread.
+    """
+    def run():
+        base_name = otf_pipeline.corrected_name(movie_name, settings['corrected_suffix'])
+        out_mrc = os.path.join(preview_dir, base_name + '.mrc')
+        if settings['motion_engine'] == 'cpu':
+            cmd = otf_pipeline.cpu_motioncor_cmd(preview_movie, out_mrc, settings)
+        else:
+            cmd = otf_pipeline.motioncor2_cmd(preview_movie, out_mrc, settings)
+            ## drop patch alignment, the preview movie only holds the first frames
+            patch_index = cmd.index('-Patch')
+            del cmd[patch_index:patch_index + 3]
+        try:
+            otf_pipeline.run_quiet(cmd)
+            if os.path.exists(out_mrc):
+                otf_pipeline.render_micrograph_gif(out_mrc, os.path.join(preview_dir, base_name + '.gif'))
+                print("   ... preview of %s ready" % movie_name)
+        finally:
+            otf_pipeline.remove_files(out_mrc, preview_movie)
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    return thread
+
+def preview_starter(movie_name, settings, preview_frames, preview_dir):
+    """ on_chunk callback for copy_verified(): starts the preview as soon as the first frames of the copy are written
+    """
+    state = { 'done' : False }
+    preview_movie = os.path.join(preview_dir, '.' + movie_name)
+    frames = settings['throw'] + preview_frames
+    def on_chunk(partial, size):
+        if state['done']:
+            return
+        try:
+            if not write_preview_movie(partial, size, frames, preview_movie):
+                return
+        except (IOError, ValueError) as e:
+            print(" !!! Preview of %s skipped: %s" % (movie_name, e))
+            state['done'] = True
+            return
+        state['done'] = True
+        start_preview(preview_movie, movie_name, settings, preview_dir)
+    return on_chunk
+
+def copy_and_process(source_dir, dest_dir, processor, pattern = '*.tif', min_size = 0, preview_frames = 0, interval = 2.0):
+    """ Continuously copy new movies from 'source_dir' into 'dest_dir' and submit every verified copy to 'processor'
+    """
+    settings = processor.settings
+    preview_dir = os.path.join(settings['out_dir'], 'preview')
+    if preview_frames > 0 and not os.path.isdir(preview_dir):
+        os.makedirs(preview_dir)
+    copied = {} # name -> (size, mtime) of the copied source, to avoid re-copying unchanged files
+    last_seen = {} # name -> (size, mtime) at the last scan, for files not yet complete
+    first_seen = {} # name -> time it was first found, to time how long it took for the file to be complete
+    while True:
+        for entry in sorted(os.scandir(source_dir), key = lambda e: e.name):
+            if not entry.is_file() or not fnmatch.fnmatch(entry.name, pattern):
+                continue
+            dest = os.path.join(dest_dir, entry.name)
+            stat = entry.stat()
+            if copied.get(entry.name) == (stat.st_size, stat.st_mtime):
+                continue
+            if os.path.exists(dest) and os.path.getsize(dest) == stat.st_size:
+                ## already copied in a previous session, only make sure it has been processed
+                copied[entry.name] = (stat.st_size, stat.st_mtime)
+                if not otf_pipeline.is_processed(dest, settings):
+                    processor.submit(dest)
+                continue
+            first_seen.setdefault(entry.name, time.time())
+            ## files still being written are looked at again on the next scan, the other files are copied meanwhile
+            if not file_is_stable(stat, last_seen.get(entry.name), min_size, interval):
+                last_seen[entry.name] = (stat.st_size, stat.st_mtime)
+                if VERBOSE:
+                    print("%s found, but file size incorrect, skipping..." % entry.name)
+                continue
+            last_seen.pop(entry.name, None)
+            timings = otf_metrics.MicrographTimings(dest)
+            timings.add('wait_for_stable', time.time() - first_seen.pop(entry.name))
+            on_chunk = preview_starter(entry.name, settings, preview_frames, preview_dir) if preview_frames > 0 else None
+            try:
+                with timings.stage('copy'):
+                    dest, size, crc = copy_verified(entry.path, dest_dir, on_chunk = on_chunk)
+            except IOError as e:
+                print(" !!! ERROR: %s, retrying ..." % e)
+                continue
+            stat = os.stat(entry.path)
+            copied[entry.name] = (stat.st_size, stat.st_mtime)
+            print(">> Copied %s (%0.1f MB in %0.1f s, crc32 %08x)" % (entry.name, size / 1e6, timings.stages['copy']['wall'], crc))
+            if not otf_pipeline.is_processed(dest, settings):
+                processor.submit(dest, timings)
+        time.sleep(interval)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Copy new movies and send them straight for on-the-fly processing")
+    parser.add_argument('source', help = "full SOURCE path (e.g. /raidy/Alex/img_dir/)")
+    parser.add_argument('dest', help = "full DEST path, processing results are written below the current directory")
+    parser.add_argument('--pattern', default = '*.tif', help = "movies to copy (default: *.tif)")
+    parser.add_argument('--min-size', type = int, default = 0, help = "expected minimum size of a full image (bytes)")
+    parser.add_argument('--preview-frames', type = int, default = 0, help = "start a quick preview from the first N frames")
+    otf_pipeline.add_settings_args(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dest):
+        os.makedirs(args.dest)
+    settings = otf_pipeline.settings_from_args(args)
+    otf_pipeline.init_output_dirs(settings)
+    otf_pipeline.init_logfile(settings)
+
+    processor, metrics = otf_pipeline.processor_from_args(settings, args)
+    try:
+        copy_and_process(args.source, args.dest, processor, args.pattern, args.min_size, args.preview_frames)
+    except KeyboardInterrupt:
+        print("\nScript terminated by user.")
+        sys.exit()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to read .MRC files and write preview .GIFs directly from Python, without EMAN2 or ImageMagick.
+
+""" Small NumPy-based image I/O helpers shared by the on-the-fly scripts:
+        read_mrc_header() / mrc_memmap() = memory-mapped access to .MRC images (only the pages actually used are read)
+        write_mrc()                      = write a 2D image as a float32 .MRC
+        tiff_frames()                    = read the frames of a .TIF movie one at a time
+        to_uint8(), bin_image(), ...     = display scaling of micrographs
+        gif_bytes() / write_gif()        = grayscale .GIF encoder readable by Tk's PhotoImage (see also gif_levels())
+        read_gif()                       = decode the first image of a .GIF as grayscale
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+import os
+import zlib
+import struct
+
+import numpy as np
+
+try:
+    import imagecodecs # optional, much faster decoding of LZW compressed .TIF movies
+except ImportError:
+    imagecodecs = None
+
+## MRC mode -> NumPy data type
+MRC_MODES = { 0 : np.int8, 1 : np.int16, 2 : np.float32, 6 : np.uint16, 12 : np.float16 }
+
+GIF_LEVELS = 128 # gray levels in written .GIFs (7-bit, see gif_bytes())
+
+## TIFF field type -> (struct format, size in bytes)
+TIFF_TYPES = { 1 : ('B', 1), 3 : ('H', 2), 4 : ('I', 4), 16 : ('Q', 8) }
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def read_mrc_header(path):
+    """ Read the parts of an .MRC header needed to map its data, returns a dictionary with the keys:
+            nx, ny, nz, mode, dtype, offset (start of the image data in bytes), angpix
+    """
+    with open(path, 'rb') as f:
+        header = f.read(1024)
+    if len(header) < 1024:
+        raise ValueError("%s is too short to be an .MRC file" % path)
+    ## machine stamp 0x11 = big-endian, otherwise assume little-endian
+    endian = '>' if header[212] == 0x11 else '<'
+    nx, ny, nz, mode = struct.unpack(endian + '4i', header[0:16])
+    mx = struct.unpack(endian + 'i', header[28:32])[0]
+    cella_x = struct.unpack(endian + 'f', header[40:44])[0]
+    nsymbt = struct.unpack(endian + 'i', header[92:96])[0]
+    if not mode in MRC_MODES:
+        raise ValueError("%s has unsupported .MRC mode %s" % (path, mode))
+    angpix = cella_x / mx if mx > 0 and cella_x > 0 else 1.0
+    return { 'nx' : nx, 'ny' : ny, 'nz' : nz, 'mode' : mode, 'dtype' : np.dtype(MRC_MODES[mode]).newbyteorder(endian),
+             'offset' : 1024 + nsymbt, 'angpix' : angpix }
+
+def mrc_memmap(path, header = None):
+    """ Memory map the image data of an .MRC file, returns an array of shape (ny, nx) for a single image or
+        (nz, ny, nx) for a stack. Row 0 is the first row stored in the file.
+    """
+    if header is None:
+        header = read_mrc_header(path)
+    shape = (header['ny'], header['nx']) if header['nz'] == 1 else (header['nz'], header['ny'], header['nx'])
+    return np.memmap(path, dtype = header['dtype'], mode = 'r', offset = header['offset'], shape = shape)
+
+def read_mrc_labels(path):
+    """ Text labels of an .MRC header (up to 10 lines of 80 characters)
+    """
+    with open(path, 'rb') as f:
+        header = f.read(1024)
+    n_labels = struct.unpack(('>' if header[212] == 0x11 else '<') + 'i', header[220:224])[0]
+    return [header[224 + 80 * i:304 + 80 * i].decode('ascii', 'replace').rstrip() for i in range(min(max(n_labels, 0), 10))]
+
+def mrc_header_bytes(nx, ny, nz = 1, mode = 2, angpix = 1.0, stats = (0.0, 0.0, 0.0), labels = ()):
+    """ Build a 1024 byte little-endian MRC2014 header
+    """
+    header = bytearray(1024)
+    struct.pack_into('<10i', header, 0, nx, ny, nz, mode, 0, 0, 0, nx, ny, nz)
+    struct.pack_into('<6f', header, 40, nx * angpix, ny * angpix, nz * angpix, 90, 90, 90)
+    struct.pack_into('<3i', header, 64, 1, 2, 3)
+    struct.pack_into('<3f', header, 76, *stats) # dmin, dmax, dmean
+    header[208:212] = b'MAP '
+    header[212:216] = b'\x44\x44\x00\x00'
+    labels = list(labels)[:10]
+    struct.pack_into('<i', header, 220, len(labels))
+    for i, label in enumerate(labels):
+        header[224 + 80 * i:304 + 80 * i] = label.encode('ascii', 'replace')[:80].ljust(80)
+    return bytes(header)
+
+def write_mrc(path, image, angpix = 1.0, labels = ()):
+    """ Write a 2D image as a float32 .MRC file
+    """
+    image = np.asarray(image, dtype = np.float32)
+    ny, nx = image.shape
+    stats = (float(image.min()), float(image.max()), float(image.mean()))
+    with open(path, 'wb') as f:
+        f.write(mrc_header_bytes(nx, ny, angpix = angpix, stats = stats, labels = labels))
+        f.write(np.ascontiguousarray(image, dtype = '<f4').tobytes())
+
+def bin_image(image, factor):
+    """ Mean shrink an image by an integer factor (edges that do not fill a whole bin are cropped)
+    """
+    if factor <= 1:
+        return np.asarray(image, dtype = np.float32)
+    ny, nx = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    binned = np.asarray(image[:ny, :nx], dtype = np.float32).reshape(ny // factor, factor, nx // factor, factor)
+    return binned.mean(axis = (1, 3))
+
+def resize_nearest(image, shape):
+    """ Nearest neighbour resize, enough for display purposes
+    """
+    rows = (np.arange(shape[0]) * image.shape[0] / shape[0]).astype(np.intp)
+    cols = (np.arange(shape[1]) * image.shape[1] / shape[1]).astype(np.intp)
+    return image[rows[:, None], cols[None, :]]
+
+def gaussian_lowpass(image, cutoff_freq):
+    """ Gaussian low-pass filter in Fourier space, 'cutoff_freq' in 1/pixel (as e2proc2d.py filter.lowpass.gauss)
+    """
+    fy = np.fft.fftfreq(image.shape[0]).astype(np.float32)
+    fx = np.fft.rfftfreq(image.shape[1]).astype(np.float32)
+    gauss = np.exp(-(fy[:, None] ** 2 + fx[None, :] ** 2) / (2 * cutoff_freq ** 2))
+    return np.fft.irfft2(np.fft.rfft2(image) * gauss, s = image.shape).astype(np.float32)
+
+def to_uint8(image, low_percentile = 0.5, high_percentile = 99.5, levels = 256):
+    """ Scale an image to 0 .. levels-1 for display, clipping the given percentiles
+    """
+    image = np.asarray(image, dtype = np.float32)
+    low, high = np.percentile(image[::4, ::4], (low_percentile, high_percentile))
+    if high <= low:
+        high = low + 1
+    scaled = (image - low) * ((levels - 1) / (high - low))
+    return np.clip(scaled, 0, levels - 1).astype(np.uint8)
+
+def gif_bytes(image):
+    """ Encode a 2D image (0 .. GIF_LEVELS-1, uint8) as a grayscale .GIF in memory.
+        The LZW stream uses 7-bit pixels with a fixed 8-bit code width: a clear code is sent before the code table
+        can grow past 8 bits, so every code is exactly one byte and the whole stream is built with array operations
+        instead of a per-pixel LZW loop (at the cost of no compression).
+    """
+    image = np.asarray(image, dtype = np.uint8)
+    height, width = image.shape
+    pixels = np.minimum(image.ravel(), GIF_LEVELS - 1)
+    clear_code, end_code = GIF_LEVELS, GIF_LEVELS + 1
+    run = 125 # literal codes between clear codes, keeps the table below 256 entries
+    n_runs = -(-pixels.size // run)
+    codes = np.full((n_runs, run + 1), 0, dtype = np.uint8)
+    codes[:, 0] = clear_code
+    padded = np.zeros(n_runs * run, dtype = np.uint8)
+    padded[:pixels.size] = pixels
+    codes[:, 1:] = padded.reshape(n_runs, run)
+    stream = codes.ravel()[:pixels.size + n_runs]
+    stream = np.concatenate((stream, np.array([end_code], dtype = np.uint8)))
+    ## split the stream into data sub-blocks of up to 255 bytes, each preceded by its length
+    n_blocks = -(-stream.size // 255)
+    blocks = np.zeros((n_blocks, 256), dtype = np.uint8)
+    blocks[:, 0] = 255
+    padded_stream = np.zeros(n_blocks * 255, dtype = np.uint8)
+    padded_stream[:stream.size] = stream
+    blocks[:, 1:] = padded_stream.reshape(n_blocks, 255)
+    last_block_size = stream.size - (n_blocks - 1) * 255
+    blocks[-1, 0] = last_block_size
+    data = blocks.ravel()[:(n_blocks - 1) * 256 + 1 + last_block_size].tobytes()
+    gray = (np.arange(GIF_LEVELS) * 255 // (GIF_LEVELS - 1)).astype(np.uint8)
+    palette = np.repeat(gray, 3).tobytes()
+    header = b'GIF89a' + struct.pack('<HHBBB', width, height, 0xE6, 0, 0) # global color table of 2^7 entries
+    descriptor = b'\x2c' + struct.pack('<HHHHB', 0, 0, width, height, 0)
+    return header + palette + descriptor + bytes([7]) + data + b'\x00\x3b'
+
+def gif_levels(image):
+    """ A 2D image as the gray levels of a .GIF (0 .. GIF_LEVELS-1, uint8), scaled with to_uint8() unless it already is
+    """
+    image = np.asarray(image)
+    if image.dtype != np.uint8 or image.max() >= GIF_LEVELS:
+        image = to_uint8(image, levels = GIF_LEVELS)
+    return image
+
+def write_gif(path, image):
+    """ Write a 2D image (any range, scaled with to_uint8()) as a grayscale .GIF. The file is written under a temporary
+        name and renamed into place, so viewers never load a half-written image.
+    """
+    temp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.part')
+    with open(temp_path, 'wb') as f:
+        f.write(gif_bytes(gif_levels(image)))
+    os.replace(temp_path, path)
+
+def lzw_decode(data, min_code_size):
+    """ Decode the LZW stream of a .GIF image into its color indices
+    """
+    clear_code, end_code = 1 << min_code_size, (1 << min_code_size) + 1
+    base_table = [bytes([i]) for i in range(clear_code)] + [b'', b'']
+    table = list(base_table)
+    code_size = min_code_size + 1
+    out = bytearray()
+    bits, n_bits, prev = 0, 0, None
+    for byte in data:
+        bits |= byte << n_bits
+        n_bits += 8
+        while n_bits >= code_size:
+            code = bits & ((1 << code_size) - 1)
+            bits >>= code_size
+            n_bits -= code_size
+            if code == clear_code:
+                table = list(base_table)
+                code_size = min_code_size + 1
+                prev = None
+                continue
+            if code == end_code:
+                return out
+            if prev is None:
+                entry = table[code]
+            else:
+                entry = table[code] if code < len(table) else prev + prev[:1]
+                if len(table) < 4096:
+                    table.append(prev + entry[:1])
+            out += entry
+            prev = entry
+            if len(table) == (1 << code_size) and code_size < 12:
+                code_size += 1
+    return out
+
+def tiff_lzw_decode(data):
+    """ Decode a TIFF LZW strip (codes packed most significant bit first, code width grows one code early)
+    """
+    if imagecodecs is not None:
+        return imagecodecs.lzw_decode(data)
+    base_table = [bytes([i]) for i in range(256)] + [b'', b'']
+    table = list(base_table)
+    padded = bytes(data) + b'\x00\x00\x00'
+    n_total = len(data) * 8
+    out = bytearray()
+    bit_pos, code_size, prev = 0, 9, None
+    while bit_pos + code_size <= n_total:
+        byte = bit_pos >> 3
+        code = (int.from_bytes(padded[byte:byte + 3], 'big') >> (24 - code_size - (bit_pos & 7))) & ((1 << code_size) - 1)
+        bit_pos += code_size
+        if code == 256:
+            table = list(base_table)
+            code_size = 9
+            prev = None
+            continue
+        if code == 257:
+            break
+        if prev is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else prev + prev[:1]
+            table.append(prev + entry[:1])
+        out += entry
+        prev = entry
+        if len(table) + 1 >= (1 << code_size) and code_size < 12:
+            code_size += 1
+    return out
+
+def tiff_ifds(f):
+    """ Read the image file directories of an open (classic or Big) TIFF file, returns (byte order, list of
+        { tag : values }) for the tags needed to read uncompressed, LZW or deflate compressed grayscale strips
+    """
+    f.seek(0)
+    order = f.read(2)
+    if order not in (b'II', b'MM'):
+        raise ValueError("%s is not a TIFF file" % f.name)
+    endian = '<' if order == b'II' else '>'
+    version = struct.unpack(endian + 'H', f.read(2))[0]
+    if version == 42:
+        offset = struct.unpack(endian + 'I', f.read(4))[0]
+        count_fmt, entry_fmt, value_size = 'H', 'HHI', 4
+    elif version == 43:
+        f.read(4)
+        offset = struct.unpack(endian + 'Q', f.read(8))[0]
+        count_fmt, entry_fmt, value_size = 'Q', 'HHQ', 8
+    else:
+        raise ValueError("%s is not a TIFF file" % f.name)
+    entry_size = struct.calcsize(endian + entry_fmt) + value_size
+    ifds = []
+    while offset:
+        f.seek(offset)
+        n_entries = struct.unpack(endian + count_fmt, f.read(struct.calcsize(count_fmt)))[0]
+        entries = f.read(n_entries * entry_size)
+        next_offset = f.read(value_size)
+        ifd = {}
+        for i in range(n_entries):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            tag, field_type, count = struct.unpack(endian + entry_fmt, entry[:-value_size])
+            if tag not in (256, 257, 258, 259, 273, 277, 278, 279, 317, 339) or field_type not in TIFF_TYPES:
+                continue
+            fmt, size = TIFF_TYPES[field_type]
+            if count * size <= value_size:
+                raw = entry[-value_size:][:count * size]
+            else:
+                position = f.tell()
+                f.seek(struct.unpack(endian + ('I' if value_size == 4 else 'Q'), entry[-value_size:])[0])
+                raw = f.read(count * size)
+                f.seek(position)
+            ifd[tag] = struct.unpack(endian + fmt * count, raw)
+        ifds.append(ifd)
+        if len(next_offset) < value_size:
+            break
+        offset = struct.unpack(endian + ('I' if value_size == 4 else 'Q'), next_offset)[0]
+    return endian, ifds
+
+def tiff_frame(f, endian, ifd):
+    """ Read one frame of an open TIFF file from its directory, as a 2D array (row 0 is the first row stored)
+    """
+    width, height = ifd[256][0], ifd[257][0]
+    bits = ifd.get(258, (1,))[0]
+    compression = ifd.get(259, (1,))[0]
+    sample_format = ifd.get(339, (1,))[0]
+    if ifd.get(277, (1,))[0] != 1:
+        raise ValueError("%s is not a grayscale TIFF" % f.name)
+    chunks = []
+    for offset, count in zip(ifd[273], ifd[279]):
+        f.seek(offset)
+        chunk = f.read(count)
+        if compression == 5:
+            chunk = tiff_lzw_decode(chunk)
+        elif compression in (8, 32946):
+            chunk = zlib.decompress(chunk)
+        elif compression != 1:
+            raise ValueError("%s uses unsupported TIFF compression %s" % (f.name, compression))
+        chunks.append(chunk)
+    data = b''.join(chunks)
+    if bits == 4:
+        ## two pixels per byte, high nibble first, each row padded to whole bytes
+        row_bytes = (width + 1) // 2
+        packed = np.frombuffer(data, dtype = np.uint8)[:row_bytes * height].reshape(height, row_bytes)
+        frame = np.empty((height, row_bytes * 2), dtype = np.uint8)
+        frame[:, 0::2], frame[:, 1::2] = packed >> 4, packed & 0x0F
+        frame = frame[:, :width]
+    else:
+        kind = { 1 : 'u', 2 : 'i', 3 : 'f' }[sample_format]
+        dtype = np.dtype(endian + kind + str(bits // 8)) if bits > 8 else np.dtype(kind + '1')
+        frame = np.frombuffer(data, dtype = dtype)[:width * height].reshape(height, width)
+    if ifd.get(317, (1,))[0] == 2:
+        ## horizontal differencing predictor
+        frame = np.cumsum(frame, axis = 1, dtype = frame.dtype)
+    return frame
+
+def tiff_frames(path, first = 0, last = None):
+    """ Iterate over the frames first .. last-1 of a multi-frame .TIF movie, reading one frame at a time
+    """
+    with open(path, 'rb') as f:
+        endian, ifds = tiff_ifds(f)
+        for ifd in ifds[first:last]:
+            yield tiff_frame(f, endian, ifd)
+
+def read_gif(path, data = None):
+    """ Read the first image of a .GIF file as a 2D uint8 grayscale array (mean of the RGB palette), row 0 at the top.
+        The bytes of the file can be given as 'data' (e.g. from a preview pack, see otf_packstore.py)
+    """
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+    if data[:3] != b'GIF':
+        raise ValueError("%s is not a .GIF file" % path)
+    flags = data[10]
+    pos = 13
+    palette = None
+    if flags & 0x80:
+        palette_size = 3 * 2 ** ((flags & 0x07) + 1)
+        palette = data[pos:pos + palette_size]
+        pos += palette_size
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21: ## extension, skip its sub-blocks
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        elif block == 0x2C: ## image descriptor
+            width, height, image_flags = struct.unpack('<HHB', data[pos + 5:pos + 10])
+            pos += 10
+            if image_flags & 0x80:
+                palette_size = 3 * 2 ** ((image_flags & 0x07) + 1)
+                palette = data[pos:pos + palette_size]
+                pos += palette_size
+            min_code_size = data[pos]
+            pos += 1
+            chunks = []
+            while data[pos]:
+                chunks.append(data[pos + 1:pos + 1 + data[pos]])
+                pos += data[pos] + 1
+            indices = np.zeros(width * height, dtype = np.uint8)
+            decoded = np.frombuffer(bytes(lzw_decode(b''.join(chunks), min_code_size)), dtype = np.uint8)[:width * height]
+            indices[:decoded.size] = decoded
+            indices = indices.reshape(height, width)
+            if image_flags & 0x40: ## interlaced: rows are stored in 4 passes
+                rows = np.concatenate([np.arange(start, height, step) for start, step in ((0, 8), (4, 8), (2, 4), (1, 2))])
+                deinterlaced = np.empty_like(indices)
+                deinterlaced[rows] = indices
+                indices = deinterlaced
+            if palette is None:
+                return indices
+            gray = np.frombuffer(palette, dtype = np.uint8).reshape(-1, 3).mean(axis = 1).astype(np.uint8)
+            gray = np.concatenate((gray, np.zeros(256 - gray.size, dtype = np.uint8)))
+            return gray[indices]
+        else:
+            break
+    raise ValueError("%s holds no image" % path)
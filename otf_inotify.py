@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so the viewers can follow a session live without polling the log file.
+
+""" Minimal Linux inotify wrapper (ctypes, no extra packages) to be told when files in a directory are written or
+    renamed into place. The file descriptor can be handed to Tk's createfilehandler() so a viewer wakes up only
+    when something changed:
+        watcher = otf_inotify.Inotify()
+        watcher.add_watch('on-the-fly_processing', otf_inotify.FILE_LANDED)
+        for wd, mask, name in watcher.read_events(): ...
+    Note that inotify only sees changes made on the local host: on network storage written by another host, viewers
+    fall back to checking the size of the log file (see 'on-the-fly_logviewer.py').
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+## a file was appended to, or a new file is complete (written and closed, or renamed into place)
+FILE_LANDED = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def available():
+    return sys.platform.startswith('linux') and ctypes.util.find_library('c') is not None
+
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {} # wd -> directory
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, directory, mask = FILE_LANDED):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed on %s" % directory)
+        self.watches[wd] = directory
+        return wd
+
+    def read_events(self):
+        """ Return the pending events as a list of (wd, mask, name), without blocking
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors = 'replace')
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to browse several sessions (e.g. the TF30 and F20 collecting in parallel, or several grids) at once.
+
+""" Read several 'on-the-fly_data.log' files and stream-merge their entries into one sequence, with a k-way merge
+    (heapq.merge) that holds only one pending line per log in memory. Entries are merged by the time they were written
+    (the 'time=' column written by 'otf_pipeline.py'; for older logs, the time the micrograph .GIF was written) or by
+    micrograph number. Each log is expected to already be in that order, as it is when written during collection.
+    Every entry carries its own session, name prefix and image directories, so sessions with different names or layouts
+    can be browsed together (see 'on-the-fly_logviewer.py', File > Open several log files).
+        $ otf_logmerge.py TF30/on-the-fly_data.log F20/on-the-fly_data.log            (merged entries)
+        $ otf_logmerge.py */on-the-fly_data.log --stats                              (statistics per session)
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import time
+import heapq
+import argparse
+import collections
+
+ORDERS = ('time', 'number')
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def session_labels(log_paths):
+    """ Short label of each log: the name of its directory, or its full path where names are not unique
+    """
+    names = [os.path.basename(os.path.dirname(os.path.abspath(path))) for path in log_paths]
+    counts = collections.Counter(names)
+    return [name if counts[name] == 1 else os.path.abspath(path) for name, path in zip(names, log_paths)]
+
+def parse_entry(line):
+    """ Split a log file line into (name, columns, flags, fields): the micrograph name without extension, its columns
+        as read by the logviewer (CTF fit, avg. dZ, ...), the number of '*' warnings and any 'key=value' columns
+    """
+    column = line.split()
+    name = os.path.splitext(column[0])[0]
+    flags = sum(token.count('*') for token in column[1:] if token.strip('*') == '')
+    fields = dict(token.split('=', 1) for token in column[1:] if '=' in token)
+    return name, tuple(column[1:]), flags, fields
+
+def image_number(name):
+    try:
+        return int(name.rsplit('_', 1)[-1])
+    except ValueError:
+        return -1
+
+class LogReader:
+    """ Reads the entries of one log file, continuing from where the last read stopped (only complete lines are read,
+        so a line still being written is picked up next time)
+    """
+    def __init__(self, path, session = None):
+        self.path = path
+        self.log_dir = os.path.dirname(os.path.abspath(path))
+        self.session = session if session is not None else session_labels([path])[0]
+        self.offset = 0
+        self.img_dir = 'on-the-fly_processing/'
+        self.ctf_dir = 'on-the-fly_processing/CTF/'
+
+    def entries(self, with_gif_time = False):
+        """ Generator of the entries added since the last read, each a dictionary with the keys:
+                name, prefix, number, data (columns as in the logviewer), flags, fields, time, session, log, img_dir, ctf_dir
+            With with_gif_time, entries without a 'time=' column get the time their .GIF was written instead
+        """
+        if os.path.getsize(self.path) < self.offset:
+            self.offset = 0 # rewritten
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    break
+                self.offset += len(raw_line)
+                line = raw_line.decode(errors = 'replace')
+                if line[:1] == '#':
+                    if 'Motion_corrected_images' in line:
+                        self.img_dir = line.split()[2]
+                    elif 'CTF_fit_images' in line:
+                        self.ctf_dir = line.split()[2]
+                    continue
+                if not line.strip():
+                    continue
+                name, data, flags, fields = parse_entry(line)
+                entry = { 'name' : name, 'prefix' : name.rsplit('_', 1)[0] + '_', 'number' : image_number(name),
+                          'data' : data, 'flags' : flags, 'fields' : fields, 'time' : fields.get('time', ''),
+                          'session' : self.session, 'log' : self.path, 'img_dir' : self.img_dir, 'ctf_dir' : self.ctf_dir }
+                if with_gif_time and not entry['time']:
+                    entry['time'] = gif_time(entry)
+                yield entry
+
+def gif_path(entry, ctf = False):
+    if ctf:
+        return os.path.join(os.path.dirname(os.path.abspath(entry['log'])), entry['ctf_dir'], entry['name'] + '_CTF.gif')
+    return os.path.join(os.path.dirname(os.path.abspath(entry['log'])), entry['img_dir'], entry['name'] + '.gif')
+
+def gif_time(entry):
+    """ Time the .GIF of an entry was written, in the format of the 'time=' column (or '' if there is no .GIF)
+    """
+    try:
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(os.path.getmtime(gif_path(entry))))
+    except OSError:
+        return ''
+
+def sort_key(order):
+    if order == 'time':
+        return lambda entry: entry['time']
+    return lambda entry: (entry['number'], entry['session'])
+
+def merge_entries(streams, order = 'time'):
+    """ k-way merge of several entry streams (each already in the given order) into one
+    """
+    return heapq.merge(*streams, key = sort_key(order))
+
+def merge_logs(log_paths, order = 'time'):
+    """ Open several logs and merge their entries, returns (readers, merged entry generator)
+    """
+    readers = [LogReader(path, session) for path, session in zip(log_paths, session_labels(log_paths))]
+    return readers, merge_entries([reader.entries(with_gif_time = order == 'time') for reader in readers], order)
+
+def summarize(entries):
+    """ Statistics per session (and over all sessions) from a stream of entries, without keeping the entries
+    """
+    stats = collections.OrderedDict()
+    for entry in entries:
+        for session in (entry['session'], 'all sessions'):
+            session_stats = stats.setdefault(session, { 'micrographs' : 0, 'flagged' : 0, 'fit_res_sum' : 0.0,
+                                                        'dZ_sum' : 0.0, 'fitted' : 0, 'best_fit_res' : None })
+            session_stats['micrographs'] += 1
+            session_stats['flagged'] += 1 if entry['flags'] else 0
+            try:
+                fit_res, dZ = float(entry['data'][0]), float(entry['data'][1])
+            except (IndexError, ValueError):
+                continue
+            session_stats['fitted'] += 1
+            session_stats['fit_res_sum'] += fit_res
+            session_stats['dZ_sum'] += dZ
+            if session_stats['best_fit_res'] is None or fit_res < session_stats['best_fit_res']:
+                session_stats['best_fit_res'] = fit_res
+    ## 'all sessions' last
+    if 'all sessions' in stats:
+        stats.move_to_end('all sessions')
+    return stats
+
+def format_stats(stats):
+    lines = ["%-30s %8s %8s %10s %10s %10s" % ("Session", "Images", "Flagged", "Mean fit", "Best fit", "Mean dZ")]
+    for session, s in stats.items():
+        fitted = max(s['fitted'], 1)
+        lines.append("%-30s %8d %8d %9.1fA %9.1fA %8.2fum" % (session[-30:], s['micrographs'], s['flagged'],
+                     s['fit_res_sum'] / fitted, s['best_fit_res'] or 0, s['dZ_sum'] / fitted))
+    return '\n'.join(lines)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Merge several on-the-fly log files into one stream")
+    parser.add_argument('logs', nargs = '+', help = "on-the-fly_data.log files")
+    parser.add_argument('--order', choices = ORDERS, default = 'time', help = "merge by time written or micrograph number")
+    parser.add_argument('--stats', action = 'store_true', help = "print statistics per session instead of the entries")
+    args = parser.parse_args()
+
+    readers, entries = merge_logs(args.logs, args.order)
+    try:
+        if args.stats:
+            print(format_stats(summarize(entries)))
+        else:
+            for entry in entries:
+                print("%-20s %-38s %s" % (entry['session'][-20:], entry['name'], ' '.join(entry['data'])))
+    except BrokenPipeError:
+        ## e.g. piped into 'head'
+        sys.stderr.close()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to record where the time goes in the processing loop, instead of just printing the 'time' of MotionCor2.
+
+""" Per-stage timing instrumentation for the on-the-fly processing pipeline (see 'otf_pipeline.py').
+    Every stage of a micrograph (e.g. wait_for_stable, motioncor2, render, ctffind, log_write) records its wall time and
+    CPU time, where CPU time includes the external programs it ran (MotionCor2, ctffind, ...). Time spent waiting in the
+    processing queue is recorded as well. Each micrograph is written as one JSON line into 'on-the-fly_metrics.log' and
+    fed into histograms (cumulative since start, as Prometheus expects) and percentiles of the most recent micrographs,
+    served in Prometheus text format on a local HTTP endpoint:
+        $ curl http://127.0.0.1:9105/metrics
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import json
+import time
+import bisect
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+## histogram bucket upper bounds (seconds), chosen to span a quick render up to a slow MotionCor2 run
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+WINDOW = 1000 # number of most recent observations the percentiles are taken from
+QUANTILES = (0.5, 0.9, 0.99)
+
+## CPU time used by child processes of the current thread, added by otf_pipeline.run_quiet()
+_thread_state = threading.local()
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def add_child_cpu(seconds):
+    _thread_state.child_cpu = child_cpu() + seconds
+
+def child_cpu():
+    return getattr(_thread_state, 'child_cpu', 0.0)
+
+class MicrographTimings:
+    """ Collects the timings of each stage of one micrograph, use as:
+            timings = MicrographTimings('Name_0001.tif')
+            with timings.stage('motioncor2'):
+                ...
+    """
+    def __init__(self, name, queue_wait = 0.0):
+        self.name = name
+        self.queue_wait = queue_wait
+        self.mode = None # quality mode the micrograph was processed in (see otf_scheduler.py)
+        self.stages = collections.OrderedDict() # stage -> {'wall' : s, 'cpu' : s}
+        self.start_time = time.time()
+
+    def stage(self, stage_name):
+        return _StageTimer(self, stage_name)
+
+    def add(self, stage_name, wall, cpu = 0.0):
+        """ Add time to a stage (stages run more than once are summed)
+        """
+        entry = self.stages.setdefault(stage_name, { 'wall' : 0.0, 'cpu' : 0.0 })
+        entry['wall'] += wall
+        entry['cpu'] += cpu
+
+    def total_wall(self):
+        return sum(entry['wall'] for entry in self.stages.values())
+
+    def as_dict(self):
+        return { 'name' : self.name, 'time' : round(self.start_time, 3), 'queue_wait' : round(self.queue_wait, 4),
+                 'mode' : self.mode,
+                 'stages' : { stage_name : { key : round(value, 4) for key, value in entry.items() }
+                              for stage_name, entry in self.stages.items() } }
+
+class _StageTimer:
+    def __init__(self, timings, stage_name):
+        self.timings = timings
+        self.stage_name = stage_name
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time() + child_cpu()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() + child_cpu() - self.cpu_start
+        self.timings.add(self.stage_name, wall, cpu)
+        return False
+
+class StageHistogram:
+    """ Histogram of every observation since start (bucket counts, sum and count only ever grow, so Prometheus can take
+        rates of them), and the most recent WINDOW observations for percentiles
+    """
+    def __init__(self, window = WINDOW):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.values = collections.deque(maxlen = window)
+
+    def observe(self, value):
+        ## non-cumulative here, summed up in snapshot()
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.total += value
+        self.count += 1
+        self.values.append(value)
+
+    def snapshot(self):
+        """ Return (bucket_counts, sum, count), with cumulative counts for each bound in BUCKETS
+        """
+        counts, running = [], 0
+        for bucket_count in self.counts:
+            running += bucket_count
+            counts.append(running)
+        return counts, self.total, self.count
+
+    def quantile(self, q):
+        values = sorted(self.values)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+class Metrics:
+    """ Thread-safe registry of histograms for every (stage, kind) pair, where kind is 'wall', 'cpu' or
+        'queue_wait'. Optionally writes each recorded micrograph as a JSON line into 'logfile'.
+    """
+    def __init__(self, logfile = None):
+        self.logfile = logfile
+        self.lock = threading.Lock()
+        self.histograms = collections.OrderedDict()
+        self.gauges = collections.OrderedDict() # name -> callable returning the current value
+        self.micrographs = 0
+
+    def histogram(self, kind, stage_name):
+        key = (kind, stage_name)
+        if not key in self.histograms:
+            self.histograms[key] = StageHistogram()
+        return self.histograms[key]
+
+    def observe(self, kind, stage_name, value):
+        with self.lock:
+            self.histogram(kind, stage_name).observe(value)
+
+    def add_gauge(self, name, function):
+        self.gauges[name] = function
+
+    def record(self, timings):
+        """ Add the timings of one micrograph to the histograms and the structured log
+        """
+        with self.lock:
+            self.micrographs += 1
+            self.histogram('queue_wait', 'queue').observe(timings.queue_wait)
+            for stage_name, entry in timings.stages.items():
+                self.histogram('wall', stage_name).observe(entry['wall'])
+                self.histogram('cpu', stage_name).observe(entry['cpu'])
+            if self.logfile is not None:
+                with open(self.logfile, 'a') as f:
+                    f.write(json.dumps(timings.as_dict()) + '\n')
+        if VERBOSE:
+            print(json.dumps(timings.as_dict()))
+
+    def prometheus_text(self):
+        """ Format all histograms and gauges in the Prometheus text exposition format
+        """
+        names = { 'wall' : ('otf_stage_wall_seconds', "Wall time of each pipeline stage per micrograph"),
+                  'cpu' : ('otf_stage_cpu_seconds', "CPU time (including external programs) of each pipeline stage per micrograph"),
+                  'queue_wait' : ('otf_queue_wait_seconds', "Time each micrograph waited in the processing queue") }
+        lines = []
+        with self.lock:
+            for kind, (metric, help_text) in names.items():
+                keys = [key for key in self.histograms if key[0] == kind]
+                if not keys:
+                    continue
+                lines.append("# HELP %s %s" % (metric, help_text))
+                lines.append("# TYPE %s histogram" % metric)
+                for key in keys:
+                    counts, total, count = self.histograms[key].snapshot()
+                    label = 'stage="%s"' % key[1]
+                    for bound, bucket_count in zip(BUCKETS, counts):
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, label, bound, bucket_count))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, label, count))
+                    lines.append('%s_sum{%s} %f' % (metric, label, total))
+                    lines.append('%s_count{%s} %d' % (metric, label, count))
+            ## percentiles of the recent micrographs can go down as well as up, so they are gauges and not part of the histograms
+            for kind, (metric, help_text) in names.items():
+                keys = [key for key in self.histograms if key[0] == kind and self.histograms[key].values]
+                if not keys:
+                    continue
+                lines.append("# HELP %s_recent %s, percentiles of the last %s micrographs" % (metric, help_text, WINDOW))
+                lines.append("# TYPE %s_recent gauge" % metric)
+                for key in keys:
+                    for q in QUANTILES:
+                        lines.append('%s_recent{stage="%s",quantile="%s"} %f' % (metric, key[1], q, self.histograms[key].quantile(q)))
+            lines.append("# HELP otf_micrographs_total Micrographs processed since start")
+            lines.append("# TYPE otf_micrographs_total counter")
+            lines.append("otf_micrographs_total %d" % self.micrographs)
+        for name, function in self.gauges.items():
+            lines.append("# TYPE %s gauge" % name)
+            lines.append("%s %s" % (name, function()))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """ Return a short text summary with the median and 90th percentile wall time of each stage
+        """
+        lines = []
+        with self.lock:
+            for (kind, stage_name), histogram in self.histograms.items():
+                if kind == 'cpu':
+                    continue
+                lines.append("%-16s p50 = %7.2f s   p90 = %7.2f s" % (stage_name, histogram.quantile(0.5), histogram.quantile(0.9)))
+        return '\n'.join(lines)
+
+def start_http_server(metrics, port, host = '127.0.0.1'):
+    """ Serve the metrics on http://host:port/metrics from a background thread, returns the server
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if VERBOSE:
+                BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    print("Metrics served on http://%s:%s/metrics" % (host, server.server_address[1]))
+    return server
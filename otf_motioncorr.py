@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so movies are still motion corrected on hosts without a GPU, or while every GPU is busy.
+
+""" Whole-frame motion correction on the CPU with NumPy, in place of MotionCor2 (same inputs, same corrected .MRC).
+    The frames of a .TIF movie (or .MRC stack) are read one at a time by a pool of processes, gain and defect corrected
+    and binned by FtBin, so only the binned frames are held in memory. Binned copies of the frames are then aligned by
+    cross-correlation against the sum of all other frames, iterated until the shifts settle, and the frames are summed
+    with sub-pixel Fourier shifts. There is no patch (local) alignment and no dose weighting, so the result is closer to
+    'MotionCor2 -Patch 0 0' than to the usual 5 x 5 patches. Used by 'otf_pipeline.py --engine cpu', or for the
+    movies the GPU workers cannot keep up with using 'otf_pipeline.py --cpu-workers N'. The total drift is written
+    into the labels of the .MRC header. Decoding LZW compressed .TIF movies is much faster with 'imagecodecs' installed.
+        $ otf_motioncorr.py Name_0001.tif Name_Corr_0001.mrc --ft-bin 2 --pix-size 0.62 --gain SuperRef.mrc --defects defects.txt
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+import otf_imageio
+
+## largest dimension of the binned frames used to find the shifts
+ALIGN_SIZE = 1024
+
+## B-factor (A^2) applied to the cross-correlations, as MotionCor2 -Bft for the global alignment
+BFACTOR = 500
+
+## shifts are refined until no frame moves by more than this (pixels of the binned frames used for alignment)
+TOLERANCE = 0.05
+MAX_ITERATIONS = 10
+
+## the largest shift searched for, as a fraction of the frame size
+MAX_SHIFT_FRACTION = 0.2
+
+## gain reference and defect mask of a worker process, see init_worker()
+worker_gain = None
+worker_defects = None
+worker_defects_path = None
+worker_ft_bin = 1
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def read_defects(path, shape):
+    """ Boolean mask of the defects listed in a MotionCor2 defects file (one 'x y width height' rectangle per line)
+    """
+    mask = np.zeros(shape, dtype = bool)
+    with open(path, 'r') as f:
+        for line in f:
+            column = line.split()
+            if len(column) < 4 or line.startswith('#'):
+                continue
+            x, y, width, height = [int(float(value)) for value in column[:4]]
+            mask[max(0, y):y + height, max(0, x):x + width] = True
+    return mask
+
+def frame_sources(movie, throw = 0, max_frames = None):
+    """ Picklable descriptions of the frames of a movie to correct, read by read_frame()
+    """
+    last = None if max_frames is None else throw + max_frames
+    if os.path.splitext(movie)[1] in ('.mrc', '.mrcs'):
+        header = otf_imageio.read_mrc_header(movie)
+        return [('mrc', movie, index) for index in range(header['nz'])[throw:last]]
+    with open(movie, 'rb') as f:
+        endian, ifds = otf_imageio.tiff_ifds(f)
+    return [('tif', movie, endian, ifd) for ifd in ifds[throw:last]]
+
+def read_frame(source):
+    if source[0] == 'mrc':
+        stack = otf_imageio.mrc_memmap(source[1])
+        return np.asarray(stack[source[2]] if stack.ndim == 3 else stack)
+    with open(source[1], 'rb') as f:
+        return otf_imageio.tiff_frame(f, source[2], source[3])
+
+def init_worker(gain_path, defects_path, ft_bin):
+    """ Load the gain reference once per worker process. The defects are loaded with the first frame, whose shape
+        they are drawn into (there may be no gain reference to take it from)
+    """
+    global worker_gain, worker_defects_path, worker_ft_bin
+    worker_ft_bin = ft_bin
+    if gain_path is not None:
+        gain = otf_imageio.mrc_memmap(gain_path)
+        worker_gain = np.asarray(gain[0] if gain.ndim == 3 else gain, dtype = np.float32)
+    if defects_path is not None and os.path.exists(defects_path):
+        worker_defects_path = defects_path
+
+def prepare_frame(source):
+    """ Read one frame, gain and defect correct it and bin it by FtBin (run in a worker process)
+    """
+    global worker_defects
+    frame = read_frame(source).astype(np.float32)
+    if worker_defects is None and worker_defects_path is not None:
+        worker_defects = read_defects(worker_defects_path, frame.shape)
+    if worker_gain is not None:
+        if worker_gain.shape != frame.shape:
+            raise ValueError("gain reference is %s x %s, frames are %s x %s" % (worker_gain.shape[1], worker_gain.shape[0], frame.shape[1], frame.shape[0]))
+        frame *= worker_gain
+    if worker_defects is not None:
+        frame[worker_defects] = frame[~worker_defects].mean()
+    return otf_imageio.bin_image(frame, worker_ft_bin).astype(np.float16)
+
+def phase_ramps(shape, dy, dx):
+    """ Factors of the rfft2 spectrum of an image of 'shape' that shift it by (dy, dx) pixels (as an outer product)
+    """
+    fy = np.fft.fftfreq(shape[0]).astype(np.float32)
+    fx = np.fft.rfftfreq(shape[1]).astype(np.float32)
+    return np.exp(-2j * np.pi * fy * dy)[:, None].astype(np.complex64), np.exp(-2j * np.pi * fx * dx)[None, :].astype(np.complex64)
+
+def shift_spectrum(spectrum, shape, dy, dx):
+    ramp_y, ramp_x = phase_ramps(shape, dy, dx)
+    return spectrum * ramp_y * ramp_x
+
+def find_peak(cc, max_shift):
+    """ Position (dy, dx) of the highest cross-correlation within 'max_shift' of the origin, refined to sub-pixel
+        precision with a parabola through the peak and its neighbours along each axis
+    """
+    ny, nx = cc.shape
+    ry, rx = min(max_shift, ny // 2 - 1), min(max_shift, nx // 2 - 1)
+    window = np.roll(cc, (ry, rx), axis = (0, 1))[:2 * ry + 1, :2 * rx + 1]
+    iy, ix = np.unravel_index(np.argmax(window), window.shape)
+    py, px = int(iy) - ry, int(ix) - rx
+    peak = []
+    for position, below, centre, above in ((py, cc[(py - 1) % ny, px % nx], cc[py % ny, px % nx], cc[(py + 1) % ny, px % nx]),
+                                           (px, cc[py % ny, (px - 1) % nx], cc[py % ny, px % nx], cc[py % ny, (px + 1) % nx])):
+        denominator = below - 2 * centre + above
+        if denominator < 0:
+            position += 0.5 * (below - above) / denominator
+        peak.append(position)
+    return peak[0], peak[1]
+
+def align_frames(frames, angpix, bfactor = BFACTOR):
+    """ Whole-frame shifts (dy, dx) that align each frame to the sum of all other frames, in pixels of the frames,
+        relative to the middle frame
+    """
+    factor = max(1, int(np.ceil(max(frames[0].shape) / ALIGN_SIZE)))
+    small = [otf_imageio.bin_image(frame.astype(np.float32), factor) for frame in frames]
+    shape = small[0].shape
+    spectra = np.array([np.fft.rfft2(image - image.mean()) for image in small], dtype = np.complex64)
+    ## B-factor weighting of the cross-correlations, spatial frequencies in 1/A
+    fy = np.fft.fftfreq(shape[0]) / (angpix * factor)
+    fx = np.fft.rfftfreq(shape[1]) / (angpix * factor)
+    weight = np.exp(-bfactor * (fy[:, None] ** 2 + fx[None, :] ** 2) / 4).astype(np.float32)
+    max_shift = int(MAX_SHIFT_FRACTION * min(shape))
+    shifts = np.zeros((len(frames), 2))
+    for iteration in range(MAX_ITERATIONS):
+        shifted = np.array([shift_spectrum(spectra[i], shape, *shifts[i]) for i in range(len(frames))])
+        total = shifted.sum(axis = 0)
+        new_shifts = np.array([find_peak(np.fft.irfft2((total - shifted[i]) * np.conj(spectra[i]) * weight, s = shape), max_shift)
+                               for i in range(len(frames))])
+        change = np.abs(new_shifts - shifts).max()
+        shifts = new_shifts
+        if VERBOSE:
+            print("   iteration %s: largest change %0.3f px" % (iteration + 1, change))
+        if change < TOLERANCE:
+            break
+    shifts -= shifts[len(frames) // 2]
+    return shifts * factor
+
+def sum_frames(frames, shifts):
+    """ Sum of the frames, each shifted by its (dy, dx) with a Fourier shift
+    """
+    shape = frames[0].shape
+    total = np.zeros((shape[0], shape[1] // 2 + 1), dtype = np.complex64)
+    for frame, (dy, dx) in zip(frames, shifts):
+        total += shift_spectrum(np.fft.rfft2(frame.astype(np.float32)), shape, dy, dx)
+    return np.fft.irfft2(total, s = shape).astype(np.float32)
+
+def correct_movie(movie, out_mrc, pix_size, ft_bin = 2, throw = 0, gain = None, defects = None, max_frames = None,
+                  processes = None, bfactor = BFACTOR):
+    """ Motion correct a movie into 'out_mrc', returns a dictionary with the number of frames, the shifts of every frame
+        (dy, dx in A) and the total drift (A, summed over consecutive frames)
+    """
+    start_time = time.time()
+    sources = frame_sources(movie, throw, max_frames)
+    if len(sources) == 0:
+        raise ValueError("%s has no frames left to align" % movie)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = processes, initializer = init_worker,
+                                                initargs = (gain, defects, ft_bin)) as executor:
+        frames = list(executor.map(prepare_frame, sources))
+    read_time = time.time()
+    angpix = pix_size * ft_bin
+    shifts = align_frames(frames, angpix, bfactor) if len(frames) > 1 else np.zeros((1, 2))
+    image = sum_frames(frames, shifts)
+    drift = float(np.sqrt((np.diff(shifts, axis = 0) ** 2).sum(axis = 1)).sum() * angpix)
+    label = "otf_motioncorr: %s frames, drift %0.2f A" % (len(frames), drift)
+    ## written under a temporary name so a half-written .MRC is never picked up
+    temp_path = os.path.join(os.path.dirname(out_mrc), '.' + os.path.basename(out_mrc) + '.part')
+    otf_imageio.write_mrc(temp_path, image, angpix = angpix, labels = [label])
+    os.replace(temp_path, out_mrc)
+    if VERBOSE:
+        print("%s: %s frames read in %0.1f s, aligned and summed in %0.1f s" % (movie, len(frames), read_time - start_time, time.time() - read_time))
+    return { 'frames' : len(frames), 'shifts' : shifts * angpix, 'drift' : drift }
+
+def read_drift(mrc):
+    """ Total drift (A) written into the header of an .MRC corrected by correct_movie(), or None
+    """
+    for label in otf_imageio.read_mrc_labels(mrc):
+        if label.startswith('otf_motioncorr:') and 'drift' in label:
+            return float(label.split('drift')[1].split()[0])
+    return None
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Whole-frame motion correction of a movie on the CPU (MotionCor2 stand-in)")
+    parser.add_argument('movie', help = "movie to correct (.tif, or an .mrc/.mrcs stack)")
+    parser.add_argument('out_mrc', help = "corrected, summed micrograph to write")
+    parser.add_argument('--pix-size', type = float, required = True, help = "pixel size of the movie (A)")
+    parser.add_argument('--ft-bin', type = int, default = 2, help = "binning of the corrected micrograph (as MotionCor2 -FtBin)")
+    parser.add_argument('--throw', type = int, default = 0, help = "frames to discard at the start (as MotionCor2 -Throw)")
+    parser.add_argument('--max-frames', type = int, default = None, help = "only align this many frames after --throw")
+    parser.add_argument('--gain', default = None, help = "gain reference .MRC to multiply the frames with")
+    parser.add_argument('--defects', default = None, help = "MotionCor2 defects file")
+    parser.add_argument('--bfactor', type = float, default = BFACTOR, help = "B-factor of the cross-correlations (A^2)")
+    parser.add_argument('--processes', type = int, default = None, help = "processes reading frames (default: number of CPUs)")
+    args = parser.parse_args()
+
+    try:
+        result = correct_movie(args.movie, args.out_mrc, args.pix_size, args.ft_bin, args.throw, args.gain, args.defects,
+                               args.max_frames, args.processes, args.bfactor)
+    except (IOError, ValueError) as e:
+        sys.exit(" !!! ERROR: %s" % e)
+    print(">> %s: %s frames aligned, total drift %0.2f A" % (args.out_mrc, result['frames'], result['drift']))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to keep the preview .GIFs of a session in one file instead of tens of thousands on NFS.
+
+""" Packed preview store: the .GIFs of a session (micrographs and CTF fits) appended to a single file,
+    'previews.pack' in the output directory, instead of one file each (see 'otf_pipeline.py --pack-previews').
+    Every record holds its name and bytes, and an index 'previews.pack.idx' lists the offset, length and name of each
+    record, one line per record, so readers learn about new previews by reading the new lines of the index only, and
+    read the previews themselves through a memory map of the pack. Names are paths relative to the pack directory
+    (e.g. 'Name_Corr_0001.gif', 'CTF/Name_Corr_0001_CTF.gif'); adding a name again replaces the older preview.
+    Writers hold a POSIX lock (fcntl.lockf, which works across hosts on NFS) while appending, so the workers of a shared
+    queue (see otf_queue.py) can all write to the same pack. Both viewers read previews from a pack when one is present:
+        $ otf_packstore.py on-the-fly_processing/previews.pack --list
+        $ otf_packstore.py on-the-fly_processing/previews.pack --export on-the-fly_processing     (back to loose files)
+        $ otf_packstore.py on-the-fly_processing/previews.pack --import on-the-fly_processing/*.gif --remove
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import mmap
+import time
+import fcntl
+import struct
+import argparse
+import threading
+
+PACK_NAME = 'previews.pack'
+PACK_MAGIC = b'OTFPACK1'
+RECORD_HEADER = struct.Struct('<4sHI') # record magic, name length, data length
+RECORD_MAGIC = b'PREC'
+
+## how often a viewer checks again for a pack that was not there
+MISSING_PACK_RECHECK = 10.0
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def index_path(pack_path):
+    return pack_path + '.idx'
+
+def pack_path(directory):
+    return os.path.join(directory, PACK_NAME)
+
+class PackStore:
+    """ Reader and writer of one pack. Thread-safe.
+    """
+    def __init__(self, path, create = False):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.records = {} # name -> (data offset, length), the latest record of each name
+        self.index_offset = 0 # bytes of the index read so far
+        self.map = None
+        self.lock = threading.Lock()
+        if create and not os.path.exists(path):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                os.write(fd, PACK_MAGIC)
+                os.close(fd)
+                os.close(os.open(index_path(path), os.O_WRONLY | os.O_CREAT, 0o644))
+            except FileExistsError:
+                pass # made by another writer at the same time
+        with open(path, 'rb') as f:
+            if f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                raise ValueError("%s is not a preview pack" % path)
+        self.refresh()
+
+    def key(self, file_path):
+        """ Name of a preview in the pack, from the path it would have as a loose file
+        """
+        return os.path.relpath(os.path.abspath(file_path), self.directory)
+
+    def refresh(self):
+        """ Read the index lines added since the last call, returns the names added
+        """
+        with self.lock:
+            added = []
+            try:
+                with open(index_path(self.path), 'rb') as f:
+                    f.seek(self.index_offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break # still being written
+                        self.index_offset += len(line)
+                        offset, length, name = line.decode().rstrip('\n').split(' ', 2)
+                        self.records[name] = (int(offset), int(length))
+                        added.append(name)
+            except FileNotFoundError:
+                pass
+            return added
+
+    def add(self, name, data):
+        """ Append a preview, then its index line (so readers never see a record that is not completely written)
+        """
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(name.encode()), len(data))
+        with self.lock:
+            fd = os.open(self.path, os.O_RDWR)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                ## the size as seen after taking the lock (NFS revalidates its cached attributes on locking)
+                offset = os.fstat(fd).st_size
+                os.pwrite(fd, header + name.encode() + data, offset)
+                os.fsync(fd)
+                data_offset = offset + RECORD_HEADER.size + len(name.encode())
+                index_fd = os.open(index_path(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(index_fd, ("%s %s %s\n" % (data_offset, len(data), name)).encode())
+                finally:
+                    os.close(index_fd)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            self.records[name] = (data_offset, len(data))
+        if VERBOSE:
+            print("Packed %s (%s bytes) into %s" % (name, len(data), self.path))
+
+    def add_file(self, file_path, remove = True):
+        """ Move a loose preview file into the pack
+        """
+        with open(file_path, 'rb') as f:
+            self.add(self.key(file_path), f.read())
+        if remove:
+            os.remove(file_path)
+
+    def __contains__(self, name):
+        if name not in self.records:
+            self.refresh()
+        return name in self.records
+
+    def get(self, name):
+        """ Bytes of a preview, or None if the pack does not hold it
+        """
+        if name not in self:
+            return None
+        with self.lock:
+            offset, length = self.records[name]
+            if self.map is None or offset + length > len(self.map):
+                ## the pack grew since it was mapped
+                if self.map is not None:
+                    self.map.close()
+                with open(self.path, 'rb') as f:
+                    self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            return self.map[offset:offset + length]
+
+    def names(self):
+        self.refresh()
+        return sorted(self.records)
+
+    def rebuild_index(self):
+        """ Write the index again from the records in the pack (e.g. if it was lost), up to the last complete record
+        """
+        lines = []
+        with open(self.path, 'rb') as f:
+            offset = len(PACK_MAGIC)
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, name_length, length = RECORD_HEADER.unpack(header)
+                name = f.read(name_length)
+                data_offset = offset + RECORD_HEADER.size + name_length
+                if magic != RECORD_MAGIC or len(name) < name_length or data_offset + length > os.path.getsize(self.path):
+                    print(" !!! WARNING: incomplete record at byte %s of %s, ignored" % (offset, self.path))
+                    break
+                lines.append("%s %s %s\n" % (data_offset, length, name.decode()))
+                offset = data_offset + length
+                f.seek(offset)
+        temp_path = index_path(self.path) + '.part'
+        with open(temp_path, 'w') as f:
+            f.writelines(lines)
+        os.replace(temp_path, index_path(self.path))
+        with self.lock:
+            self.records, self.index_offset = {}, 0
+        self.refresh()
+        return len(lines)
+
+## packs opened by this process, { pack path : PackStore or time it was found missing }
+stores = {}
+stores_lock = threading.Lock()
+
+def open_store(directory, create = False):
+    """ The pack of a directory (shared within this process), or None if there is none
+    """
+    path = os.path.abspath(pack_path(directory))
+    with stores_lock:
+        store = stores.get(path)
+        if isinstance(store, PackStore):
+            return store
+        if store is not None and not create and time.time() - store < MISSING_PACK_RECHECK:
+            return None
+        if create or os.path.exists(path):
+            stores[path] = PackStore(path, create = create)
+            return stores[path]
+        stores[path] = time.time()
+        return None
+
+def read_preview(file_path, pack_dir):
+    """ Bytes of a preview from the pack in 'pack_dir', given the path it would have as a loose file, or None if there
+        is no pack or the pack does not hold it
+    """
+    try:
+        store = open_store(pack_dir)
+    except (IOError, ValueError):
+        return None
+    if store is None:
+        return None
+    ## previews can be replaced (e.g. the quick CTF estimate by the CTFFIND4 fit), read the new index lines first
+    store.refresh()
+    return store.get(store.key(file_path))
+
+def has_preview(file_path, pack_dir):
+    store = open_store(pack_dir)
+    return store is not None and store.key(file_path) in store
+
+def export(store, out_dir):
+    """ Write the latest version of every preview as a loose file, returns the number of files written
+    """
+    names = store.names()
+    for name in names:
+        path = os.path.join(out_dir, name)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        temp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.part')
+        with open(temp_path, 'wb') as f:
+            f.write(store.get(name))
+        os.replace(temp_path, path)
+    return len(names)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "List, fill or unpack a packed preview store")
+    parser.add_argument('pack', help = "pack file (e.g. on-the-fly_processing/previews.pack)")
+    parser.add_argument('--list', action = 'store_true', help = "list the previews in the pack")
+    parser.add_argument('--export', default = None, metavar = 'DIR', help = "write every preview as a loose file under DIR")
+    parser.add_argument('--import', dest = 'import_files', nargs = '+', default = [], metavar = 'FILE', help = "add loose preview files to the pack (created if needed)")
+    parser.add_argument('--remove', action = 'store_true', help = "with --import, remove the files once packed")
+    parser.add_argument('--reindex', action = 'store_true', help = "rebuild the index from the records in the pack")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.pack) and not args.import_files:
+        sys.exit("No pack at %s" % args.pack)
+    store = PackStore(args.pack, create = bool(args.import_files))
+    if args.reindex:
+        print(">> Index rebuilt with %s records" % store.rebuild_index())
+    for path in args.import_files:
+        store.add_file(path, remove = args.remove)
+    if args.import_files:
+        print(">> %s files packed" % len(args.import_files))
+    try:
+        if args.list:
+            for name in store.names():
+                print("%-50s %10s bytes" % (name, store.records[name][1]))
+        if args.export:
+            print(">> %s previews written to %s" % (export(store, args.export), args.export))
+        print(">> %s previews in %s (%0.1f MB)" % (len(store.names()), args.pack, os.path.getsize(args.pack) / 1024 ** 2))
+    except BrokenPipeError:
+        ## e.g. piped into 'head'
+        sys.stderr.close()
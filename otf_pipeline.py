@@ -0,0 +1,782 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created as a Python port of the per-movie steps in 'proc_loop.sh', so that movies can be handed straight
+#             to a processing queue (e.g. by 'otf_copy.py') instead of being rediscovered by a polling glob.
+
+""" Processing stages for on-the-fly motion correction and CTF estimation, mirroring 'proc_loop.sh':
+        MotionCor2 -> e2proc2d.py/convert .GIF -> CTFFIND4 -> 'on-the-fly_data.log' entry -> clean up
+    Settings are kept in a plain dictionary (see default_settings()) using the same microscope presets as 'proc_loop.sh'.
+    Run directly to process a list of movies, or to watch a directory the same way 'proc_loop.sh' does:
+        $ otf_pipeline.py --watch --min-size 400000000 --microscope TF30
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import glob
+import math
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import otf_cache
+import otf_queue
+import otf_metrics
+import otf_packstore
+import otf_scheduler
+
+## my typical settings on HMS microscopes, as used in 'proc_loop.sh'
+MICROSCOPES = {
+    'TF30' : { 'kV' : 300, 'pix_size' : 0.62, 'dose' : 1.196 }, # 31000 x mag, default dose
+    'F20' : { 'kV' : 200, 'pix_size' : 0.64, 'dose' : 0.977 }, # 29000 x mag, default dose
+}
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def default_settings(microscope = 'TF30'):
+    """ Return a settings dictionary with the defaults used in 'proc_loop.sh' for the given microscope
+    """
+    settings = {
+        'microscope' : microscope,
+        'out_dir' : './on-the-fly_processing',
+        'ctf_dir' : './on-the-fly_processing/CTF',
+        'logfile' : './on-the-fly_data.log',
+        'metrics_log' : './on-the-fly_metrics.log',
+        'corrected_suffix' : 'Corr',
+        'keep_mrc' : False,
+        'cache_budget' : None, # bytes of intermediate files to keep for reuse (see otf_cache.py), None to remove them
+        'pack_previews' : False, # append the .GIFs to 'previews.pack' in 'out_dir' instead of keeping loose files (see otf_packstore.py)
+        'gain_corrected' : False,
+        'gain_ref' : 'SuperRef.mrc',
+        'defects' : 'defects.txt',
+        'gpu' : '0',
+        ## 'motioncor2' on the GPU, or the whole-frame NumPy alignment of 'otf_motioncorr.py' on the CPU
+        'motion_engine' : 'motioncor2',
+        ## processes each CPU motion correction reads frames with (None: one per CPU), set by Processor for its workers
+        'cpu_processes' : None,
+        ## MotionCor2 parameters
+        'patch' : (5, 5),
+        'ft_bin' : 2,
+        'throw' : 1,
+        ## CTFFIND4 parameters, in the order they are given in the 'proc_loop.sh' heredoc
+        'cs' : 2,
+        'amp_contrast' : 0.07,
+        'ctf_box' : 512,
+        'ctf_min_res' : 30,
+        'ctf_max_res' : 5,
+        'ctf_min_dz' : 10000,
+        'ctf_max_dz' : 40000,
+        'ctf_dz_step' : 150,
+        ## quick NumPy power spectrum estimate before CTFFIND4 (see otf_powerspec.py), and when to run CTFFIND4 after
+        ## it: 'always', or only for 'flagged' micrographs whose quick estimate is out of range
+        'quick_ctf' : False,
+        'ctffind' : 'always',
+        ## render the .GIF with NumPy and log quality metrics from the same read of the .MRC (see otf_quality.py)
+        'quality_metrics' : False,
+        ## thresholds used to flag a log entry with '*' (the quality metric limits are off with None)
+        'max_fit_res' : 9,
+        'max_dz' : 3.5,
+        'min_dz' : 1.0,
+        'min_mean' : None,
+        'max_mean' : None,
+        'min_hf' : None,
+        'max_drift' : None,
+    }
+    settings.update(MICROSCOPES[microscope])
+    return settings
+
+def binned_pix_size(settings):
+    """ After MotionCor2 the image is binned by 'ft_bin', this value is required for CTF estimation
+    """
+    return float("%4.2f" % (settings['pix_size'] * settings['ft_bin']))
+
+def corrected_name(movie, corrected_suffix):
+    """ Map a movie name onto the base name of its corrected micrograph (e.g. /dir/Name_0001.tif -> Name_Corr_0001)
+    """
+    mic = os.path.basename(movie)
+    head, tail = mic.rsplit('_', 1)
+    intermediate_filename = head + '_' + corrected_suffix + '_' + tail
+    return intermediate_filename.split('.')[0]
+
+def output_paths(movie, settings):
+    """ Return a dictionary with the paths of every file produced while processing a given movie
+    """
+    base_name = corrected_name(movie, settings['corrected_suffix'])
+    return {
+        'name' : base_name,
+        'mrc' : os.path.join(settings['out_dir'], base_name + '.mrc'),
+        'gif' : os.path.join(settings['out_dir'], base_name + '.gif'),
+        'ctf_mrc' : os.path.join(settings['ctf_dir'], base_name + '_CTF.mrc'),
+        'ctf_txt' : os.path.join(settings['ctf_dir'], base_name + '_CTF.txt'),
+        'ctf_avrot' : os.path.join(settings['ctf_dir'], base_name + '_CTF_avrot.txt'),
+        'ctf_gif' : os.path.join(settings['ctf_dir'], base_name + '_CTF.gif'),
+        ## diagnostic .GIF of the quick estimate (otf_powerspec.py), kept apart from the CTFFIND4 one
+        'ps_gif' : os.path.join(settings['ctf_dir'], base_name + '_PS.gif'),
+    }
+
+def is_processed(movie, settings):
+    """ A movie is considered processed once its corrected .GIF exists (same test as 'proc_loop.sh')
+    """
+    return preview_exists(output_paths(movie, settings)['gif'], settings)
+
+def preview_exists(gif, settings):
+    """ A preview .GIF exists as a loose file, or in the preview pack with --pack-previews
+    """
+    if settings['pack_previews'] and otf_packstore.has_preview(gif, settings['out_dir']):
+        return True
+    return os.path.exists(gif)
+
+def store_preview(gif, settings):
+    """ With --pack-previews, move a freshly written preview .GIF into the pack of 'out_dir'
+    """
+    if settings['pack_previews'] and os.path.exists(gif):
+        otf_packstore.open_store(settings['out_dir'], create = True).add_file(gif)
+
+def store_preview_image(gif, image, settings):
+    """ Save a preview rendered with NumPy: with --pack-previews encoded in memory and added to the pack (no loose file
+        is written, read back and removed), otherwise written to 'gif'
+    """
+    import otf_imageio # optional, requires NumPy
+    if settings['pack_previews']:
+        store = otf_packstore.open_store(settings['out_dir'], create = True)
+        store.add(store.key(gif), otf_imageio.gif_bytes(otf_imageio.gif_levels(image)))
+    else:
+        otf_imageio.write_gif(gif, image)
+
+def init_output_dirs(settings):
+    for directory in (settings['out_dir'], settings['ctf_dir']):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            print("Created directory: %s" % directory)
+
+def init_logfile(settings):
+    """ If not already present, initialize a log file to store all relevant processing data, otherwise data is just
+        appended into the existing log file
+    """
+    logfile = settings['logfile']
+    if os.path.exists(logfile):
+        return
+    with open(logfile, 'w') as f:
+        f.write("%s %s %s \n" % ("##", "Motion_corrected_images=", settings['out_dir'].rstrip('/') + '/'))
+        f.write("%s %s %s \n" % ("##", "CTF_fit_images=", settings['ctf_dir'].rstrip('/') + '/'))
+        f.write("## \n")
+        f.write("%-38s %-14s %-14s \n" % ("## Micrograph", "CTF fit(A)", "Avg. dZ (um)"))
+        f.write("%-38s %-14s %-14s \n" % ("## =============================", "==========", "============"))
+    print("Log file initialized at %s" % logfile)
+
+def run_quiet(cmd, stdin_text = None):
+    """ Run an external program with its output discarded (i.e. '> /dev/null 2>&1'). The CPU time used by the program
+        is added to the timings of the calling thread (see otf_metrics.py)
+    """
+    proc = subprocess.Popen(cmd, stdin = subprocess.PIPE if stdin_text is not None else subprocess.DEVNULL,
+                            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, universal_newlines = True)
+    if stdin_text is not None:
+        try:
+            proc.stdin.write(stdin_text)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+    ## reap the child ourselves to get the resource usage of this program only (not of other worker threads)
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    otf_metrics.add_child_cpu(rusage.ru_utime + rusage.ru_stime)
+    return proc.returncode
+
+def motioncor2_cmd(movie, out_mrc, settings):
+    cmd = ['MotionCor2', '-InTiff', movie, '-OutMrc', out_mrc]
+    if not settings['gain_corrected']:
+        cmd += ['-DefectFile', settings['defects'], '-Gain', settings['gain_ref']]
+    cmd += ['-Patch', str(settings['patch'][0]), str(settings['patch'][1]),
+            '-FtBin', str(settings['ft_bin']), '-Throw', str(settings['throw']),
+            '-PixSize', str(settings['pix_size']), '-GPU'] + settings['gpu'].split()
+    if settings['quality_metrics']:
+        ## alignment logs, for the drift of the quality metrics (see motioncor2_drift()), named after the output .MRC;
+        ## in serial mode 'out_mrc' is the output directory and each log is named after its movie
+        cmd += ['-LogFile', os.path.splitext(out_mrc)[0]]
+    return cmd
+
+def cpu_motioncor_cmd(movie, out_mrc, settings):
+    """ The same correction on the CPU with 'otf_motioncorr.py' (whole-frame alignment only, -Patch is ignored)
+    """
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'otf_motioncorr.py'), movie, out_mrc]
+    if not settings['gain_corrected']:
+        cmd += ['--defects', settings['defects'], '--gain', settings['gain_ref']]
+    cmd += ['--ft-bin', str(settings['ft_bin']), '--throw', str(settings['throw']), '--pix-size', str(settings['pix_size'])]
+    if settings['cpu_processes']:
+        cmd += ['--processes', str(settings['cpu_processes'])]
+    return cmd
+
+def motioncor2_key(settings):
+    """ The MotionCor2 parameters a corrected .MRC depends on, to tell whether a cached one can be reused
+    """
+    if settings['motion_engine'] == 'cpu':
+        return 'cpu ' + ' '.join(cpu_motioncor_cmd('', '', dict(settings, cpu_processes = None))[4:])
+    cmd = motioncor2_cmd('', '', settings)
+    return ' '.join(cmd[5:cmd.index('-GPU')])
+
+def run_motioncor2(movie, out_mrc, settings):
+    if settings['motion_engine'] == 'cpu':
+        return run_quiet(cpu_motioncor_cmd(movie, out_mrc, settings))
+    return run_quiet(motioncor2_cmd(movie, out_mrc, settings))
+
+def motioncor2_drift(mrc, settings):
+    """ Total drift (A, summed over consecutive frames) from the full-frame alignment log MotionCor2 writes with
+        -LogFile next to a corrected .MRC, or None if there is none. The logs of the micrograph are removed once read
+    """
+    logs = glob.glob(os.path.splitext(mrc)[0] + '*.log')
+    drift = None
+    for log in logs:
+        if not log.endswith('Full.log'):
+            continue
+        shifts = []
+        with open(log, 'r') as f:
+            for line in f:
+                column = line.split()
+                if len(column) < 3 or column[0][0] == '#':
+                    continue
+                try:
+                    shifts.append((float(column[1]), float(column[2])))
+                except ValueError:
+                    continue
+        ## shifts are in pixels of the movie, as given with -PixSize
+        drift = sum(math.hypot(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(shifts, shifts[1:])) * settings['pix_size']
+    remove_files(*logs)
+    return drift
+
+def motioncor2_batch_cmd(staging_dir, settings, in_suffix):
+    """ MotionCor2 in serial mode (-Serial 1): every movie in 'staging_dir' ending in 'in_suffix' is corrected by one
+        process, written to 'out_dir' under the name it has in 'staging_dir' with an .mrc extension
+    """
+    cmd = motioncor2_cmd(staging_dir.rstrip('/') + '/', settings['out_dir'].rstrip('/') + '/', settings)
+    return cmd[:5] + ['-Serial', '1', '-InSuffix', in_suffix] + cmd[5:]
+
+def run_motioncor2_batch(movies, settings):
+    """ Motion correct several movies with a single MotionCor2 run, so the CUDA context, gain reference and defects
+        file are loaded once per batch instead of once per movie. Each movie is symlinked into a staging directory
+        under the name of its corrected micrograph (Name_0001.tif -> Name_Corr_0001.tif), so the outputs land where
+        output_paths() expects them. Returns the movies whose corrected .MRC was not produced.
+    """
+    in_suffix = os.path.splitext(movies[0])[1]
+    staging_dir = tempfile.mkdtemp(prefix = '.motioncor2_batch_', dir = settings['out_dir'])
+    try:
+        for movie in movies:
+            os.symlink(os.path.abspath(movie), os.path.join(staging_dir, output_paths(movie, settings)['name'] + in_suffix))
+        run_quiet(motioncor2_batch_cmd(staging_dir, settings, in_suffix))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors = True)
+    return [movie for movie in movies if not os.path.exists(output_paths(movie, settings)['mrc'])]
+
+def render_gif(mrc, gif, e2proc2d_args = (), resize = None):
+    """ Format an .MRC into a viewable .GIF with e2proc2d.py & convert, removing the intermediate .PNG
+    """
+    png = os.path.splitext(gif)[0] + '.png'
+    run_quiet(['e2proc2d.py', mrc, png] + list(e2proc2d_args))
+    convert_cmd = ['convert', png]
+    if resize is not None:
+        convert_cmd += ['-resize', resize]
+    run_quiet(convert_cmd + [gif])
+    if os.path.exists(png):
+        os.remove(png)
+
+def render_micrograph_gif(mrc, gif):
+    render_gif(mrc, gif, ('--meanshrink', '3', '--process=filter.lowpass.gauss:cutoff_freq=0.2'), resize = '70%')
+
+def ctffind_input(mrc, ctf_mrc, settings):
+    """ Build the answers to the CTFFIND4 prompts, as given in the 'proc_loop.sh' heredoc
+    """
+    answers = [mrc, ctf_mrc, binned_pix_size(settings), settings['kV'], settings['cs'], settings['amp_contrast'],
+               settings['ctf_box'], settings['ctf_min_res'], settings['ctf_max_res'], settings['ctf_min_dz'],
+               settings['ctf_max_dz'], settings['ctf_dz_step'], 'no', 'no', 'no', 'no', 'no']
+    return ''.join("%s\n" % answer for answer in answers)
+
+def ctffind_key(settings):
+    return ctffind_input('', '', settings).strip().replace('\n', ' ')
+
+def run_ctffind(mrc, ctf_mrc, settings):
+    return run_quiet(['ctffind'], stdin_text = ctffind_input(mrc, ctf_mrc, settings))
+
+def read_ctffind_result(ctf_txt):
+    """ Grab CTF fit & defocus data from the last line of the CTFFIND output file, returns (fit_res (Ang), avg_dZ (um))
+    """
+    with open(ctf_txt, 'r') as f:
+        lines = [line for line in f if line.strip()]
+    column = lines[-1].split()
+    est_Reso = float(column[6]) # row 7
+    est_dZ_x = int(float(column[1])) # row 2
+    est_dZ_y = int(float(column[2])) # row 3
+    ## calculate average dZ from x and y directions, then adjust unit to microns
+    est_dZ_avg = (est_dZ_x + est_dZ_y) / 20000
+    return est_Reso, est_dZ_avg
+
+def ctf_warnings(est_Reso, est_dZ_avg, settings):
+    """ Return the warnings raised by CTF values that are out of range (each is marked with a '*' in the log file)
+    """
+    warnings = []
+    if est_Reso > settings['max_fit_res']:
+        warnings.append("!!! LOW RESOLUTION FIT !!!")
+    if est_dZ_avg > settings['max_dz']:
+        warnings.append("!!! HIGH DEFOCUS !!!")
+    if est_dZ_avg < settings['min_dz']:
+        warnings.append("!!! LOW DEFOCUS !!!")
+    return warnings
+
+def format_log_entry(mrc_name, est_Reso, est_dZ_avg, warnings, finished = None, metrics = None):
+    """ Format a log file line as written by 'proc_loop.sh', followed by the time it was processed as a 'time=' column
+        (used to merge the logs of several sessions, see otf_logmerge.py) and any quality metrics as key=value columns
+    """
+    finished = time.localtime(finished) # now, if None
+    line = "%-38s %-14s %-14s" % ("   " + mrc_name, "%0.1f" % est_Reso, "%0.2f" % est_dZ_avg) + '*' * len(warnings) + \
+           " time=%s" % time.strftime('%Y-%m-%dT%H:%M:%S', finished)
+    if metrics:
+        import otf_quality
+        line += ' ' + otf_quality.format_metrics(metrics)
+    return line + '\n'
+
+def log_result(settings, result):
+    """ Write the log file entry of a result returned by process_movie() (used when it was processed on another host)
+    """
+    if result['fit_res'] is not None:
+        append_line(settings['logfile'], format_log_entry(result['name'] + '.mrc', result['fit_res'], result['dZ'], result['warnings'],
+                                                            result['finished'], result.get('metrics')))
+
+def append_line(path, line):
+    """ Append a line with a single write() so that lines from concurrent writers are never interleaved
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+def remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def retain_files(paths, settings, cache, ctf_files, priority):
+    """ Hand the intermediate files of a micrograph to the retention cache, or remove them if there is none
+    """
+    ## to save on file space, remove the motion corrected micrograph unless the user explicitly asks to keep it
+    if not settings['keep_mrc']:
+        if cache is not None:
+            cache.add(paths['name'], 'mrc', [paths['mrc']], motioncor2_key(settings), priority)
+        else:
+            remove_files(paths['mrc'])
+    ## clean up CTFFIND results files
+    if ctf_files and cache is not None:
+        cache.add(paths['name'], 'ctf', [paths['ctf_mrc'], paths['ctf_txt'], paths['ctf_avrot']], ctffind_key(settings), priority)
+    else:
+        remove_files(paths['ctf_mrc'], paths['ctf_txt'], paths['ctf_avrot'])
+
+def process_movie(movie, settings, timings = None, ctf = True, cache = None):
+    """ Run the full processing chain on one movie and return a dictionary of the results. The time spent in each stage
+        is added to 'timings' (an otf_metrics.MicrographTimings object), if given. With ctf = False only the motion
+        corrected .GIF is made, without CTF estimation or a log file entry. With a retention cache (otf_cache.py),
+        intermediate files are kept in it rather than removed, and reused if they were made with the same parameters.
+    """
+    if timings is None:
+        timings = otf_metrics.MicrographTimings(movie)
+    paths = output_paths(movie, settings)
+    if cache is not None and cache.lookup(paths['name'], 'mrc', motioncor2_key(settings)):
+        print(">> Reusing cached %s" % os.path.basename(paths['mrc']))
+        return process_corrected(movie, settings, timings, ctf, cache)
+    print(">> Sending %s for motion correction." % os.path.basename(movie))
+
+    engine = 'MotionCor2' if settings['motion_engine'] == 'motioncor2' else 'otf_motioncorr.py (CPU)'
+    with timings.stage('motioncor2'):
+        run_motioncor2(movie, paths['mrc'], settings)
+    print("   ... corrected drift with %s (%0.1f s)" % (engine, timings.stages['motioncor2']['wall']))
+    if not os.path.exists(paths['mrc']):
+        print(" !!! ERROR: %s did not produce %s, skipping ..." % (engine, paths['mrc']))
+        return None
+    return process_corrected(movie, settings, timings, ctf, cache)
+
+def process_corrected(movie, settings, timings, ctf = True, cache = None):
+    """ The stages of process_movie() that follow motion correction, for a movie whose corrected .MRC already exists
+    """
+    paths = output_paths(movie, settings)
+    metrics = None
+    with timings.stage('render'):
+        if settings['quality_metrics']:
+            import otf_quality # optional, requires NumPy
+            display, metrics = otf_quality.micrograph_display(paths['mrc'])
+            store_preview_image(paths['gif'], display, settings)
+            if not 'drift' in metrics:
+                drift = motioncor2_drift(paths['mrc'], settings)
+                if drift is not None:
+                    metrics['drift'] = drift
+        else:
+            render_micrograph_gif(paths['mrc'], paths['gif'])
+            store_preview(paths['gif'], settings)
+    if metrics is not None:
+        print("   ... quality: %s" % otf_quality.format_metrics(metrics))
+
+    ## early feedback: a rough defocus estimate and diagnostic .GIF from an averaged power spectrum, in well under a second
+    quick = None
+    if settings['quick_ctf'] or settings['ctffind'] == 'flagged':
+        import otf_powerspec # optional, requires NumPy
+        with timings.stage('quick_ctf'):
+            quick = otf_powerspec.quick_ctf_from_settings(paths['mrc'], settings, diagnostic = True)
+        print("   ... quick CTF estimate: -%0.2f um defocus, fit to ~%0.1f A" % (quick['dZ'], quick['fit_res']))
+
+    run_ctffind_fit = ctf and (settings['ctffind'] == 'always' or quick is None or len(ctf_warnings(quick['fit_res'], quick['dZ'], settings)) > 0)
+    if quick is not None:
+        ## an accepted quick estimate is the CTF fit of this micrograph, its diagnostic becomes the _CTF.gif; otherwise
+        ## it is only early feedback and must not take the place of the CTFFIND4 diagnostic
+        quick_gif = paths['ps_gif'] if run_ctffind_fit or not ctf else paths['ctf_gif']
+        with timings.stage('quick_ctf'):
+            store_preview_image(quick_gif, quick['diagnostic'], settings)
+
+    if not ctf:
+        print("   ... CTF estimation skipped")
+        retain_files(paths, settings, cache, False, otf_cache.PRIORITY_NORMAL)
+        return { 'movie' : movie, 'name' : paths['name'], 'fit_res' : None, 'dZ' : None, 'warnings' : [],
+                 'metrics' : metrics, 'finished' : time.time() }
+
+    cached_fit = run_ctffind_fit and cache is not None and cache.lookup(paths['name'], 'ctf', ctffind_key(settings)) is not None
+    if cached_fit:
+        print("   ... reusing cached CTFFIND result")
+        est_Reso, est_dZ_avg = read_ctffind_result(paths['ctf_txt'])
+    elif run_ctffind_fit:
+        ## launch CTFFIND silently with default inputs
+        print("   ... fitting CTF with CTFFIND")
+        with timings.stage('ctffind'):
+            run_ctffind(paths['mrc'], paths['ctf_mrc'], settings)
+            try:
+                est_Reso, est_dZ_avg = read_ctffind_result(paths['ctf_txt'])
+            except (IOError, IndexError, ValueError):
+                est_Reso = None
+        if est_Reso is None:
+            print(" !!! ERROR: No CTFFIND result for %s, skipping ..." % paths['mrc'])
+            return None
+    else:
+        ## the quick estimate is in range, keep it rather than running the full fit
+        est_Reso, est_dZ_avg = round(quick['fit_res'], 1), quick['dZ']
+    warnings = ctf_warnings(est_Reso, est_dZ_avg, settings)
+    if metrics is not None:
+        warnings += otf_quality.quality_warnings(metrics, settings)
+
+    ## update log file with all relevant parameters (with a shared queue, the coordinator writes it, see otf_queue.py)
+    if settings['logfile']:
+        with timings.stage('log_write'):
+            append_line(settings['logfile'], format_log_entry(os.path.basename(paths['mrc']), est_Reso, est_dZ_avg, warnings,
+                                                              metrics = metrics))
+
+    if run_ctffind_fit and not (cached_fit and preview_exists(paths['ctf_gif'], settings)):
+        with timings.stage('render_ctf'):
+            render_gif(paths['ctf_mrc'], paths['ctf_gif'])
+            store_preview(paths['ctf_gif'], settings)
+
+    print("CTF correction of %s reaches %0.1f Angstroms with an average estimated -%0.2f um defocus %s" % (
+          os.path.basename(paths['ctf_mrc']), est_Reso, est_dZ_avg, ' '.join(warnings)))
+
+    ## flagged micrographs are kept longer in the cache, they are the ones likely to be looked at again
+    retain_files(paths, settings, cache, run_ctffind_fit, otf_cache.PRIORITY_FLAGGED if warnings else otf_cache.PRIORITY_NORMAL)
+
+    return { 'movie' : movie, 'name' : paths['name'], 'fit_res' : est_Reso, 'dZ' : est_dZ_avg, 'warnings' : warnings,
+             'metrics' : metrics, 'finished' : time.time() }
+
+def file_is_ready(path, min_size):
+    try:
+        return os.path.getsize(path) >= min_size
+    except OSError:
+        return False
+
+class Processor:
+    """ A queue of movies waiting for processing, consumed by one or more worker threads. Movies can be handed in by
+        any producer (e.g. a directory watch or the copy loop in 'otf_copy.py') with submit(). The order and quality
+        each movie is processed at is chosen by the job queue (see 'otf_scheduler.py'). Extra 'cpu_workers' take the
+        movies the other workers cannot keep up with and motion correct them on the CPU (see 'otf_motioncorr.py')
+    """
+    def __init__(self, settings, workers = 1, metrics = None, jobs = None, max_batch = 1, cpu_workers = 0):
+        self.settings = settings
+        self.metrics = metrics
+        self.max_batch = max_batch # most movies given to one MotionCor2 run, see batch_size()
+        self.batch_seconds = 0.0 # running average of the wall time of one batched MotionCor2 run
+        ## every CPU motion correction reads frames with a pool of processes, the CPUs are shared out between the workers
+        ## that can run one at the same time (rather than each starting one process per CPU)
+        cpu_engine_workers = cpu_workers + (workers if settings['motion_engine'] == 'cpu' else 0)
+        self.cpu_processes = max(1, (os.cpu_count() or 1) // max(1, cpu_engine_workers))
+        self.cache = None
+        if settings['cache_budget']:
+            ## one index per host, hosts sharing a --queue each keep their own
+            index = os.path.join(settings['out_dir'], '.retention_cache_%s.json' % socket.gethostname())
+            marked_lists = ('bad_mics.txt', os.path.join(settings['out_dir'], 'marked_imgs.txt'))
+            self.cache = otf_cache.RetentionCache(index, settings['cache_budget'], marked_lists)
+        self.jobs = jobs if jobs is not None else otf_scheduler.JobQueue()
+        self.queued = set() # movies submitted but not yet finished, to avoid duplicate processing
+        self.lock = threading.Lock()
+        self.results = []
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target = self.work, daemon = True)
+            thread.start()
+            self.threads.append(thread)
+        for i in range(cpu_workers):
+            thread = threading.Thread(target = self.work, args = (True,), daemon = True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, movie, timings = None):
+        """ Add a movie to the queue, returns False if it was already waiting or being processed. Stages timed before
+            the movie was submitted (e.g. its copy) can be handed in with 'timings'
+        """
+        with self.lock:
+            if movie in self.queued:
+                return False
+            self.queued.add(movie)
+        if timings is None:
+            timings = otf_metrics.MicrographTimings(movie)
+        self.jobs.put(movie, timings)
+        return True
+
+    def batch_size(self):
+        """ Number of movies to motion correct in the next MotionCor2 run: about as many as arrive while one batch is
+            being processed (so a batch is ready by the time the GPU is free), or enough to clear the backlog, up
+            to 'max_batch'. A slow trickle of movies is still processed one at a time, without waiting for a batch.
+        """
+        if self.max_batch <= 1 or self.settings['motion_engine'] != 'motioncor2':
+            return 1
+        expected = self.jobs.arrival_rate() * self.batch_seconds
+        behind = -(-self.jobs.backlog() // len(self.threads)) if self.threads else 1
+        return max(1, min(self.max_batch, max(1 + int(expected), behind)))
+
+    def work(self, overflow = False):
+        """ Worker thread. An 'overflow' worker only takes a movie when no other worker is free to, and motion corrects
+            it on the CPU
+        """
+        while True:
+            try:
+                jobs = self.jobs.get_batch(1, overflow = True) if overflow else self.jobs.get_batch(self.batch_size())
+            except Exception as e:
+                ## e.g. the shared queue directory is briefly unreachable, the worker must stay alive for join()
+                print(" !!! ERROR: taking a job from the queue failed: %s" % e)
+                time.sleep(1.0)
+                continue
+            if not jobs:
+                return
+            for job in jobs:
+                timings = otf_metrics.MicrographTimings(job['movie']) if job['catch_up'] else job['timings']
+                timings.queue_wait = time.time() - job['submit_time']
+                timings.mode = job['mode'] + (' (catch-up)' if job['catch_up'] else '') + (' (cpu)' if overflow else '')
+                job['timings'] = timings
+            ## jobs of one batch are handed out together, so they share the same quality mode
+            settings = otf_scheduler.mode_settings(self.settings, jobs[0]['mode'])
+            if overflow:
+                settings = dict(settings, motion_engine = 'cpu')
+            if settings['motion_engine'] == 'cpu':
+                settings = dict(settings, cpu_processes = self.cpu_processes)
+            corrected = set()
+            ## movies with a reusable cached .MRC are left out of the batch (process_movie() picks them up)
+            batch = [job for job in jobs if self.cache is None or
+                     not self.cache.lookup(output_paths(job['movie'], settings)['name'], 'mrc', motioncor2_key(settings))]
+            if len(batch) > 1 and settings['motion_engine'] == 'motioncor2':
+                try:
+                    corrected = self.motion_correct_batch(batch, settings)
+                except Exception as e:
+                    print(" !!! ERROR: batched motion correction failed: %s" % e)
+            for job in jobs:
+                movie = job['movie']
+                timings = job['timings']
+                job['result'] = None
+                try:
+                    if movie in corrected:
+                        result = process_corrected(movie, settings, timings, ctf = job['ctf'], cache = self.cache)
+                    else:
+                        result = process_movie(movie, settings, timings, ctf = job['ctf'], cache = self.cache)
+                    if result is not None:
+                        result['mode'] = timings.mode
+                        job['result'] = result
+                        self.results.append(result)
+                        if self.metrics is not None:
+                            self.metrics.record(timings)
+                except Exception as e:
+                    print(" !!! ERROR: processing %s failed: %s" % (movie, e))
+                finally:
+                    with self.lock:
+                        self.queued.discard(movie)
+                    self.jobs.task_done(job)
+
+    def motion_correct_batch(self, jobs, settings):
+        """ Motion correct the movies of several jobs with one MotionCor2 run, returns the set of movies corrected.
+            Each movie is charged an equal share of the wall and CPU time of the run. Movies missing from the output
+            are left to be corrected on their own.
+        """
+        movies = [job['movie'] for job in jobs]
+        print(">> Sending %s movies for motion correction in one batch (%s ... %s)." % (
+              len(movies), os.path.basename(movies[0]), os.path.basename(movies[-1])))
+        batch_timings = otf_metrics.MicrographTimings('batch')
+        with batch_timings.stage('motioncor2'):
+            failed = run_motioncor2_batch(movies, settings)
+        wall, cpu = batch_timings.stages['motioncor2']['wall'], batch_timings.stages['motioncor2']['cpu']
+        for job in jobs:
+            job['timings'].add('motioncor2', wall / len(jobs), cpu / len(jobs))
+        self.batch_seconds = wall if self.batch_seconds == 0 else 0.7 * self.batch_seconds + 0.3 * wall
+        print("   ... corrected drift of %s movies with MotionCor2 (%0.1f s)" % (len(movies) - len(failed), wall))
+        for movie in failed:
+            print(" !!! WARNING: MotionCor2 batch did not correct %s, retrying on its own ..." % os.path.basename(movie))
+        return set(movies) - set(failed)
+
+    def backlog(self):
+        return self.jobs.backlog()
+
+    def quality_level(self):
+        return self.jobs.level
+
+    def join(self):
+        """ Wait for all queued movies (and any catch-up work) to finish, then stop the worker threads
+        """
+        self.jobs.join()
+        self.jobs.close()
+        for thread in self.threads:
+            thread.join()
+
+def watch_directory(processor, pattern, min_size, interval = 2.5):
+    """ Continuously find new files matching 'pattern' and submit them for processing (the loop of 'proc_loop.sh')
+    """
+    settings = processor.settings
+    first_seen = {} # movie -> time it was first found, to time how long it took for the file to be complete
+    while True:
+        for movie in sorted(glob.glob(pattern)):
+            if is_processed(movie, settings):
+                continue
+            first_seen.setdefault(movie, time.time())
+            if not file_is_ready(movie, min_size):
+                if VERBOSE:
+                    print("%s found, but file size incorrect, skipping..." % movie)
+                continue
+            timings = otf_metrics.MicrographTimings(movie)
+            timings.add('wait_for_stable', time.time() - first_seen.pop(movie))
+            processor.submit(movie, timings)
+        time.sleep(interval)
+
+def processor_from_args(settings, args):
+    """ Create the Processor, its job queue and metrics from the command line arguments added by add_settings_args()
+    """
+    metrics = start_metrics(settings, args.metrics_port)
+    if args.queue:
+        ## shared queue across hosts: the coordinator (not --worker) is the only one to write the log file
+        coordinator = not getattr(args, 'worker', False)
+        if coordinator:
+            otf_queue.save_settings(args.queue, settings)
+        log_settings = settings
+        jobs = otf_queue.LeaseQueue(args.queue, coordinator = coordinator, lease_timeout = args.lease_timeout,
+                                    on_result = lambda result: log_result(log_settings, result))
+        settings = dict(settings, logfile = None)
+    else:
+        jobs = otf_scheduler.JobQueue(adaptive = args.adaptive, high_water = args.high_water, ctf_every = args.ctf_every)
+    processor = Processor(settings, workers = args.workers, metrics = metrics, jobs = jobs, max_batch = args.batch,
+                          cpu_workers = args.cpu_workers)
+    metrics.add_gauge('otf_backlog', processor.backlog)
+    metrics.add_gauge('otf_quality_level', processor.quality_level)
+    return processor, metrics
+
+def start_metrics(settings, port):
+    """ Create the metrics registry used by a Processor, serving it over HTTP if a port is given
+    """
+    metrics = otf_metrics.Metrics(settings['metrics_log'])
+    if port:
+        otf_metrics.start_http_server(metrics, port)
+    return metrics
+
+def settings_from_args(args):
+    """ Build a settings dictionary from the command line arguments shared by the scripts driving this pipeline
+    """
+    settings = default_settings(args.microscope)
+    settings['corrected_suffix'] = args.suffix
+    settings['keep_mrc'] = args.keep_mrc
+    settings['gpu'] = args.gpu
+    settings['motion_engine'] = args.engine
+    settings['quick_ctf'] = args.quick_ctf
+    settings['ctffind'] = args.ctffind
+    settings['pack_previews'] = args.pack_previews
+    settings['quality_metrics'] = args.quality_metrics
+    for key in ('min_mean', 'max_mean', 'min_hf', 'max_drift'):
+        settings[key] = getattr(args, key)
+    if args.cache_budget:
+        settings['cache_budget'] = otf_cache.parse_size(args.cache_budget)
+    if args.gain_ref is None:
+        settings['gain_corrected'] = True
+    else:
+        settings['gain_ref'] = args.gain_ref
+        settings['defects'] = args.defects
+    return settings
+
+def add_settings_args(parser):
+    parser.add_argument('--microscope', default = 'TF30', choices = sorted(MICROSCOPES), help = "microscope presets to use")
+    parser.add_argument('--suffix', default = 'Corr', help = "suffix for motion corrected images (Name_Corr_####.mrc)")
+    parser.add_argument('--keep-mrc', action = 'store_true', help = "keep motion corrected .MRC files")
+    parser.add_argument('--cache-budget', default = None, help = "keep intermediate files for reuse up to this size (e.g. 200G)")
+    parser.add_argument('--pack-previews', action = 'store_true', help = "append the preview .GIFs to one file, 'previews.pack' (see otf_packstore.py)")
+    parser.add_argument('--gain-ref', default = None, help = "gain reference (omit if images are gain corrected)")
+    parser.add_argument('--defects', default = 'defects.txt', help = "defects file used with --gain-ref")
+    parser.add_argument('--gpu', default = '0', help = "MotionCor2 GPU flag (e.g. '0 1')")
+    parser.add_argument('--engine', default = 'motioncor2', choices = ('motioncor2', 'cpu'),
+                        help = "motion correct with MotionCor2, or on the CPU with otf_motioncorr.py (whole-frame alignment only)")
+    parser.add_argument('--quick-ctf', action = 'store_true', help = "quick power spectrum defocus estimate before CTFFIND4 (needs NumPy)")
+    parser.add_argument('--ctffind', default = 'always', choices = ('always', 'flagged'),
+                        help = "run CTFFIND4 on every micrograph, or only when the quick estimate is out of range")
+    parser.add_argument('--quality-metrics', action = 'store_true', help = "render the .GIFs with NumPy and log quality metrics of each micrograph (see otf_quality.py)")
+    parser.add_argument('--min-mean', type = float, default = None, help = "flag micrographs with a lower mean (e.g. thick ice, empty)")
+    parser.add_argument('--max-mean', type = float, default = None, help = "flag micrographs with a higher mean (e.g. no ice)")
+    parser.add_argument('--min-hf', type = float, default = None, help = "flag micrographs with less high-frequency power (0 .. 1)")
+    parser.add_argument('--max-drift', type = float, default = None, help = "flag micrographs that drifted more (A)")
+    parser.add_argument('--workers', type = int, default = 1, help = "number of movies processed at the same time")
+    parser.add_argument('--cpu-workers', type = int, default = 0,
+                        help = "extra workers motion correcting on the CPU the movies the other workers cannot keep up with")
+    parser.add_argument('--batch', type = int, default = 1,
+                        help = "up to this many movies per MotionCor2 run (-Serial 1), depending on how fast they arrive")
+    parser.add_argument('--adaptive', action = 'store_true', help = "newest movies first, cheaper processing while a backlog builds up")
+    parser.add_argument('--high-water', type = int, default = 4, help = "backlog at which --adaptive switches to fast processing")
+    parser.add_argument('--ctf-every', type = int, default = 3, help = "CTF is estimated on every Nth movie when far behind")
+    parser.add_argument('--queue', default = None, help = "job queue directory on storage shared by several hosts (see otf_queue.py)")
+    parser.add_argument('--lease-timeout', type = float, default = 60, help = "seconds without a heartbeat before a leased job is queued again")
+    parser.add_argument('--metrics-port', type = int, default = 0, help = "serve stage timings on http://127.0.0.1:PORT/metrics")
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Motion correct and CTF estimate movies for on-the-fly assessment")
+    parser.add_argument('movies', nargs = '*', help = "movies to process (e.g. Name_0001.tif)")
+    parser.add_argument('--watch', action = 'store_true', help = "continuously look for new movies (terminate with Ctrl+C)")
+    parser.add_argument('--pattern', default = '*.tif', help = "glob pattern of movies to look for with --watch")
+    parser.add_argument('--min-size', type = int, default = 0, help = "expected minimum size of a full image (bytes)")
+    parser.add_argument('--worker', action = 'store_true', help = "only process jobs leased from the shared --queue")
+    add_settings_args(parser)
+    args = parser.parse_args()
+
+    settings = settings_from_args(args)
+    if args.worker:
+        if not args.queue:
+            parser.error("--worker requires --queue")
+        ## processing settings are taken from the coordinator of the session
+        settings = otf_queue.load_settings(args.queue, settings)
+    else:
+        init_output_dirs(settings)
+        init_logfile(settings)
+
+    processor, metrics = processor_from_args(settings, args)
+    for movie in args.movies:
+        if not is_processed(movie, settings):
+            processor.submit(movie)
+    try:
+        if args.watch:
+            watch_directory(processor, args.pattern, args.min_size)
+        processor.join()
+        print(metrics.summary())
+    except KeyboardInterrupt:
+        print("\nScript terminated by user.")
+        sys.exit()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to give early CTF feedback while (or instead of) waiting for CTFFIND4.
+
+""" Fast in-process power spectrum and rough defocus estimate of a motion corrected micrograph.
+    The micrograph is read through a memory map and cut into boxes (default 512 px, as given to CTFFIND4 in
+    'proc_loop.sh'), whose periodograms are averaged into one power spectrum. Its radial average is compared against
+    the CTF of every defocus in the CTFFIND4 search range (10000 - 40000 A, step 150), in the 30 - 5 A band.
+    Astigmatism is ignored, so this is a rough estimate for early feedback; it also writes a diagnostic .GIF
+    (left: measured power spectrum, right: fitted CTF^2 rings), so there is something to look at right away.
+        $ otf_powerspec.py on-the-fly_processing/Name_Corr_0001.mrc --angpix 1.24 --kV 300 --gif Name_Corr_0001_PS.gif
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+import otf_imageio
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def electron_wavelength(kV):
+    """ Relativistic electron wavelength in Angstroms
+    """
+    volts = kV * 1000.0
+    return 12.2643247 / np.sqrt(volts * (1 + 0.978466e-6 * volts))
+
+def box_positions(length, box, max_boxes):
+    """ Evenly spaced, non-overlapping box start positions along one axis
+    """
+    n_boxes = max(1, min(length // box, max_boxes))
+    return np.linspace(0, length - box, n_boxes).astype(int)
+
+def averaged_power_spectrum(image, box = 512, max_boxes = 4, batch = 8):
+    """ Average the periodograms of up to max_boxes x max_boxes boxes of the image, each with its mean removed and
+        tapered with a Hann window. Returns the half-plane power spectrum of shape (box, box // 2 + 1), unshifted.
+    """
+    window = np.outer(np.hanning(box), np.hanning(box)).astype(np.float32)
+    positions = [(y, x) for y in box_positions(image.shape[0], box, max_boxes) for x in box_positions(image.shape[1], box, max_boxes)]
+    power = np.zeros((box, box // 2 + 1), dtype = np.float64)
+    for i in range(0, len(positions), batch):
+        tiles = np.stack([np.asarray(image[y:y + box, x:x + box], dtype = np.float32) for y, x in positions[i:i + batch]])
+        tiles -= tiles.mean(axis = (1, 2), keepdims = True)
+        tiles *= window
+        power += (np.abs(np.fft.rfft2(tiles)) ** 2).sum(axis = 0)
+    return power / len(positions)
+
+def full_spectrum(power):
+    """ Expand a half-plane power spectrum into a centred full spectrum of shape (box, box) for display
+    """
+    box = power.shape[0]
+    shifted = np.fft.fftshift(power, axes = 0)
+    right = shifted[:, :box // 2]
+    rows = (-np.arange(box)) % box
+    left = shifted[rows][:, box // 2:0:-1]
+    return np.hstack((left, right))
+
+def radial_average(power):
+    """ Radial average of a half-plane power spectrum, indexed by radius in Fourier pixels (0 .. box // 2)
+    """
+    box = power.shape[0]
+    ky = np.fft.fftfreq(box) * box
+    kx = np.arange(power.shape[1])
+    radius = np.rint(np.sqrt(ky[:, None] ** 2 + kx[None, :] ** 2)).astype(np.intp)
+    inside = radius <= box // 2
+    sums = np.bincount(radius[inside], weights = power[inside], minlength = box // 2 + 1)
+    counts = np.bincount(radius[inside], minlength = box // 2 + 1)
+    return sums / np.maximum(counts, 1)
+
+def subtract_background(profile, width = 9):
+    """ Flatten a radial profile by subtracting a running mean of its logarithm, leaving the Thon ring oscillations
+    """
+    log_profile = np.log(np.maximum(profile, 1e-30))
+    kernel = np.ones(width) / width
+    padded = np.pad(log_profile, width // 2, mode = 'edge')
+    return log_profile - np.convolve(padded, kernel, mode = 'valid')
+
+def ctf_squared(s, defocus, kV, cs, amp_contrast):
+    """ CTF^2 for spatial frequencies 's' (1/A) and one or more defoci (A, underfocus positive), broadcasting
+    """
+    wavelength = electron_wavelength(kV)
+    chi = np.pi * wavelength * defocus * s ** 2 - 0.5 * np.pi * cs * 1e7 * wavelength ** 3 * s ** 4
+    return np.sin(chi + np.arcsin(amp_contrast)) ** 2
+
+def fit_defocus(profile, angpix, box, kV, cs = 2.0, amp_contrast = 0.07, min_res = 30.0, max_res = 5.0,
+                min_dz = 10000.0, max_dz = 40000.0, dz_step = 150.0):
+    """ Compare the flattened radial profile with CTF^2 of every defocus in the search range (all at once, as one
+        matrix), returns (best defocus in A, correlation score, fit resolution in A)
+    """
+    radius = np.arange(profile.size)
+    s = radius / (box * angpix)
+    band = (s >= 1.0 / min_res) & (s <= 1.0 / max_res)
+    data = subtract_background(profile)[band]
+    data = (data - data.mean()) / (data.std() + 1e-12)
+    defoci = np.arange(min_dz, max_dz + dz_step / 2, dz_step)
+    models = ctf_squared(s[band][None, :], defoci[:, None], kV, cs, amp_contrast)
+    models -= models.mean(axis = 1, keepdims = True)
+    models /= models.std(axis = 1, keepdims = True) + 1e-12
+    scores = models @ data / data.size
+    best = int(np.argmax(scores))
+    ## fit resolution: the highest frequency up to which the data keeps following the best model, checked in windows
+    ## of at least one Thon ring period at their frequency (at low defocus the first rings are far wider than a fixed
+    ## fraction of the band) and stopping at the second window in a row that no longer agrees
+    s_band = s[band]
+    wavelength = electron_wavelength(kV)
+    dchi = 2 * np.pi * wavelength * np.abs(defoci[best] * s_band - cs * 1e7 * wavelength ** 2 * s_band ** 3)
+    ring_period = np.pi / np.maximum(dchi, 1e-12) * box * angpix
+    fit_res = min_res
+    failures = 0
+    start = 0
+    while start < data.size:
+        window = int(max(5, np.ceil(ring_period[start])))
+        if start + window > data.size:
+            break
+        local = np.corrcoef(data[start:start + window], models[best, start:start + window])[0, 1]
+        if local > 0.2:
+            failures = 0
+            fit_res = 1.0 / s_band[start + window - 1]
+        else:
+            failures += 1
+            if failures == 2:
+                break
+        start += max(1, window // 2)
+    return float(defoci[best]), float(scores[best]), float(fit_res)
+
+def diagnostic_image(power, defocus, angpix, kV, cs, amp_contrast, min_res):
+    """ Diagnostic image as in CTFFIND4: the measured power spectrum on the left, the fitted CTF^2 on the right
+    """
+    box = power.shape[0]
+    spectrum = np.log(np.maximum(full_spectrum(power), 1e-30))
+    ky = (np.arange(box) - box // 2)[:, None]
+    kx = (np.arange(box) - box // 2)[None, :]
+    s = np.sqrt(ky ** 2 + kx ** 2) / (box * angpix)
+    centre = s < 1.0 / min_res
+    spectrum[centre] = np.median(spectrum[~centre])
+    display = otf_imageio.to_uint8(spectrum, 2, 99.5, levels = otf_imageio.GIF_LEVELS)
+    model = ctf_squared(s, defocus, kV, cs, amp_contrast)
+    model_display = (model * (otf_imageio.GIF_LEVELS - 1)).astype(np.uint8)
+    display[:, box // 2:] = model_display[:, box // 2:]
+    return display
+
+def quick_ctf(mrc, angpix, kV, cs = 2.0, amp_contrast = 0.07, box = 512, min_res = 30.0, max_res = 5.0,
+              min_dz = 10000.0, max_dz = 40000.0, dz_step = 150.0, gif = None, diagnostic = False):
+    """ Estimate the defocus of a micrograph from its averaged power spectrum, optionally writing the diagnostic .GIF.
+        Returns a dictionary with 'dZ' (um, as written in the log file), 'defocus' (A), 'score', 'fit_res' (A) and
+        'seconds', and with diagnostic = True also the diagnostic image itself ('diagnostic', uint8)
+    """
+    start_time = time.time()
+    image = otf_imageio.mrc_memmap(mrc)
+    if image.ndim == 3:
+        image = image[0]
+    box = min(box, image.shape[0], image.shape[1]) // 2 * 2
+    power = averaged_power_spectrum(image, box)
+    profile = radial_average(power)
+    defocus, score, fit_res = fit_defocus(profile, angpix, box, kV, cs, amp_contrast, min_res, max_res, min_dz, max_dz, dz_step)
+    result = { 'dZ' : defocus / 10000, 'defocus' : defocus, 'score' : score, 'fit_res' : fit_res }
+    if gif is not None or diagnostic:
+        image = diagnostic_image(power, defocus, angpix, kV, cs, amp_contrast, min_res)
+        if gif is not None:
+            otf_imageio.write_gif(gif, image)
+        if diagnostic:
+            result['diagnostic'] = image
+    result['seconds'] = time.time() - start_time
+    return result
+
+def quick_ctf_from_settings(mrc, settings, gif = None, diagnostic = False):
+    """ Run quick_ctf() with the CTFFIND4 parameters of an 'otf_pipeline.py' settings dictionary
+    """
+    angpix = settings['pix_size'] * settings['ft_bin']
+    return quick_ctf(mrc, angpix, settings['kV'], settings['cs'], settings['amp_contrast'], settings['ctf_box'],
+                     settings['ctf_min_res'], settings['ctf_max_res'], settings['ctf_min_dz'], settings['ctf_max_dz'],
+                     settings['ctf_dz_step'], gif = gif, diagnostic = diagnostic)
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Quick power spectrum based defocus estimate of motion corrected micrographs")
+    parser.add_argument('micrographs', nargs = '+', help = ".MRC micrographs")
+    parser.add_argument('--angpix', type = float, default = 1.24, help = "pixel size of the micrographs (A/pix)")
+    parser.add_argument('--kV', type = float, default = 300)
+    parser.add_argument('--cs', type = float, default = 2.0)
+    parser.add_argument('--amp-contrast', type = float, default = 0.07)
+    parser.add_argument('--box', type = int, default = 512)
+    parser.add_argument('--gif', default = None, help = "diagnostic .GIF (only with a single micrograph)")
+    args = parser.parse_args()
+
+    for mrc in args.micrographs:
+        result = quick_ctf(mrc, args.angpix, args.kV, args.cs, args.amp_contrast, args.box,
+                           gif = args.gif if len(args.micrographs) == 1 else None)
+        print("%-40s -%0.2f um defocus, fit to ~%0.1f A (score %0.2f, %0.0f ms)" % (
+              os.path.basename(mrc), result['dZ'], result['fit_res'], result['score'], 1000 * result['seconds']))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so 'GIF_particle_boxer_v1.py' can zoom into the full resolution .MRC instead of the compressed .GIF.
+
+""" Multi-resolution tile pyramid of an .MRC micrograph for display. Level L shows the micrograph binned by 2^L and
+    is cut into square tiles (default 256 px), numbered (tx, ty) from the .MRC origin (x = 0, y = 0 at the bottom
+    left). Tiles are made on demand from a memory map of the .MRC, so only the parts of the micrograph that are looked
+    at are read, and all levels share one contrast (taken from a sparse sample of the whole micrograph):
+        pyramid = otf_pyramid.TilePyramid('Name_Corr_0001.mrc')
+        for tx, ty in pyramid.visible_tiles(2, x0, y0, x1, y1): pyramid.tile_gif(2, tx, ty) ...
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+import numpy as np
+
+import otf_imageio
+
+TILE_SIZE = 256
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+class TilePyramid:
+    def __init__(self, path, tile_size = TILE_SIZE):
+        self.path = path
+        self.tile_size = tile_size
+        header = otf_imageio.read_mrc_header(path)
+        self.image = otf_imageio.mrc_memmap(path, header)
+        if self.image.ndim == 3:
+            self.image = self.image[0]
+        self.ny, self.nx = self.image.shape
+        self.angpix = header['angpix']
+        ## display contrast of the whole micrograph, from every 8th pixel of every 8th row
+        sample = np.asarray(self.image[::8, ::8], dtype = np.float32)
+        self.low, self.high = np.percentile(sample, (0.5, 99.5))
+        if self.high <= self.low:
+            self.high = self.low + 1
+
+    def n_levels(self):
+        """ Number of levels, the last one fits into a single tile
+        """
+        levels = 1
+        while max(self.nx, self.ny) > self.tile_size * 2 ** (levels - 1):
+            levels += 1
+        return levels
+
+    def tile_span(self, level):
+        """ Width of a tile of this level in .MRC pixels
+        """
+        return self.tile_size * 2 ** level
+
+    def visible_tiles(self, level, x0, y0, x1, y1):
+        """ Tiles (tx, ty) of a level that overlap the .MRC region x0 <= x < x1, y0 <= y < y1
+        """
+        span = self.tile_span(level)
+        tx0, tx1 = max(0, int(x0 // span)), min(int(np.ceil(self.nx / span)), int(np.ceil(x1 / span)))
+        ty0, ty1 = max(0, int(y0 // span)), min(int(np.ceil(self.ny / span)), int(np.ceil(y1 / span)))
+        return [(tx, ty) for ty in range(ty0, ty1) for tx in range(tx0, tx1)]
+
+    def tile_bounds(self, level, tx, ty):
+        """ .MRC region (x0, y0, x1, y1) covered by a tile (edge tiles are cut at the border of the micrograph)
+        """
+        span = self.tile_span(level)
+        return tx * span, ty * span, min((tx + 1) * span, self.nx), min((ty + 1) * span, self.ny)
+
+    def tile(self, level, tx, ty):
+        """ Tile as a uint8 array of 0 .. GIF_LEVELS-1, in display orientation (row 0 is the top, highest .MRC y)
+        """
+        x0, y0, x1, y1 = self.tile_bounds(level, tx, ty)
+        factor = 2 ** level
+        ## round the region up to whole bins, the last bin of an edge tile may be cut short
+        region = np.asarray(self.image[y0:y1, x0:x1], dtype = np.float32)
+        pad_y, pad_x = -region.shape[0] % factor, -region.shape[1] % factor
+        if pad_y or pad_x:
+            region = np.pad(region, ((0, pad_y), (0, pad_x)), mode = 'edge')
+        binned = otf_imageio.bin_image(region, factor)
+        scaled = (binned - self.low) * ((otf_imageio.GIF_LEVELS - 1) / (self.high - self.low))
+        return np.clip(scaled, 0, otf_imageio.GIF_LEVELS - 1).astype(np.uint8)[::-1]
+
+    def tile_gif(self, level, tx, ty):
+        """ Tile encoded as a .GIF, e.g. for Tk's PhotoImage(data = ...)
+        """
+        return otf_imageio.gif_bytes(self.tile(level, tx, ty))
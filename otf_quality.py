@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to get cheap quality signals (ice thickness, drift, empty images) for every micrograph.
+
+""" Per-micrograph quality metrics, computed in the same pass that renders the preview .GIF with NumPy (in place of
+    e2proc2d.py + convert, same 3x mean shrink, Gaussian low-pass at 0.2 and 70% resize): the corrected .MRC is read
+    once, in blocks of rows through a memory map, and each block is both shrunk for display and added to the statistics:
+        mean, std   = mean and standard deviation of the micrograph (the mean follows the ice thickness)
+        p1, p50, p99 = percentiles of the shrunk micrograph
+        hf          = fraction of the variance above 1/6 of the sampling frequency (within each 3 x 3 bin), drops for
+                      blurred, charging or featureless images
+        drift       = total drift in A, from the .MRC header when corrected by 'otf_motioncorr.py' (with MotionCor2,
+                      'otf_pipeline.py' adds it from the alignment log)
+    'otf_pipeline.py --quality-metrics' writes them as key=value columns in the log file, shown by the logviewer, and
+    flags micrographs beyond the limits given with --min-mean, --max-mean, --min-hf or --max-drift. From the command line:
+        $ otf_quality.py on-the-fly_processing/*.mrc
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+import otf_imageio
+import otf_motioncorr
+
+## the display processing of render_micrograph_gif() in 'otf_pipeline.py'
+SHRINK = 3
+LOWPASS = 0.2
+RESIZE = 0.7
+
+## rows of the .MRC read at once (a multiple of SHRINK)
+BLOCK_ROWS = 3 * 256
+
+## columns written to the log file, in this order, with their format
+METRICS = (('mean', '%0.4g'), ('std', '%0.4g'), ('p1', '%0.4g'), ('p50', '%0.4g'), ('p99', '%0.4g'), ('hf', '%0.3f'), ('drift', '%0.1f'))
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def shrink_with_metrics(mrc):
+    """ Read an .MRC in blocks of rows, returns (the image mean shrunk by SHRINK, metrics dictionary). Edge rows and
+        columns that do not fill a whole bin are left out of both, as in otf_imageio.bin_image()
+    """
+    image = otf_imageio.mrc_memmap(mrc)
+    if image.ndim == 3:
+        image = image[0]
+    ny, nx = image.shape[0] // SHRINK * SHRINK, image.shape[1] // SHRINK * SHRINK
+    if ny == 0 or nx == 0:
+        raise ValueError("%s is smaller than %s x %s pixels" % (mrc, SHRINK, SHRINK))
+    shrunk = np.empty((ny // SHRINK, nx // SHRINK), dtype = np.float32)
+    total, total_sq, binned_sq = 0.0, 0.0, 0.0
+    for y0 in range(0, ny, BLOCK_ROWS):
+        block = np.asarray(image[y0:min(y0 + BLOCK_ROWS, ny), :nx], dtype = np.float32)
+        binned = block.reshape(block.shape[0] // SHRINK, SHRINK, nx // SHRINK, SHRINK).mean(axis = (1, 3))
+        shrunk[y0 // SHRINK:y0 // SHRINK + binned.shape[0]] = binned
+        total += float(block.sum(dtype = np.float64))
+        total_sq += float(np.square(block, dtype = np.float64).sum())
+        binned_sq += float(np.square(binned, dtype = np.float64).sum())
+    n_pixels = ny * nx
+    mean = total / n_pixels
+    variance = max(total_sq / n_pixels - mean ** 2, 0.0)
+    ## variance of the pixels around the mean of their bin, i.e. the power above the frequency of the bins
+    within_bins = max(total_sq - SHRINK ** 2 * binned_sq, 0.0) / n_pixels
+    p1, p50, p99 = np.percentile(shrunk, (1, 50, 99))
+    metrics = { 'mean' : mean, 'std' : variance ** 0.5, 'p1' : float(p1), 'p50' : float(p50), 'p99' : float(p99),
+                'hf' : within_bins / variance if variance > 0 else 0.0 }
+    drift = otf_motioncorr.read_drift(mrc)
+    if drift is not None:
+        metrics['drift'] = drift
+    return shrunk, metrics
+
+def micrograph_display(mrc):
+    """ The preview image of a corrected micrograph (as written to its .GIF) and its quality metrics, reading the .MRC
+        once. Returns (image, metrics)
+    """
+    shrunk, metrics = shrink_with_metrics(mrc)
+    display = otf_imageio.gaussian_lowpass(shrunk, LOWPASS)
+    display = otf_imageio.resize_nearest(display, (max(1, int(display.shape[0] * RESIZE)), max(1, int(display.shape[1] * RESIZE))))
+    ## .MRC y = 0 is at the bottom of the .GIF, as written by e2proc2d.py
+    return display[::-1], metrics
+
+def render_micrograph(mrc, gif):
+    """ Write the preview .GIF of a corrected micrograph and return its quality metrics, reading the .MRC once
+    """
+    display, metrics = micrograph_display(mrc)
+    otf_imageio.write_gif(gif, display)
+    return metrics
+
+def format_metrics(metrics):
+    """ Log file columns of a metrics dictionary (e.g. 'mean=21.37 std=4.112 ... hf=0.874')
+    """
+    return ' '.join(key + '=' + fmt % metrics[key] for key, fmt in METRICS if metrics.get(key) is not None)
+
+def parse_metrics(columns):
+    """ Metrics dictionary from the columns of a log file entry (any of the METRICS found as key=value)
+    """
+    keys = set(key for key, fmt in METRICS)
+    metrics = {}
+    for column in columns:
+        key, _, value = column.partition('=')
+        if key in keys and value:
+            try:
+                metrics[key] = float(value)
+            except ValueError:
+                pass
+    return metrics
+
+def quality_warnings(metrics, settings):
+    """ Return the warnings raised by metrics beyond the limits of the settings (each is marked with a '*' in the log
+        file, as the warnings of otf_pipeline.ctf_warnings())
+    """
+    warnings = []
+    if settings['min_mean'] is not None and metrics['mean'] < settings['min_mean']:
+        warnings.append("!!! DARK IMAGE !!!")
+    if settings['max_mean'] is not None and metrics['mean'] > settings['max_mean']:
+        warnings.append("!!! BRIGHT IMAGE !!!")
+    if settings['min_hf'] is not None and metrics['hf'] < settings['min_hf']:
+        warnings.append("!!! LOW HIGH-FREQUENCY POWER !!!")
+    if settings['max_drift'] is not None and metrics.get('drift') is not None and metrics['drift'] > settings['max_drift']:
+        warnings.append("!!! HIGH DRIFT !!!")
+    return warnings
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Quality metrics of motion corrected micrographs")
+    parser.add_argument('micrographs', nargs = '+', help = ".MRC micrographs")
+    parser.add_argument('--gif', action = 'store_true', help = "also write the preview .GIF next to each micrograph")
+    args = parser.parse_args()
+
+    try:
+        for mrc in args.micrographs:
+            if args.gif:
+                metrics = render_micrograph(mrc, os.path.splitext(mrc)[0] + '.gif')
+            else:
+                metrics = shrink_with_metrics(mrc)[1]
+            print("%-40s %s" % (os.path.basename(mrc), format_metrics(metrics)))
+    except BrokenPipeError:
+        ## e.g. piped into 'head'
+        sys.stderr.close()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so that processing workstations sharing the same storage can all work on one collection session.
+
+""" File-based job queue on shared storage, used by 'otf_pipeline.py --queue DIR' in place of the local job queue.
+    One host is the coordinator: it finds new movies (--watch or a list), adds them to the queue, puts jobs of workers
+    that stopped responding back in the queue and writes 'on-the-fly_data.log' (so there is only one writer of the log).
+    Workers on any host that sees the same storage (mounted at the same path) lease jobs from the queue:
+        $ otf_pipeline.py --queue /shared/session/queue --watch --min-size 400000000      (coordinator)
+        $ otf_pipeline.py --queue /shared/session/queue --worker --gpu '0 1'                (each extra workstation)
+    Every job is a small .json file that moves between state directories with atomic renames, so exactly one worker
+    can lease a job and a job is never lost if a worker dies:
+        pending/ -> leased/ -> done/ -> logged/          (or back to pending/, and failed/ after 'max_attempts')
+    A worker touches the files of its leases every 'heartbeat' seconds. A lease not touched for 'lease_timeout'
+    seconds (as seen by the clock of the file server) is expired by the coordinator and the job is queued again.
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import json
+import time
+import socket
+import threading
+
+import otf_metrics
+
+STATES = ('pending', 'leased', 'done', 'logged', 'failed')
+
+## settings that stay local to each host when a worker loads the settings of the session
+LOCAL_SETTINGS = ('gpu', 'motion_engine', 'metrics_log')
+
+## settings holding paths, made absolute so they mean the same on every host
+PATH_SETTINGS = ('out_dir', 'ctf_dir', 'logfile', 'metrics_log', 'gain_ref', 'defects')
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_json(path, data):
+    """ Write a .json file under a temporary name and rename it into place, so it is never read half written
+    """
+    temp_path = os.path.join(os.path.dirname(path), '.%s.%s.%s.part' % (os.path.basename(path), socket.gethostname(), os.getpid()))
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+def save_settings(queue_dir, settings):
+    """ Store the settings of the session in the queue, used by every worker
+    """
+    os.makedirs(queue_dir, exist_ok = True)
+    shared = dict(settings)
+    for key in PATH_SETTINGS:
+        shared[key] = os.path.abspath(shared[key])
+    write_json(os.path.join(queue_dir, 'settings.json'), shared)
+
+def load_settings(queue_dir, settings, timeout = None):
+    """ Return the settings of the session stored by the coordinator, keeping the LOCAL_SETTINGS of this host. Waits
+        for the coordinator to start if needed.
+    """
+    path = os.path.join(queue_dir, 'settings.json')
+    start_time = time.time()
+    while not os.path.exists(path):
+        if timeout is not None and time.time() - start_time > timeout:
+            raise IOError("No session settings found in %s, is the coordinator running?" % queue_dir)
+        time.sleep(1.0)
+    shared = read_json(path)
+    shared['patch'] = tuple(shared['patch'])
+    for key in LOCAL_SETTINGS:
+        shared[key] = settings[key]
+    return shared
+
+class LeaseQueue:
+    """ Drop-in replacement for otf_scheduler.JobQueue backed by a queue directory on shared storage (see above).
+        Jobs are processed at full quality, oldest first (overflow workers motion correct on the CPU, see get_batch()).
+        'on_result' is called by the coordinator with the result dictionary of every finished job (see
+        otf_pipeline.process_movie()).
+    """
+    def __init__(self, queue_dir, coordinator = False, on_result = None, lease_timeout = 60.0, heartbeat = None,
+                 poll_interval = 1.0, max_attempts = 3):
+        self.queue_dir = queue_dir
+        self.coordinator = coordinator
+        self.on_result = on_result
+        self.lease_timeout = lease_timeout
+        self.heartbeat = heartbeat if heartbeat is not None else lease_timeout / 6
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.owner = '%s:%s' % (socket.gethostname(), os.getpid())
+        self.level = 0 # quality level, for the same interface as otf_scheduler.JobQueue
+        self.held = {} # job id -> time leased, for the jobs leased by this process
+        self.in_progress = 0
+        self.idle = 0 # workers of this process (other than overflow workers) waiting for a job
+        self.closed = False
+        self.lock = threading.Lock()
+        for state in STATES:
+            os.makedirs(self.state_dir(state), exist_ok = True)
+        if coordinator:
+            ## a new session starts, workers left from the last one (if any) should not stop
+            if os.path.exists(self.finished_marker()):
+                os.remove(self.finished_marker())
+            threading.Thread(target = self.coordinate, daemon = True).start()
+        threading.Thread(target = self.send_heartbeats, daemon = True).start()
+
+    def state_dir(self, state):
+        return os.path.join(self.queue_dir, state)
+
+    def job_path(self, state, job_id):
+        return os.path.join(self.state_dir(state), job_id + '.json')
+
+    def finished_marker(self):
+        return os.path.join(self.queue_dir, 'finished')
+
+    def job_ids(self, state):
+        """ Ids of the jobs in a state directory, oldest first
+        """
+        entries = []
+        for entry in os.scandir(self.state_dir(state)):
+            if entry.name.endswith('.json') and not entry.name.startswith('.'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.name[:-len('.json')]))
+                except FileNotFoundError:
+                    pass # moved to another state by another process since the directory was read
+        entries.sort()
+        return [job_id for mtime, job_id in entries]
+
+    def shared_clock(self):
+        """ Current time according to the file server, so leases are expired correctly even if host clocks differ
+        """
+        probe = os.path.join(self.queue_dir, '.clock_' + socket.gethostname())
+        with open(probe, 'a'):
+            pass
+        os.utime(probe, None)
+        return os.stat(probe).st_mtime
+
+    def put(self, movie, timings = None):
+        """ Add a movie to the queue, unless a job for it exists already (in any state)
+        """
+        job_id = os.path.basename(movie)
+        if any(os.path.exists(self.job_path(state, job_id)) for state in STATES):
+            return False
+        write_json(self.job_path('pending', job_id), { 'id' : job_id, 'movie' : os.path.abspath(movie), 'submit_time' : time.time(),
+                                                       'attempts' : 0, 'history' : [] })
+        return True
+
+    def backlog(self):
+        return len(self.job_ids('pending'))
+
+    def arrival_rate(self):
+        """ Not measured across hosts, batch sizes follow the backlog only (see otf_pipeline.Processor.batch_size())
+        """
+        return 0.0
+
+    def mode(self):
+        return 'full'
+
+    def lease(self, max_jobs):
+        """ Try to lease up to 'max_jobs' pending jobs, returns the list of leased jobs (possibly empty)
+        """
+        jobs = []
+        for job_id in self.job_ids('pending'):
+            if len(jobs) >= max_jobs:
+                break
+            lease_path = self.job_path('leased', job_id)
+            try:
+                ## only one of the workers racing for a job can rename it away from pending/
+                os.rename(self.job_path('pending', job_id), lease_path)
+            except FileNotFoundError:
+                continue
+            try:
+                ## the job keeps the modification time it had in pending/, renew it before it looks like an expired lease
+                os.utime(lease_path, None)
+                ## update the record while it is taken out of leased/, so a lease taken back by the coordinator in the
+                ## meantime is never written again (the job would then be both pending and leased)
+                claimed_path = self.take_back('leased', job_id)
+                if claimed_path is None:
+                    raise FileNotFoundError(lease_path)
+                record = read_json(claimed_path)
+                record['history'].append({ 'owner' : self.owner, 'leased' : time.time() })
+                write_json(claimed_path, record)
+                os.rename(claimed_path, lease_path)
+            except FileNotFoundError:
+                print(" !!! WARNING: lease on %s was taken back before it started, skipped" % job_id)
+                continue
+            with self.lock:
+                self.held[job_id] = time.time()
+            timings = otf_metrics.MicrographTimings(record['movie'])
+            jobs.append({ 'id' : job_id, 'movie' : record['movie'], 'timings' : timings, 'submit_time' : record['submit_time'],
+                          'mode' : 'full', 'ctf' : True, 'catch_up' : False, 'record' : record })
+            if VERBOSE:
+                print("Leased %s" % job_id)
+        return jobs
+
+    def get(self):
+        jobs = self.get_batch(1)
+        return jobs[0] if jobs else None
+
+    def get_batch(self, max_jobs, overflow = False):
+        """ Block until at least one job is leased and return up to 'max_jobs' jobs, or an empty list once the queue is
+            closed (or the coordinator marked the session as finished and nothing is left to do). An 'overflow' worker
+            only leases a job while no other worker of this process is waiting for one
+        """
+        if not overflow:
+            with self.lock:
+                self.idle += 1
+        try:
+            while True:
+                jobs = self.lease(max_jobs) if not overflow or self.idle == 0 else []
+                if jobs:
+                    with self.lock:
+                        self.in_progress += len(jobs)
+                    return jobs
+                if self.closed or (os.path.exists(self.finished_marker()) and not self.job_ids('pending')):
+                    return []
+                time.sleep(self.poll_interval)
+        finally:
+            if not overflow:
+                with self.lock:
+                    self.idle -= 1
+
+    def send_heartbeats(self):
+        while not self.closed:
+            with self.lock:
+                job_ids = list(self.held)
+            for job_id in job_ids:
+                try:
+                    os.utime(self.job_path('leased', job_id), None)
+                except FileNotFoundError:
+                    print(" !!! WARNING: lease on %s was lost (expired), its result will be discarded" % job_id)
+                    with self.lock:
+                        self.held.pop(job_id, None)
+            time.sleep(self.heartbeat)
+
+    def take_back(self, state, job_id):
+        """ Atomically take a job out of a state directory for this process, returns its temporary path or None if
+            another process got to it first
+        """
+        claimed_path = os.path.join(self.state_dir(state), '.%s.%s.claimed' % (job_id, self.owner.replace(':', '_')))
+        try:
+            os.rename(self.job_path(state, job_id), claimed_path)
+        except FileNotFoundError:
+            return None
+        return claimed_path
+
+    def requeue(self, claimed_path, reason):
+        """ Put a job taken back with take_back() into pending/ again, or into failed/ after 'max_attempts'
+        """
+        record = read_json(claimed_path)
+        record['attempts'] += 1
+        record['history'].append({ 'owner' : self.owner, 'released' : time.time(), 'reason' : reason })
+        state = 'failed' if record['attempts'] >= self.max_attempts else 'pending'
+        write_json(self.job_path(state, record['id']), record)
+        os.remove(claimed_path)
+        print(">> %s %s (%s)" % ("Gave up on" if state == 'failed' else "Queued again:", record['id'], reason))
+
+    def task_done(self, job):
+        """ Finish a leased job: its result (job['result'], set by the Processor) is moved to done/ for the coordinator,
+            or the job goes back to the queue if processing failed
+        """
+        with self.lock:
+            self.in_progress -= 1
+            held = self.held.pop(job['id'], None) is not None
+        claimed_path = self.take_back('leased', job['id']) if held else None
+        if claimed_path is None:
+            print(" !!! WARNING: lease on %s expired before it was finished, result discarded" % job['id'])
+            return
+        if job.get('result') is None:
+            self.requeue(claimed_path, 'processing failed on %s' % self.owner)
+            return
+        record = read_json(claimed_path)
+        record['result'] = job['result']
+        record['host'] = socket.gethostname()
+        write_json(self.job_path('done', job['id']), record)
+        os.remove(claimed_path)
+
+    def expire_leases(self):
+        """ Put leased jobs whose worker stopped sending heartbeats back into the queue
+        """
+        now = self.shared_clock()
+        for job_id in self.job_ids('leased'):
+            try:
+                last_heartbeat = os.stat(self.job_path('leased', job_id)).st_mtime
+            except FileNotFoundError:
+                continue
+            if now - last_heartbeat > self.lease_timeout:
+                claimed_path = self.take_back('leased', job_id)
+                if claimed_path is not None:
+                    self.requeue(claimed_path, 'lease expired')
+
+    def collect_results(self):
+        """ Hand the results in done/ to 'on_result' and move them to logged/
+        """
+        for job_id in self.job_ids('done'):
+            claimed_path = self.take_back('done', job_id)
+            if claimed_path is None:
+                continue
+            record = read_json(claimed_path)
+            if self.on_result is not None:
+                self.on_result(record['result'])
+            os.replace(claimed_path, self.job_path('logged', job_id))
+
+    def coordinate(self):
+        while not self.closed:
+            try:
+                self.expire_leases()
+                self.collect_results()
+            except (IOError, ValueError) as e:
+                print(" !!! ERROR: queue coordination failed: %s" % e)
+            time.sleep(self.poll_interval)
+
+    def join(self):
+        """ Coordinator: wait until every queued job has been processed and logged. Worker: wait until the coordinator
+            marks the session as finished.
+        """
+        if self.coordinator:
+            while self.job_ids('pending') or self.job_ids('leased') or self.job_ids('done') or self.in_progress:
+                time.sleep(self.poll_interval)
+            self.collect_results()
+            with open(self.finished_marker(), 'w') as f:
+                f.write("%s\n" % self.owner)
+        else:
+            while not os.path.exists(self.finished_marker()) or self.job_ids('pending') or self.in_progress:
+                time.sleep(self.poll_interval)
+
+    def close(self):
+        self.closed = True
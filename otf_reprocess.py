@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created to rerun a finished session with other parameters without deleting its .GIFs and restarting the
+#             polling loop with new values baked into 'proc_loop.sh'.
+
+""" Non-interactive bulk reprocessing of a finished session, with one parameter set or a sweep over several. Run from
+    the session directory with the settings of the session (the same options as 'otf_pipeline.py') and the parameters
+    to change, each with one or more values (every combination is processed):
+        $ otf_reprocess.py --microscope TF30 --gain-ref SuperRef.mrc --set ctf_max_res=4,5,6 --set ctf_box=512,1024
+    Every combination is written as a new version next to the others, so earlier results are never overwritten:
+        reprocess/v001/on-the-fly_data.log           (open it in the logviewer to compare)
+        reprocess/v001/on-the-fly_processing/        (previews, hard links to the shared intermediates)
+        reprocess/v001/parameters.json               (the parameters changed, all settings and a summary of the results)
+    Work is shared wherever the parameters allow: each movie is motion corrected once for all versions with the same
+    motion correction parameters (a corrected .MRC kept in the retention cache of the session, see otf_cache.py, or
+    kept with --keep-mrc is used instead when its parameters match), and CTF estimation runs once for all versions that
+    only differ in the limits used to flag micrographs. These intermediates are kept under 'reprocess/intermediates', so
+    a later sweep reuses them too. Movies are processed by --workers threads (by default one per CPU), motion correction
+    by one process per GPU given with --gpu.
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import queue
+import shutil
+import hashlib
+import argparse
+import itertools
+import threading
+import concurrent.futures
+
+import otf_cache
+import otf_logmerge
+import otf_metrics
+import otf_pipeline
+
+## settings that describe where the outputs go or how the host runs, not how a micrograph is processed
+FIXED_SETTINGS = ('microscope', 'out_dir', 'ctf_dir', 'logfile', 'metrics_log', 'gpu', 'keep_mrc', 'cache_budget', 'pack_previews')
+
+## settings only used to flag the log file entries, versions differing in these share their results
+CTF_LIMITS = ('max_fit_res', 'max_dz', 'min_dz')
+QUALITY_LIMITS = ('min_mean', 'max_mean', 'min_hf', 'max_drift')
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def parse_value(text, current):
+    """ A --set value, of the type of the current setting (patches are given as e.g. '5x5')
+    """
+    if text.lower() == 'none':
+        return None
+    if isinstance(current, bool):
+        return text.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(current, tuple):
+        return tuple(int(value) for value in text.lower().split('x'))
+    if isinstance(current, int):
+        return int(text)
+    if isinstance(current, float) or current is None:
+        return float(text)
+    return text
+
+def parse_sweep(assignments, settings):
+    """ List of the parameter sets to process, from --set arguments ('KEY=VALUE[,VALUE...]'), one per combination
+    """
+    names, values = [], []
+    for assignment in assignments:
+        key, _, text = assignment.partition('=')
+        key = key.strip().replace('-', '_')
+        if key not in settings or key in FIXED_SETTINGS:
+            raise ValueError("cannot sweep '%s', choose from: %s" % (key, ', '.join(sorted(set(settings) - set(FIXED_SETTINGS)))))
+        names.append(key)
+        values.append([parse_value(value.strip(), settings[key]) for value in text.split(',') if value.strip()])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def format_changes(changes):
+    if not changes:
+        return "(session settings)"
+    return ' '.join("%s=%s" % (key, 'x'.join(map(str, value)) if isinstance(value, tuple) else value) for key, value in changes.items())
+
+def short_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:10]
+
+def motion_dir(settings, out_root):
+    """ Directory of the corrected .MRCs (and micrograph .GIFs) made with the motion correction parameters of 'settings'
+    """
+    key = otf_pipeline.motioncor2_key(settings) + ' ' + settings['corrected_suffix']
+    return os.path.join(out_root, 'intermediates', 'mc_' + short_hash(key))
+
+def group_key(settings):
+    """ The settings the processing of a micrograph depends on: all but the outputs and the limits used for flagging
+        (the CTF limits do matter when CTFFIND only runs on micrographs flagged by the quick estimate)
+    """
+    ignored = FIXED_SETTINGS + QUALITY_LIMITS + (CTF_LIMITS if settings['ctffind'] == 'always' else ())
+    return json.dumps(dict((key, value) for key, value in settings.items() if key not in ignored), sort_keys = True)
+
+def next_version(out_root):
+    versions = [int(name[1:]) for name in os.listdir(out_root) if re.match(r'^v\d+$', name)] if os.path.isdir(out_root) else []
+    return max(versions, default = 0) + 1
+
+def link_file(source, target):
+    """ Hard link a file (copy it if links are not possible, e.g. across file systems), replacing the target
+    """
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+class Reprocessor:
+    """ The versions of one sweep, the processing groups they share and the intermediates reused
+    """
+    def __init__(self, settings, sweep, out_root = 'reprocess', workers = None):
+        self.settings = settings
+        self.out_root = out_root
+        self.workers = workers or os.cpu_count() or 1
+        ## one MotionCor2 process per GPU at any time (the CPU engine uses every core by itself)
+        self.gpus = queue.Queue()
+        for gpu in (settings['gpu'].split() if settings['motion_engine'] == 'motioncor2' else ['0']):
+            self.gpus.put(gpu)
+        ## corrected .MRCs made with the session settings, from its retention caches (one per host) or kept with --keep-mrc
+        self.session_caches = [otf_cache.RetentionCache(index, float('inf'))
+                               for index in sorted(glob.glob(os.path.join(settings['out_dir'], '.retention_cache_*.json')))]
+        self.lock = threading.Lock()
+        self.counts = { 'mrc_session' : 0, 'mrc_reused' : 0, 'mrc_corrected' : 0, 'groups_reused' : 0, 'groups_run' : 0, 'failed' : 0 }
+        self.groups = {}
+        self.versions = []
+        first = next_version(out_root)
+        for number, changes in enumerate(sweep):
+            version_settings = dict(settings, **changes)
+            key = group_key(version_settings)
+            if key not in self.groups:
+                self.groups[key] = self.init_group(version_settings, key)
+            version_dir = os.path.join(out_root, 'v%03d' % (first + number))
+            self.versions.append({ 'dir' : version_dir, 'changes' : changes, 'group' : self.groups[key], 'results' : [],
+                                   'settings' : dict(version_settings,
+                                                     out_dir = os.path.join(version_dir, 'on-the-fly_processing'),
+                                                     ctf_dir = os.path.join(version_dir, 'on-the-fly_processing', 'CTF'),
+                                                     logfile = os.path.join(version_dir, 'on-the-fly_data.log'), cache_budget = None) })
+
+    def init_group(self, settings, key):
+        """ A processing group writes its intermediates under the motion correction directory, and its results to a log
+            file of its own (read back when a later sweep reuses it)
+        """
+        mc_dir = motion_dir(settings, self.out_root)
+        ctf_dir = os.path.join(mc_dir, 'ctf_' + short_hash(key))
+        group_settings = dict(settings, out_dir = mc_dir, ctf_dir = ctf_dir, logfile = os.path.join(ctf_dir, 'on-the-fly_data.log'),
+                              keep_mrc = True, cache_budget = None, pack_previews = False)
+        done = {}
+        if os.path.exists(group_settings['logfile']):
+            for entry in otf_logmerge.LogReader(group_settings['logfile']).entries():
+                done[entry['name']] = entry
+        return { 'settings' : group_settings, 'done' : done }
+
+    def setup(self):
+        for group in self.groups.values():
+            otf_pipeline.init_output_dirs(group['settings'])
+            with open(os.path.join(group['settings']['out_dir'], 'key.txt'), 'w') as f:
+                f.write(otf_pipeline.motioncor2_key(group['settings']) + '\n')
+            with open(os.path.join(group['settings']['ctf_dir'], 'key.json'), 'w') as f:
+                f.write(group_key(group['settings']) + '\n')
+            if not os.path.exists(group['settings']['logfile']):
+                otf_pipeline.init_logfile(group['settings'])
+        for version in self.versions:
+            otf_pipeline.init_output_dirs(version['settings'])
+            ## the paths in the log file header are relative to the log file, as the logviewer reads them
+            otf_pipeline.init_logfile(dict(version['settings'], out_dir = 'on-the-fly_processing', ctf_dir = 'on-the-fly_processing/CTF'))
+            self.write_parameters(version)
+
+    def write_parameters(self, version, summary = None):
+        parameters = { 'changes' : version['changes'], 'settings' : version['settings'], 'created' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'intermediates' : version['group']['settings']['ctf_dir'] }
+        if summary is not None:
+            parameters['summary'] = summary
+        temp_path = os.path.join(version['dir'], '.parameters.json.part')
+        with open(temp_path, 'w') as f:
+            json.dump(parameters, f, indent = 1)
+        os.replace(temp_path, os.path.join(version['dir'], 'parameters.json'))
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def corrected_mrc(self, movie, settings, timings):
+        """ Make sure the corrected .MRC of a movie is in the motion correction directory of 'settings': reuse one made
+            earlier with the same parameters, or motion correct the movie on a free GPU. Returns False if it failed.
+        """
+        paths = otf_pipeline.output_paths(movie, settings)
+        if os.path.exists(paths['mrc']):
+            self.count('mrc_reused')
+            return True
+        key = otf_pipeline.motioncor2_key(settings)
+        for cache in self.session_caches:
+            files = cache.lookup(paths['name'], 'mrc', key)
+            if files:
+                link_file(files[0], paths['mrc'])
+                self.count('mrc_session')
+                return True
+        kept_mrc = otf_pipeline.output_paths(movie, self.settings)['mrc']
+        if key == otf_pipeline.motioncor2_key(self.settings) and os.path.exists(kept_mrc):
+            link_file(kept_mrc, paths['mrc'])
+            self.count('mrc_session')
+            return True
+        ## corrected under a temporary name, so an .MRC in the directory is always complete
+        temp_path = os.path.join(settings['out_dir'], '.' + paths['name'] + '.part.mrc')
+        gpu = self.gpus.get()
+        try:
+            print(">> Sending %s for motion correction." % os.path.basename(movie))
+            with timings.stage('motioncor2'):
+                otf_pipeline.run_motioncor2(movie, temp_path, dict(settings, gpu = gpu))
+        finally:
+            self.gpus.put(gpu)
+        if not os.path.exists(temp_path):
+            print(" !!! ERROR: motion correction did not produce %s, skipping ..." % paths['mrc'])
+            return False
+        os.replace(temp_path, paths['mrc'])
+        self.count('mrc_corrected')
+        return True
+
+    def group_result(self, movie, group, timings):
+        """ Results of a movie in a processing group (fit_res, dZ, metrics), processed now or read from its log file
+        """
+        settings = group['settings']
+        name = otf_pipeline.output_paths(movie, settings)['name']
+        entry = group['done'].get(name)
+        if entry is not None:
+            self.count('groups_reused')
+            metrics = None
+            if settings['quality_metrics']:
+                import otf_quality # optional, requires NumPy
+                metrics = otf_quality.parse_metrics(entry['data'])
+            return { 'fit_res' : float(entry['data'][0]), 'dZ' : float(entry['data'][1].rstrip('*')), 'metrics' : metrics,
+                     'finished' : time.time() }
+        if not self.corrected_mrc(movie, settings, timings):
+            return None
+        result = otf_pipeline.process_corrected(movie, settings, timings)
+        if result is not None:
+            group['done'][name] = result
+            self.count('groups_run')
+        return result
+
+    def process(self, movie):
+        """ Process one movie for every version (run by a worker thread)
+        """
+        timings = otf_metrics.MicrographTimings(movie)
+        results = {}
+        for version in self.versions:
+            group = version['group']
+            if id(group) not in results:
+                try:
+                    results[id(group)] = self.group_result(movie, group, timings)
+                except Exception as e:
+                    print(" !!! ERROR: processing %s failed: %s" % (movie, e))
+                    results[id(group)] = None
+            result = results[id(group)]
+            if result is None:
+                self.count('failed')
+                continue
+            self.write_version(movie, version, result)
+
+    def write_version(self, movie, version, result):
+        """ Link the previews of a movie into a version and write its log file entry, flagged with the limits of the version
+        """
+        settings = version['settings']
+        paths = otf_pipeline.output_paths(movie, settings)
+        group_paths = otf_pipeline.output_paths(movie, version['group']['settings'])
+        for kind in ('gif', 'ctf_gif'):
+            if os.path.exists(group_paths[kind]):
+                link_file(group_paths[kind], paths[kind])
+                otf_pipeline.store_preview(paths[kind], settings)
+        warnings = otf_pipeline.ctf_warnings(result['fit_res'], result['dZ'], settings)
+        if result.get('metrics'):
+            import otf_quality # optional, requires NumPy
+            warnings += otf_quality.quality_warnings(result['metrics'], settings)
+        otf_pipeline.append_line(settings['logfile'], otf_pipeline.format_log_entry(paths['name'] + '.mrc', result['fit_res'], result['dZ'],
+                                                                                    warnings, result['finished'], result.get('metrics')))
+        with self.lock:
+            version['results'].append((result['fit_res'], result['dZ'], len(warnings)))
+
+    def run(self, movies):
+        self.setup()
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for future in [executor.submit(self.process, movie) for movie in movies]:
+                future.result()
+        for version in self.versions:
+            self.write_parameters(version, summarize(version['results']))
+
+def summarize(results):
+    """ Number of micrographs, median CTF fit and defocus, and number flagged, of the results of a version
+    """
+    if not results:
+        return { 'micrographs' : 0 }
+    fits = sorted(result[0] for result in results)
+    defoci = sorted(result[1] for result in results)
+    return { 'micrographs' : len(results), 'median_fit_res' : fits[len(fits) // 2], 'median_dZ' : defoci[len(defoci) // 2],
+             'flagged' : sum(1 for result in results if result[2] > 0) }
+
+def session_movies(pattern, settings, everything = False):
+    """ The movies of the session, by default only those with an entry in its log file (i.e. processed before)
+    """
+    movies = sorted(glob.glob(pattern))
+    if everything or not os.path.exists(settings['logfile']):
+        return movies
+    logged = set(entry['name'] for entry in otf_logmerge.LogReader(settings['logfile']).entries())
+    return [movie for movie in movies if otf_pipeline.corrected_name(movie, settings['corrected_suffix']) in logged]
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Reprocess a finished session with other parameters, as new versions next to the old ones")
+    parser.add_argument('--set', dest = 'sweep', action = 'append', default = [], metavar = 'KEY=VALUE[,VALUE...]',
+                        help = "setting to change (e.g. ctf_max_res=4,5 or patch=5x5,7x7), every combination is processed")
+    parser.add_argument('--pattern', default = '*.tif', help = "glob pattern of the movies of the session")
+    parser.add_argument('--all-movies', action = 'store_true', help = "process every movie found, not only those in the session log file")
+    parser.add_argument('--out', default = 'reprocess', help = "directory of the versions and shared intermediates")
+    parser.add_argument('--dry-run', action = 'store_true', help = "only list the versions that would be made")
+    otf_pipeline.add_settings_args(parser)
+    parser.set_defaults(workers = None)
+    args = parser.parse_args()
+
+    settings = otf_pipeline.settings_from_args(args)
+    try:
+        sweep = parse_sweep(args.sweep, settings)
+    except ValueError as e:
+        parser.error(str(e))
+    movies = session_movies(args.pattern, settings, args.all_movies)
+    if not movies:
+        sys.exit("No movies matching %s%s" % (args.pattern, '' if args.all_movies else " in %s" % settings['logfile']))
+
+    reprocessor = Reprocessor(settings, sweep, args.out, args.workers)
+    print(">> %s movies, %s versions in %s processing groups" % (len(movies), len(reprocessor.versions), len(reprocessor.groups)))
+    for version in reprocessor.versions:
+        print("   %-18s %s" % (version['dir'], format_changes(version['changes'])))
+    if args.dry_run:
+        sys.exit()
+
+    start_time = time.time()
+    try:
+        reprocessor.run(movies)
+    except KeyboardInterrupt:
+        print("\nScript terminated by user.")
+        sys.exit()
+    counts = reprocessor.counts
+    print(">> Done in %0.1f min: %s movies motion corrected, %s corrected .MRCs reused (%s from the session), %s CTF results reused, %s failed" % (
+          (time.time() - start_time) / 60, counts['mrc_corrected'], counts['mrc_reused'] + counts['mrc_session'], counts['mrc_session'],
+          counts['groups_reused'], counts['failed']))
+    print("%-18s %-40s %8s %10s %10s %8s" % ("Version", "Changes", "Images", "Fit (A)", "dZ (um)", "Flagged"))
+    for version in reprocessor.versions:
+        summary = summarize(version['results'])
+        if summary['micrographs']:
+            print("%-18s %-40s %8s %10.1f %10.2f %8s" % (version['dir'], format_changes(version['changes']), summary['micrographs'], summary['median_fit_res'],
+                                                         summary['median_dZ'], summary['flagged']))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so that processing keeps up with collection by trading quality for speed when a backlog builds up.
+
+""" Job queue used by the Processor in 'otf_pipeline.py'.
+    By default movies are processed in the order they were submitted, at full quality. In adaptive mode the queue
+    measures its backlog every time a worker asks for a job and:
+        - hands out the newest movie first, so the operator sees feedback on what is being collected right now
+        - above 'high_water' waiting movies, switches to 'fast' mode (full-frame alignment only, no Patch alignment)
+        - above 2 x 'high_water', switches to 'sampled' mode (fast, and CTF estimation only on every 'ctf_every'th movie)
+        - returns to 'full' mode once the backlog has drained back down to 'low_water'
+    Work skipped in the cheaper modes is remembered and handed out again (at full quality) whenever no new movies are
+    waiting, so the dataset ends up fully processed once collection slows down.
+    Overflow workers (CPU motion correction, see 'otf_pipeline.py --cpu-workers') only get a new movie while every
+    other worker is busy. Their movies are handed out in 'fast' mode (or cheaper) and caught up on later in the same way.
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import time
+import heapq
+import threading
+
+## quality levels, from most to least expensive
+QUALITY_MODES = ('full', 'fast', 'sampled')
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def mode_settings(settings, mode):
+    """ Return the settings to process a movie with in the given quality mode
+    """
+    if mode == 'full':
+        return settings
+    fast_settings = dict(settings)
+    fast_settings['patch'] = (0, 0) # MotionCor2 default, full-frame alignment only
+    return fast_settings
+
+class JobQueue:
+    """ Thread-safe queue of movies for the processing workers. A job is a dictionary with the keys:
+            movie, timings, submit_time, mode ('full', 'fast' or 'sampled'), ctf (run CTF estimation) and catch_up
+    """
+    def __init__(self, adaptive = False, high_water = 4, low_water = 1, ctf_every = 3):
+        self.adaptive = adaptive
+        self.high_water = high_water
+        self.low_water = low_water
+        self.ctf_every = ctf_every
+        self.level = 0 # index into QUALITY_MODES
+        self.sampled_count = 0
+        self.ready = [] # heap of (priority, sequence, job)
+        self.deferred = [] # heap of catch-up jobs, newest first
+        self.sequence = 0
+        self.last_put = None
+        self.put_interval = None # running average of the time between movies, see arrival_rate()
+        self.in_progress = 0
+        self.idle = 0 # workers (other than overflow workers) waiting for a job
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, movie, timings):
+        with self.condition:
+            now = time.time()
+            if self.last_put is not None:
+                interval = max(now - self.last_put, 0.001)
+                self.put_interval = interval if self.put_interval is None else 0.7 * self.put_interval + 0.3 * interval
+            self.last_put = now
+            self.sequence += 1
+            job = { 'movie' : movie, 'timings' : timings, 'submit_time' : time.time(), 'mode' : 'full', 'ctf' : True, 'catch_up' : False }
+            ## newest first in adaptive mode, otherwise first in first out
+            priority = -self.sequence if self.adaptive else self.sequence
+            heapq.heappush(self.ready, (priority, self.sequence, job))
+            ## wake every waiting worker, overflow workers go back to waiting if another worker is free
+            self.condition.notify_all()
+
+    def backlog(self):
+        return len(self.ready)
+
+    def arrival_rate(self):
+        """ Movies submitted per second, averaged over the last few movies (0 until two have arrived)
+        """
+        if self.put_interval is None:
+            return 0.0
+        return 1.0 / self.put_interval
+
+    def mode(self):
+        return QUALITY_MODES[self.level]
+
+    def update_level(self):
+        """ Choose the quality level from the current backlog, with hysteresis between 'high_water' and 'low_water'
+        """
+        backlog = len(self.ready)
+        old_level = self.level
+        if backlog >= 2 * self.high_water:
+            self.level = 2
+        elif backlog >= self.high_water:
+            self.level = max(self.level, 1)
+        elif backlog <= self.low_water:
+            self.level = 0
+        if self.level != old_level:
+            print(">> Backlog of %s movies, switching to '%s' processing" % (backlog, QUALITY_MODES[self.level]))
+
+    def get(self):
+        """ Block until a job is available and return it, or None once the queue is closed
+        """
+        jobs = self.get_batch(1)
+        return jobs[0] if jobs else None
+
+    def get_batch(self, max_jobs, overflow = False):
+        """ Block until a job is available and return a list of up to 'max_jobs' jobs (without waiting for more to
+            arrive), or an empty list once the queue is closed. All jobs of a batch have the same quality mode.
+            An 'overflow' worker waits until a new movie is waiting while no other worker is, and never gets catch-up work.
+        """
+        jobs = []
+        with self.condition:
+            if overflow:
+                while not (self.ready and self.idle == 0) and not self.closed:
+                    self.condition.wait()
+            else:
+                self.idle += 1
+                while not self.ready and not self.deferred and not self.closed:
+                    self.condition.wait()
+                self.idle -= 1
+            if self.ready:
+                if self.adaptive:
+                    self.update_level()
+                while self.ready and len(jobs) < max_jobs:
+                    job = heapq.heappop(self.ready)[2]
+                    job['mode'] = QUALITY_MODES[max(self.level, 1)] if overflow else self.mode()
+                    if job['mode'] == 'sampled':
+                        self.sampled_count += 1
+                        job['ctf'] = self.sampled_count % self.ctf_every == 0
+                    jobs.append(job)
+            elif not overflow:
+                while self.deferred and len(jobs) < max_jobs:
+                    jobs.append(heapq.heappop(self.deferred)[2])
+            self.in_progress += len(jobs)
+            if self.ready:
+                ## one less free worker, overflow workers may take what is left
+                self.condition.notify_all()
+            return jobs
+
+    def task_done(self, job):
+        """ Mark a job as finished, remembering any work that was skipped to catch up on later
+        """
+        with self.condition:
+            self.in_progress -= 1
+            if job['mode'] != 'full' and not job['catch_up']:
+                self.sequence += 1
+                catch_up = dict(job, mode = 'full', catch_up = True, submit_time = time.time())
+                ## movies that have no CTF estimate yet need the full processing, others only a better alignment
+                catch_up['ctf'] = not job['ctf']
+                heapq.heappush(self.deferred, (-self.sequence, self.sequence, catch_up))
+            self.condition.notify_all()
+
+    def join(self):
+        """ Wait until every job, including catch-up work, has been processed
+        """
+        with self.condition:
+            while self.ready or self.deferred or self.in_progress:
+                self.condition.wait()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
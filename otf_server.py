@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+# 2026-10-19: Created so the session can be followed from a web browser instead of the logviewer over X forwarding.
+
+""" Small asyncio HTTP server for following a session remotely. Serves, for one 'on-the-fly_data.log':
+        /                        = a page listing the micrographs as they are processed, with their previews
+        /rows?since=N            = log entries N, N+1, ... as JSON (name, CTF fit, dZ, flags and the key=value columns)
+        /events                  = server-sent events, one 'row' event per new log entry (resumes from Last-Event-ID)
+        /log                     = the log file itself, with Range requests (e.g. 'Range: bytes=12000-' for new lines)
+        /gif/NAME.gif            = motion corrected preview (loose file or from 'previews.pack', see otf_packstore.py)
+        /ctf/NAME_CTF.gif        = CTF fit preview
+    The log file is read by a single task (only the new lines, once a second) however many clients are connected,
+    and previews are kept in memory (checked against the file at most once a second), so each image is read from disk
+    once, even when every client asks for a new preview at the same time. Responses carry ETag (and, for files,
+    Last-Modified) headers, so browsers only download what changed. Listens on localhost unless told otherwise:
+        $ otf_server.py on-the-fly_data.log --port 8765
+        $ curl http://127.0.0.1:8765/rows?since=100
+"""
+
+##########################
+### SETUP BLOCK
+##########################
+
+VERBOSE = False
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import collections
+import email.utils
+import http
+import urllib.parse
+
+import otf_logmerge
+import otf_packstore
+
+PORT = 8765
+
+## seconds between checks of the log file for new lines
+POLL_INTERVAL = 1.0
+
+## seconds a cached preview is served without checking its file again
+STAT_TTL = 1.0
+
+## bytes of previews kept in memory
+CACHE_BYTES = 256 * 1024 ** 2
+
+## seconds between comments sent to keep idle event streams open
+KEEPALIVE = 15.0
+
+PREVIEW_NAME = re.compile(r'^[\w.-]+\.gif$')
+
+INDEX_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>%(title)s</title>
+<style>body { font-family: Helvetica, sans-serif; } td { padding: 0 8px; } tr.flagged { color: #c00; }
+img { max-height: 512px; margin-right: 8px; } #rows { height: 300px; overflow-y: scroll; }</style></head>
+<body><h3>%(title)s</h3><div><img id="gif"><img id="ctf"></div><div id="name"></div>
+<div id="rows"><table><tbody id="table"></tbody></table></div>
+<script>
+function show(row) {
+    document.getElementById('gif').src = '/gif/' + row.name + '.gif';
+    document.getElementById('ctf').src = '/ctf/' + row.name + '_CTF.gif';
+    document.getElementById('name').textContent = row.name + '   fit ' + row.fit_res + ' A   dZ -' + row.dZ + ' um';
+}
+function add(row) {
+    var tr = document.createElement('tr');
+    if (row.flags > 0) tr.className = 'flagged';
+    var fields = Object.keys(row.fields).map(function (key) { return key + '=' + row.fields[key]; }).join(' ');
+    [row.index, row.name, row.fit_res, row.dZ, fields].forEach(function (text) {
+        var td = document.createElement('td'); td.textContent = text; tr.appendChild(td); });
+    tr.onclick = function () { show(row); };
+    document.getElementById('table').prepend(tr);
+    show(row);
+}
+var events = new EventSource('/events?since=0');
+events.addEventListener('row', function (event) { add(JSON.parse(event.data)); });
+</script></body></html>
+"""
+
+##########################
+### FUNCTION DEFINITIONS
+##########################
+
+def http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt = True)
+
+def parse_http_date(text):
+    try:
+        return email.utils.parsedate_to_datetime(text).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def parse_index(text):
+    """ A row number given by a client (?since=N, Last-Event-ID), or None if it is not a whole number >= 0
+    """
+    text = text.strip()
+    return int(text) if text.isdigit() else None
+
+def parse_range(header, size):
+    """ (start, end) of a single 'bytes=' range (end inclusive), None if there is no usable range header, or
+        'unsatisfiable'
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip()) if header else None
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        start, end = max(0, size - int(match.group(2))), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+class PreviewCache:
+    """ Least recently used previews, { path : (validator, etag, last modified, data, time checked) }. Thread-safe, its
+        methods are run in the executor of the event loop since they touch the disk
+    """
+    def __init__(self, max_bytes = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, pack_dir):
+        """ (data, etag, last modified) of a preview, or None if it does not exist
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and now - entry[4] < STAT_TTL:
+                self.entries.move_to_end(path)
+                return entry[3], entry[1], entry[2]
+        try:
+            stat = os.stat(path)
+            validator, last_modified = ('file', stat.st_mtime_ns, stat.st_size), stat.st_mtime
+        except FileNotFoundError:
+            store = otf_packstore.open_store(pack_dir)
+            if store is None:
+                return None
+            store.refresh()
+            record = store.records.get(store.key(path))
+            if record is None:
+                return None
+            validator = ('pack',) + record
+            last_modified = entry[2] if entry is not None and entry[0] == validator else now
+        if entry is not None and entry[0] == validator:
+            data = entry[3]
+        elif validator[0] == 'file':
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            data = otf_packstore.read_preview(path, pack_dir)
+            if data is None:
+                return None
+        etag = '"%s-%x-%x"' % validator
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[3])
+            self.entries[path] = (validator, etag, last_modified, data, now)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self.size -= len(self.entries.popitem(last = False)[1][3])
+        return data, etag, last_modified
+
+class Session:
+    """ The log file of a session and its entries so far
+    """
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self.log_dir = os.path.dirname(os.path.abspath(logfile))
+        self.reader = otf_logmerge.LogReader(logfile)
+        self.rows = []
+        self.size = -1
+        self.count = 0 # rows read by read_rows()
+
+    def read_rows(self):
+        """ Read the entries added to the log file since the last call (run in the executor), returns (the new entries
+            as rows, whether the log file was rewritten and the rows so far are gone)
+        """
+        size = os.path.getsize(self.logfile)
+        if size == self.size:
+            return [], False
+        rewritten = size < self.size
+        if rewritten:
+            self.reader = otf_logmerge.LogReader(self.logfile)
+            self.count = 0
+        self.size = size
+        rows = []
+        for entry in self.reader.entries():
+            data = entry['data']
+            rows.append({ 'index' : self.count, 'name' : entry['name'],
+                          'fit_res' : data[0] if len(data) > 0 else None, 'dZ' : data[1].rstrip('*') if len(data) > 1 else None,
+                          'flags' : entry['flags'], 'fields' : entry['fields'] })
+            self.count += 1
+        return rows, rewritten
+
+    def preview_path(self, kind, name):
+        directory = self.reader.img_dir if kind == 'gif' else self.reader.ctf_dir
+        return os.path.join(self.log_dir, directory, name)
+
+    def pack_dir(self):
+        return os.path.join(self.log_dir, self.reader.img_dir)
+
+class PreviewServer:
+    def __init__(self, logfile):
+        self.session = Session(logfile)
+        self.cache = PreviewCache()
+        ## previews being read, { path : future }, so that clients asking for the same new preview at once (as they do
+        ## after each 'row' event) share a single read
+        self.loading = {}
+        ## notified when rows are added, every event stream waits on it
+        self.new_rows = asyncio.Condition()
+        self.title = "On-the-fly session - %s" % self.session.log_dir
+
+    async def follow_log(self):
+        """ Read new log entries once a second and wake up the event streams
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                rows, rewritten = await loop.run_in_executor(None, self.session.read_rows)
+            except OSError as e:
+                print(" !!! WARNING: cannot read %s: %s" % (self.session.logfile, e))
+                rows, rewritten = [], False
+            if rewritten:
+                self.session.rows = []
+            if rows:
+                async with self.new_rows:
+                    self.session.rows.extend(rows)
+                    self.new_rows.notify_all()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def handle(self, reader, writer):
+        """ Serve the requests of one connection (HTTP/1.1 keep-alive)
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                url = urllib.parse.urlsplit(target)
+                query = urllib.parse.parse_qs(url.query)
+                if VERBOSE:
+                    print("%s %s" % (method, target))
+                if method not in ('GET', 'HEAD'):
+                    await self.send(writer, 405, { 'Allow' : 'GET, HEAD' }, b'', method)
+                elif url.path == '/events':
+                    await self.stream_events(writer, headers, query)
+                    break
+                else:
+                    await self.route(writer, method, url.path, headers, query)
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, headers, body, method = 'GET'):
+        status = http.HTTPStatus(status)
+        lines = ["HTTP/1.1 %s %s" % (status.value, status.phrase), "Date: %s" % http_date(time.time())]
+        headers = dict(headers)
+        headers.setdefault('Content-Length', str(len(body)))
+        lines += ["%s: %s" % (key, value) for key, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if method != 'HEAD':
+            writer.write(body)
+        await writer.drain()
+
+    def not_modified(self, headers, etag, last_modified):
+        if 'if-none-match' in headers:
+            return etag in [tag.strip() for tag in headers['if-none-match'].split(',')] or headers['if-none-match'].strip() == '*'
+        since = parse_http_date(headers.get('if-modified-since'))
+        return since is not None and last_modified is not None and int(last_modified) <= since
+
+    async def send_cached(self, writer, method, headers, body, content_type, etag, last_modified, cache_control = 'no-cache'):
+        """ Send a response with validators, or 304 Not Modified if the client has it already. Without a last
+            modified time only the ETag is sent
+        """
+        validators = { 'ETag' : etag, 'Cache-Control' : cache_control }
+        if last_modified is not None:
+            validators['Last-Modified'] = http_date(last_modified)
+        if self.not_modified(headers, etag, last_modified):
+            await self.send(writer, 304, validators, b'', 'HEAD')
+        else:
+            await self.send(writer, 200, dict(validators, **{ 'Content-Type' : content_type }), body, method)
+
+    async def load_preview(self, path):
+        """ Get a preview from the cache, waiting for the read already under way if another request asked for it first
+        """
+        future = self.loading.get(path)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(None, self.cache.get, path, self.session.pack_dir())
+            self.loading[path] = future
+            future.add_done_callback(lambda done: self.loading.pop(path, None))
+        ## shielded, a client hanging up must not cancel the read for the others
+        return await asyncio.shield(future)
+
+    async def route(self, writer, method, path, headers, query):
+        loop = asyncio.get_running_loop()
+        if path == '/':
+            body = (INDEX_PAGE % { 'title' : self.title }).encode()
+            await self.send(writer, 200, { 'Content-Type' : 'text/html; charset=utf-8' }, body, method)
+        elif path == '/rows':
+            rows = self.session.rows
+            since = parse_index(query.get('since', ['0'])[0])
+            if since is None:
+                await self.send(writer, 400, { 'Content-Type' : 'text/plain' }, b'since must be a row number\n', method)
+                return
+            body = json.dumps(rows[since:]).encode()
+            ## rows only change by being added to, their number is a strong validator; no Last-Modified, rows are added
+            ## many times a second and a one second resolution date would answer 304 to a client missing some of them
+            await self.send_cached(writer, method, headers, body, 'application/json', '"rows-%s-%s"' % (since, len(rows)), None)
+        elif path == '/log':
+            await self.send_log(writer, method, headers)
+        elif path.startswith('/gif/') or path.startswith('/ctf/'):
+            kind, name = path[1:4], urllib.parse.unquote(path[5:])
+            if not PREVIEW_NAME.match(name):
+                await self.send(writer, 404, { 'Content-Type' : 'text/plain' }, b'Not found\n', method)
+                return
+            preview = await self.load_preview(self.session.preview_path(kind, name))
+            if preview is None:
+                await self.send(writer, 404, { 'Content-Type' : 'text/plain' }, b'Not found\n', method)
+                return
+            data, etag, last_modified = preview
+            await self.send_cached(writer, method, headers, data, 'image/gif', etag, last_modified)
+        else:
+            await self.send(writer, 404, { 'Content-Type' : 'text/plain' }, b'Not found\n', method)
+
+    async def send_log(self, writer, method, headers):
+        """ The log file, or the byte range asked for (so clients can fetch only the lines added since their last read)
+        """
+        loop = asyncio.get_running_loop()
+        def read(start, length):
+            with open(self.session.logfile, 'rb') as f:
+                f.seek(start)
+                return f.read(length)
+        stat = os.stat(self.session.logfile)
+        etag = '"log-%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+        validators = { 'ETag' : etag, 'Last-Modified' : http_date(stat.st_mtime), 'Accept-Ranges' : 'bytes', 'Cache-Control' : 'no-cache' }
+        byte_range = parse_range(headers.get('range'), stat.st_size)
+        if byte_range is None:
+            if self.not_modified(headers, etag, stat.st_mtime):
+                await self.send(writer, 304, validators, b'', 'HEAD')
+                return
+            body = await loop.run_in_executor(None, read, 0, stat.st_size)
+            await self.send(writer, 200, dict(validators, **{ 'Content-Type' : 'text/plain; charset=utf-8' }), body, method)
+        elif byte_range == 'unsatisfiable':
+            await self.send(writer, 416, dict(validators, **{ 'Content-Range' : 'bytes */%s' % stat.st_size }), b'', method)
+        else:
+            start, end = byte_range
+            body = await loop.run_in_executor(None, read, start, end - start + 1)
+            await self.send(writer, 206, dict(validators, **{ 'Content-Type' : 'text/plain; charset=utf-8',
+                                                               'Content-Range' : 'bytes %s-%s/%s' % (start, start + len(body) - 1, stat.st_size) }), body, method)
+
+    async def stream_events(self, writer, headers, query):
+        """ Server-sent events: the rows after Last-Event-ID (or ?since=N, by default only the rows logged from now on),
+            then every new row as it is logged
+        """
+        if 'last-event-id' in headers:
+            last_event = parse_index(headers['last-event-id'])
+            next_row = last_event + 1 if last_event is not None else None
+        else:
+            next_row = parse_index(query.get('since', [str(len(self.session.rows))])[0])
+        if next_row is None:
+            await self.send(writer, 400, { 'Content-Type' : 'text/plain' }, b'since and Last-Event-ID must be row numbers\n')
+            return
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n')
+        await writer.drain()
+        while True:
+            rows = self.session.rows
+            ## a rewritten log file starts over
+            next_row = min(next_row, len(rows))
+            for row in rows[next_row:]:
+                writer.write(("id: %s\nevent: row\ndata: %s\n\n" % (row['index'], json.dumps(row))).encode())
+            next_row = len(rows)
+            await writer.drain()
+            try:
+                async with self.new_rows:
+                    ## rows may have been added while the last ones were sent
+                    await asyncio.wait_for(self.new_rows.wait_for(lambda: len(self.session.rows) != next_row), KEEPALIVE)
+            except asyncio.TimeoutError:
+                writer.write(b': keep-alive\n\n')
+
+async def serve(logfile, host = '127.0.0.1', port = PORT, ready = None):
+    """ Run the server until cancelled. 'ready' (a threading.Event) is set once it listens, with the port it listens on
+        stored as ready.port (e.g. with port = 0)
+    """
+    server = PreviewServer(logfile)
+    session = server.session
+    session.rows.extend((await asyncio.get_running_loop().run_in_executor(None, session.read_rows))[0])
+    listener = await asyncio.start_server(server.handle, host, port)
+    port = listener.sockets[0].getsockname()[1]
+    print("Serving %s on http://%s:%s/" % (logfile, host, port))
+    if ready is not None:
+        ready.port = port
+        ready.set()
+    async with listener:
+        await asyncio.gather(listener.serve_forever(), server.follow_log())
+
+
+##########################
+### RUN BLOCK
+##########################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Serve the log file and previews of a session over HTTP")
+    parser.add_argument('logfile', nargs = '?', default = 'on-the-fly_data.log', help = "log file of the session")
+    parser.add_argument('--host', default = '127.0.0.1', help = "address to listen on (0.0.0.0 for every interface)")
+    parser.add_argument('--port', type = int, default = PORT, help = "port to listen on")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.logfile):
+        sys.exit("No log file at %s" % args.logfile)
+    try:
+        asyncio.run(serve(args.logfile, args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")